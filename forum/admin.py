@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Section, Category, Thread, Post, PrivateMessage
+from .models import Section, Category, Thread, Post, PrivateMessage, MessageRecipient
 
 @admin.register(Section)
 class SectionAdmin(admin.ModelAdmin):
@@ -19,10 +19,16 @@ class ThreadAdmin(admin.ModelAdmin):
 class PostAdmin(admin.ModelAdmin):
     list_filter = ('thread',)
 
+class MessageRecipientInline(admin.TabularInline):
+    model = MessageRecipient
+    extra = 0
+    raw_id_fields = ('recipient',)
+
 @admin.register(PrivateMessage)
 class PrivateMessageAdmin(admin.ModelAdmin):
-    list_display = ('title', 'sender', 'get_recipients', 'get_content', 'timestamp', 'read')
+    list_display = ('title', 'sender', 'get_recipients', 'get_content', 'timestamp')
     readonly_fields = ('get_content',)
+    inlines = (MessageRecipientInline,)
 
     def get_recipients(self, obj):
         return ", ".join([user.username for user in obj.recipients.all()])
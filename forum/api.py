@@ -0,0 +1,132 @@
+import hashlib
+
+from django.db.models import Count, F, Max, Sum
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from drf_spectacular.utils import extend_schema
+from rest_framework import generics
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import AllowAny
+from .models import Section, Category, Thread, Post
+from .serializers import (
+    CategorySerializer, PostSerializer, SectionSerializer, ThreadDetailSerializer, ThreadListSerializer,
+)
+from .trees import load_post_tree
+
+
+def state_etag(state, request):
+    """
+    ETag of a response built from data summarized by ``state``, for this
+    exact URL; ``None`` (no ETag, so no 304) when the object does not exist.
+    """
+    if state is None:
+        return None
+    return hashlib.md5(f'{state}:{request.get_full_path()}'.encode()).hexdigest()
+
+
+def section_tree_etag(request, *args, **kwargs):
+    # Sections and categories carry no timestamps, but both tables are
+    # small: the ETag covers every row the responses show.
+    rows = Section.objects.order_by('pk', 'categories__pk').values_list(
+        'pk', 'title', 'slug', 'categories__pk', 'categories__title', 'categories__slug',
+    )
+    return state_etag(list(rows), request)
+
+
+def category_etag(request, slug, *args, **kwargs):
+    state = Category.objects.filter(slug=slug).annotate(
+        thread_count=Count('threads'), threads_updated=Max('threads__updated_at'),
+        last_post=Max('threads__last_post_at'), posts=Sum('threads__post_count'),
+    ).values_list('thread_count', 'threads_updated', 'last_post', 'posts').first()
+    return state_etag(state, request)
+
+
+def thread_etag(request, slug, *args, **kwargs):
+    # Toggling a like rewrites only ``likes_count``, not ``updated_at``, so the
+    # counters are summed in too, weighted by id so that a like and an unlike
+    # on different posts do not cancel out.
+    state = Thread.objects.filter(slug=slug).annotate(
+        posts_updated=Max('posts__updated_at'),
+        likes=Sum('posts__likes_count'),
+        likes_checksum=Sum(F('posts__likes_count') * F('posts__id')),
+    ).values_list('updated_at', 'post_count', 'posts_updated', 'likes', 'likes_checksum').first()
+    return state_etag(state, request)
+
+
+# The ETags are computed from the rows' timestamps and counters in a single
+# query, so a conditional request is answered with a 304 without loading or
+# serializing the data. There is no Last-Modified: deletions and like
+# toggles change a response without moving any timestamp.
+
+@method_decorator(condition(etag_func=section_tree_etag), name='get')
+@extend_schema(tags=['forum'])
+class SectionListView(generics.ListAPIView):
+    """Every section with its categories."""
+    serializer_class = SectionSerializer
+    permission_classes = [AllowAny]
+
+    def get_queryset(self):
+        return Section.get_tree()
+
+
+@method_decorator(condition(etag_func=section_tree_etag), name='get')
+@extend_schema(tags=['forum'])
+class CategoryListView(generics.ListAPIView):
+    """Every category, in section order."""
+    serializer_class = CategorySerializer
+    permission_classes = [AllowAny]
+
+    def get_queryset(self):
+        return [category for section in Section.get_tree() for category in section.categories.all()]
+
+
+class ThreadActivityPagination(CursorPagination):
+    ordering = ('-last_post_at', '-id')
+    page_size = 20
+
+
+class PostPagination(CursorPagination):
+    ordering = ('created_at', 'id')
+    page_size = 50
+
+
+@method_decorator(condition(etag_func=category_etag), name='get')
+@extend_schema(tags=['forum'])
+class CategoryThreadListView(generics.ListAPIView):
+    """Threads of a category, most recently active first."""
+    serializer_class = ThreadListSerializer
+    permission_classes = [AllowAny]
+    pagination_class = ThreadActivityPagination
+
+    def get_queryset(self):
+        category = get_object_or_404(Category, slug=self.kwargs['slug'])
+        return category.threads.select_related('author', 'last_post_author').defer('content')
+
+
+@method_decorator(condition(etag_func=thread_etag), name='get')
+@extend_schema(tags=['forum'])
+class ThreadDetailAPIView(generics.RetrieveAPIView):
+    """A thread with its whole post tree, loaded in one query."""
+    serializer_class = ThreadDetailSerializer
+    permission_classes = [AllowAny]
+    queryset = Thread.objects.select_related('category', 'author', 'last_post_author')
+    lookup_field = 'slug'
+
+    def get_object(self):
+        thread = super().get_object()
+        thread.post_tree = load_post_tree(thread)
+        return thread
+
+
+@method_decorator(condition(etag_func=thread_etag), name='get')
+@extend_schema(tags=['forum'])
+class ThreadPostListView(generics.ListAPIView):
+    """Posts of a thread in creation order, flat and cursor-paginated."""
+    serializer_class = PostSerializer
+    permission_classes = [AllowAny]
+    pagination_class = PostPagination
+
+    def get_queryset(self):
+        thread = get_object_or_404(Thread.objects.only('id'), slug=self.kwargs['slug'])
+        return Post.objects.filter(thread=thread).select_related('author')
@@ -0,0 +1,160 @@
+"""
+Native async versions of the forum's read-heavy views, served under ASGI
+(see ``vimiapi.asgi_urls``).
+
+They share their query building with ``forum.views`` and run the queries
+through the async ORM, gathering the independent ones. Django still runs
+each query in its thread-sensitive executor, so the gathered queries of one
+request do not overlap on the database; the win is that a request waiting
+on the database no longer holds a worker thread.
+"""
+import asyncio
+import json
+from itertools import chain
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.db import connection
+from django.shortcuts import aget_object_or_404, render
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from .events import get_broker, thread_channel
+from .models import Category, PrivateMessage, Thread
+from .page_cache import cache_anonymous_page
+from .trees import aload_post_page
+from .views import (
+    INBOX_PAGE_SIZE, ThreadDetailView, category_threads, decrypt_previews, get_page_urls, get_posts_ordering,
+    get_reply_orderings, inbox_querysets, liked_posts_query, thread_max_depth,
+)
+
+
+async def resolve_user(request):
+    """Resolve ``request.user`` without blocking; middleware may already have done it."""
+    user = getattr(request, '_cached_user', None)
+    if user is None:
+        user = await request.auser()
+    request.user = user
+    return user
+
+
+async def unread_count_for(user):
+    return await PrivateMessage.aunread_count_for(user) if user.is_authenticated else 0
+
+
+async def aset(queryset):
+    return {value async for value in queryset}
+
+
+async def apage(queryset, number):
+    """Async ``Paginator.get_page``: the count and the page rows are fetched without blocking."""
+    paginator = Paginator(queryset, INBOX_PAGE_SIZE)
+    paginator.count = await queryset.acount()
+    page = paginator.get_page(number)
+    page.object_list = [obj async for obj in page.object_list]
+    return page
+
+
+@cache_anonymous_page('category')
+async def category_detail(request, slug):
+    category, request.unread_count = await asyncio.gather(
+        aget_object_or_404(Category, slug=slug), unread_count_for(await resolve_user(request)),
+    )
+    threads = [thread async for thread in category_threads(category)]
+    return render(request, 'forum/category_detail.html', {'category': category, 'threads': threads})
+
+
+@csrf_exempt
+@cache_anonymous_page('thread')
+async def thread_detail(request, slug):
+    if request.method not in ('GET', 'HEAD'):
+        # Edits and deletions stay on the sync view.
+        return await sync_to_async(ThreadDetailView.as_view())(request, slug=slug)
+
+    user = await resolve_user(request)
+    thread, request.unread_count = await asyncio.gather(
+        aget_object_or_404(Thread.objects.select_related('category'), slug=slug), unread_count_for(user),
+    )
+    posts_ordering = get_posts_ordering(request)
+    (posts, next_cursor), liked_posts = await asyncio.gather(
+        aload_post_page(
+            thread, posts_ordering, request.GET.get('after'), ThreadDetailView.posts_per_page,
+            get_reply_orderings(request), thread_max_depth(),
+        ),
+        aset(liked_posts_query(user, thread)) if user.is_authenticated else asyncio.sleep(0, set()),
+    )
+    return render(request, 'forum/thread_detail.html', {
+        'thread': thread,
+        'category': thread.category,
+        'posts': posts,
+        'can_edit': user.is_authenticated and user.pk == thread.author_id,
+        'liked_posts': liked_posts,
+        'order_posts_by': posts_ordering.lstrip('-'),
+        'order_posts_direction': 'desc' if posts_ordering.startswith('-') else 'asc',
+        'events_url': reverse('forum:thread_events', kwargs={'slug': thread.slug}),
+        **get_page_urls(request, next_cursor),
+    })
+
+
+@login_required(login_url='/forum/')
+async def inbox(request):
+    user = await resolve_user(request)
+    titles_only = request.GET.get('view') == 'titles'
+    messages_received, messages_sent = inbox_querysets(user, titles_only)
+    received_page, sent_page, request.unread_count = await asyncio.gather(
+        apage(messages_received, request.GET.get('received_page')),
+        apage(messages_sent, request.GET.get('sent_page')),
+        unread_count_for(user),
+    )
+    if not titles_only:
+        decrypt_previews(chain(received_page, sent_page))
+
+    return render(request, 'forum/inbox.html', {
+        'messages_received': received_page,
+        'messages_sent': sent_page,
+        'titles_only': titles_only,
+    })
+
+
+async def unread_count(request):
+    return JsonResponse({'unread_count': await unread_count_for(await resolve_user(request))})
+
+
+# Seconds between keep-alive comments on idle event streams, so proxies do
+# not close them.
+EVENT_STREAM_KEEPALIVE = 15
+
+
+def release_connection():
+    """Close this thread's database connection, unless a transaction (e.g. a test case's) still needs it."""
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+async def thread_events(request, slug):
+    """
+    Server-Sent Events stream of a thread: new and edited posts and like
+    counts, as JSON ``data`` lines. Readers apply them in place instead of
+    reloading the page.
+    """
+    thread = await aget_object_or_404(Thread.objects.only('id'), slug=slug)
+    # The stream needs no database. Without this, the connection opened for
+    # the lookup would stay open, idle, until the reader disconnects.
+    await sync_to_async(release_connection)()
+
+    async def stream():
+        async with get_broker().subscribe(thread_channel(thread.id)) as queue:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENT_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream.
+    return response
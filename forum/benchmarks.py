@@ -0,0 +1,268 @@
+"""
+Per-view benchmarks: latency percentiles and SQL query counts for every URL
+of ``forum.urls`` and ``users.urls`` (see the ``benchmark_views`` command).
+
+``QUERY_BUDGETS`` holds the most queries each case may run. The counts must
+not grow with the amount of data, so the same budgets hold at every scale;
+a case that exceeds its budget is a regression (typically an N+1) and fails
+the run and the test suite. Lower a budget when a change saves queries.
+"""
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from .models import MessageRecipient, Post, Thread
+from .seeding import SEED_PASSWORD, SeedScale
+
+User = get_user_model()
+
+# Scales are cumulative: each run seeds them in order into the same database.
+SCALES = {
+    'small': SeedScale(users=20, sections=2, categories=3, threads=5, posts=10, messages=30),
+    'medium': SeedScale(users=100, sections=3, categories=4, threads=25, posts=25, messages=300),
+    'large': SeedScale(users=500, sections=4, categories=5, threads=100, posts=40, messages=3000),
+}
+
+
+@dataclass(frozen=True)
+class Case:
+    """
+    One request to benchmark. ``kwargs`` and ``data`` are callables of the
+    fixtures (``data`` also gets the iteration, for requests that must differ
+    each time); ``auth`` is ``None``, ``'session'``, ``'staff_session'``,
+    ``'jwt'`` or ``'staff_jwt'``.
+    """
+    label: str
+    url_name: str
+    kwargs: object = None
+    method: str = 'get'
+    data: object = None
+    auth: str = None
+    content_type: str = None
+    query_string: str = ''
+
+    def url(self, fixtures):
+        url = reverse(self.url_name, kwargs=self.kwargs(fixtures) if self.kwargs else None)
+        return f'{url}?{self.query_string}' if self.query_string else url
+
+
+def thread_slug(fixtures):
+    return {'slug': fixtures.thread.slug}
+
+
+CASES = [
+    Case('forum_main', 'forum:forum_main'),
+    Case('category_detail', 'forum:category_detail', lambda f: {'slug': f.category.slug}),
+    Case('thread_create', 'forum:thread_create', lambda f: {'slug': f.category.slug}, auth='session'),
+    Case('thread_detail', 'forum:thread_detail', thread_slug),
+    Case('thread_detail (logged in)', 'forum:thread_detail', thread_slug, auth='session'),
+    Case('thread_detail (by likes)', 'forum:thread_detail', thread_slug, query_string='order_posts_by=likes_count'),
+    Case('add_post', 'forum:add_post', lambda f: {'thread_slug': f.thread.slug}, method='post',
+         data=lambda f, i: {'content': f'Benchmark reply {i}'}, auth='session'),
+    Case('post_replies', 'forum:post_replies', lambda f: {'thread_slug': f.thread.slug, 'pk': f.post.pk}),
+    Case('search', 'forum:search', query_string='q=paciente'),
+    Case('search_json', 'forum:search_json', query_string='q=paciente'),
+    Case('custom_login', 'forum:custom_login'),
+    Case('custom_login (post)', 'forum:custom_login', method='post',
+         data=lambda f, i: {'username': f.user.email, 'password': SEED_PASSWORD}),
+    Case('custom_logout', 'forum:custom_logout', auth='session'),
+    Case('user_profile', 'forum:user_profile', lambda f: {'username': f.user.username}),
+    Case('inbox', 'forum:inbox', auth='session'),
+    Case('unread_count', 'forum:unread_count', auth='session'),
+    Case('send_message', 'forum:send_message', auth='session'),
+    Case('send_message_with_username', 'forum:send_message_with_username',
+         lambda f: {'username': f.staff.username}, auth='session'),
+    Case('message_detail', 'forum:message_detail', lambda f: {'pk': f.message_id}, auth='session'),
+    Case('like_post', 'forum:like_post', method='post', data=lambda f, i: {'post_id': f.post.pk}, auth='session'),
+    Case('export_dump', 'forum:export_dump', auth='staff_session'),
+    Case('api_sections', 'forum:api_sections'),
+    Case('api_categories', 'forum:api_categories'),
+    Case('api_category_threads', 'forum:api_category_threads', lambda f: {'slug': f.category.slug}),
+    Case('api_thread_detail', 'forum:api_thread_detail', thread_slug),
+    Case('api_thread_posts', 'forum:api_thread_posts', thread_slug),
+    Case('user_registration', 'user_registration', method='post', data=lambda f, i: {
+        'first_name': 'Bench', 'last_name': 'Mark', 'username': f'bench_{uuid.uuid4().hex[:12]}',
+        'email': f'bench_{uuid.uuid4().hex[:12]}@example.com', 'password': 'benchmark-password-1',
+    }),
+    Case('token_obtain_pair', 'token_obtain_pair', method='post',
+         data=lambda f, i: {'email': f.user.email, 'password': SEED_PASSWORD}),
+    Case('token_refresh', 'token_refresh', method='post', data=lambda f, i: {'refresh': f.refresh_token}),
+    Case('user_detail', 'user_detail', auth='jwt'),
+    Case('user_profile_update', 'user_profile_update', method='put', data=lambda f, i: {'city': f'Madrid {i}'},
+         auth='jwt', content_type='application/json'),
+    Case('auth_cache_stats', 'auth_cache_stats', auth='staff_jwt'),
+]
+
+# URLs deliberately left out of the benchmarks, with the reason.
+NOT_BENCHMARKED = {
+    'forum:check_key': 'debugging endpoint',
+}
+
+QUERY_BUDGETS = {
+    'forum_main': 2,
+    'category_detail': 2,
+    'thread_create': 3,
+    'thread_detail': 5,
+    'thread_detail (logged in)': 8,
+    'thread_detail (by likes)': 5,
+    'add_post': 10,
+    'post_replies': 3,
+    'search': 4,
+    'search_json': 2,
+    'custom_login': 0,
+    'custom_login (post)': 9,
+    'custom_logout': 4,
+    'user_profile': 1,
+    'inbox': 7,
+    'unread_count': 2,
+    'send_message': 2,
+    'send_message_with_username': 3,
+    'message_detail': 7,
+    'like_post': 11,
+    'export_dump': 14,
+    'api_sections': 3,
+    'api_categories': 3,
+    'api_category_threads': 3,
+    'api_thread_detail': 3,
+    'api_thread_posts': 3,
+    'user_registration': 1,
+    'token_obtain_pair': 1,
+    'token_refresh': 1,
+    'user_detail': 1,
+    'user_profile_update': 2,
+    'auth_cache_stats': 2,
+}
+
+
+@dataclass
+class Fixtures:
+    """The objects the cases request, picked from the seeded data."""
+    user: object
+    staff: object
+    category: object
+    thread: object
+    post: object
+    message_id: int
+    refresh_token: str = field(init=False)
+
+    def __post_init__(self):
+        self.refresh_token = str(RefreshToken.for_user(self.user))
+
+    @classmethod
+    def pick(cls):
+        """Use the busiest objects: the worst case for views whose cost could grow with the data."""
+        delivery = (
+            MessageRecipient.objects.select_related('recipient')
+            .filter(recipient__is_staff=False).order_by('-recipient__forum_messages', '-id').first()
+        )
+        user = delivery.recipient if delivery else User.objects.filter(is_staff=False).order_by('-forum_messages').first()
+        staff = User.objects.filter(is_staff=True).first()
+        if staff is None:
+            staff = User.objects.create_user(
+                email=f'bench_staff_{uuid.uuid4().hex[:6]}@example.com', username=f'bench_staff_{uuid.uuid4().hex[:6]}',
+                password=SEED_PASSWORD, is_staff=True,
+            )
+        thread = Thread.objects.select_related('category').order_by('-post_count', 'id').first()
+        post = (
+            Post.objects.filter(thread=thread, parent__isnull=True)
+            .annotate(reply_total=Count('replies')).order_by('-reply_total', 'id').first()
+        )
+        return cls(
+            user=user, staff=staff, category=thread.category, thread=thread, post=post, message_id=delivery.message_id if delivery else None,
+        )
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+@dataclass
+class Result:
+    case: Case
+    statuses: Counter
+    queries: int
+    latencies: list
+
+    @property
+    def budget(self):
+        return QUERY_BUDGETS.get(self.case.label)
+
+    @property
+    def failures(self):
+        failures = []
+        errors = sorted(status for status in self.statuses if status >= 400)
+        if errors:
+            failures.append(f'responded {", ".join(map(str, errors))}')
+        if self.budget is None:
+            failures.append(f'has no query budget (ran {self.queries})')
+        elif self.queries > self.budget:
+            failures.append(f'ran {self.queries} queries, budget is {self.budget}')
+        return failures
+
+    def percentiles_ms(self, *fractions):
+        latencies = sorted(self.latencies)
+        return [1000 * percentile(latencies, fraction) for fraction in fractions]
+
+
+def benchmark_host():
+    return next((host for host in settings.ALLOWED_HOSTS if host[:1] not in ('*', '.')), 'localhost')
+
+
+def run_case(case, fixtures, requests=20):
+    """
+    Request ``case`` ``requests`` times and return its ``Result``. Logging in
+    happens outside the measurement and streamed responses are read in full;
+    the query count is the highest seen.
+    """
+    client = Client(HTTP_HOST=benchmark_host(), raise_request_exception=False)
+    headers = {}
+    if case.auth == 'jwt':
+        headers['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(fixtures.user)}'
+    elif case.auth == 'staff_jwt':
+        headers['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(fixtures.staff)}'
+
+    url = case.url(fixtures)
+    statuses = Counter()
+    queries = 0
+    latencies = []
+    for iteration in range(requests):
+        if case.auth == 'session':
+            client.force_login(fixtures.user)
+        elif case.auth == 'staff_session':
+            client.force_login(fixtures.staff)
+        extra = dict(headers)
+        if case.data:
+            extra['data'] = case.data(fixtures, iteration)
+        if case.content_type:
+            extra['content_type'] = case.content_type
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = getattr(client, case.method)(url, **extra)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] += 1
+        queries = max(queries, len(captured))
+    return Result(case, statuses, queries, latencies)
+
+
+def uncovered_url_names():
+    """Named URLs of ``forum.urls`` and ``users.urls`` that no case requests."""
+    from forum.urls import urlpatterns as forum_urlpatterns
+    from users.urls import urlpatterns as users_urlpatterns
+
+    covered = {case.url_name for case in CASES} | set(NOT_BENCHMARKED)
+    names = {f'forum:{pattern.name}' for pattern in forum_urlpatterns} | {pattern.name for pattern in users_urlpatterns}
+    return sorted(names - covered)
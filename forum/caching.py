@@ -0,0 +1,29 @@
+"""
+Cache timeouts for data that is invalidated on write.
+
+Deleting or bumping a key only reaches other worker processes through a
+shared cache backend (Redis, memcached, the database). With a per-process
+local-memory cache, each worker keeps its own copy and never sees the
+invalidations made by the others, so such entries are kept for at most
+``FORUM_LOCAL_CACHE_TIMEOUT`` seconds instead.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def cache_is_shared(alias='default'):
+    """Whether the ``alias`` cache is seen by every process (i.e. is not local memory)."""
+    return not isinstance(caches[alias], LocMemCache)
+
+
+def invalidated_timeout(timeout):
+    """
+    The timeout to use for an entry that writes invalidate: ``timeout``
+    (``None`` for no expiry) with a shared cache, capped at
+    ``FORUM_LOCAL_CACHE_TIMEOUT`` with a per-process one.
+    """
+    if cache_is_shared():
+        return timeout
+    local_timeout = getattr(settings, 'FORUM_LOCAL_CACHE_TIMEOUT', 30)
+    return local_timeout if timeout is None else min(timeout, local_timeout)
@@ -0,0 +1,14 @@
+from .models import PrivateMessage
+
+
+def unread_count(request):
+    """
+    Expose the current user's (cached) unread message count to every template.
+    Async views look it up beforehand and leave it on ``request.unread_count``.
+    """
+    if hasattr(request, 'unread_count'):
+        return {'unread_count': request.unread_count}
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {'unread_count': 0}
+    return {'unread_count': PrivateMessage.unread_count_for(user)}
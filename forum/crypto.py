@@ -0,0 +1,128 @@
+"""
+Message encryption. Deliberately free of Django imports, so process pool
+workers (see the rotate_message_keys command) can use it without setting
+Django up, whatever the multiprocessing start method.
+"""
+import base64
+import functools
+import os
+
+from Crypto.Cipher import AES
+
+PREFIX = 'ENC:'
+# Ciphertexts written before key ids existed ("ENC:<base64>") belong to the
+# key in MESSAGE_ENCRYPTION_KEY, registered under this id.
+LEGACY_KEY_ID = '0'
+
+
+class KeyRing:
+    """
+    Versioned AES keys for private messages.
+
+    New ciphertexts are written as ``ENC:<key id>:<base64(iv + data)>`` with
+    the primary key; any key of the ring can decrypt. Base64 never contains
+    ``:``, so legacy ``ENC:<base64>`` values stay unambiguous.
+    """
+
+    def __init__(self, keys, primary):
+        if primary not in keys:
+            raise ValueError(f"Primary key id {primary!r} is not in the key ring.")
+        self.keys = keys
+        self.primary = primary
+
+    @classmethod
+    def from_environment(cls, environ=os.environ):
+        """
+        Build the ring from ``MESSAGE_ENCRYPTION_KEYS`` (comma separated
+        ``<id>:<hex key>`` pairs, primary first) and the legacy
+        ``MESSAGE_ENCRYPTION_KEY``.
+        """
+        keys = {}
+        primary = None
+        legacy = environ.get('MESSAGE_ENCRYPTION_KEY')
+        if legacy:
+            keys[LEGACY_KEY_ID] = bytes.fromhex(legacy)
+            primary = LEGACY_KEY_ID
+
+        entries = [entry.strip() for entry in environ.get('MESSAGE_ENCRYPTION_KEYS', '').split(',') if entry.strip()]
+        for entry in reversed(entries):
+            key_id, _, key_hex = entry.partition(':')
+            if not key_id.isalnum() or not key_hex:
+                raise ValueError(f"Malformed MESSAGE_ENCRYPTION_KEYS entry for key id {key_id!r}.")
+            keys[key_id] = bytes.fromhex(key_hex)
+            primary = key_id
+
+        if primary is None:
+            raise ValueError("Encryption key not set. Please set the MESSAGE_ENCRYPTION_KEY environment variable.")
+        return cls(keys, primary)
+
+    @staticmethod
+    def key_id_of(token):
+        """Return the key id a stored value was encrypted with (``None`` for plaintext)."""
+        if not token.startswith(PREFIX):
+            return None
+        key_id, separator, _ = token[len(PREFIX):].partition(':')
+        return key_id if separator else LEGACY_KEY_ID
+
+    def encrypt(self, raw):
+        raw = raw.ljust(16 * ((len(raw) + 15) // 16))
+        iv = os.urandom(16)
+        cipher = AES.new(self.keys[self.primary], AES.MODE_CFB, iv)
+        encrypted = iv + cipher.encrypt(raw.encode('utf-8'))
+        return f'{PREFIX}{self.primary}:' + base64.b64encode(encrypted).decode('utf-8')
+
+    def decrypt(self, token, max_chars=None):
+        """
+        Decrypt a stored value. With ``max_chars`` only the ciphertext blocks
+        needed for that many characters are decoded and decrypted. Raises
+        ``ValueError`` for unknown keys or corrupt data.
+        """
+        key_id = self.key_id_of(token)
+        if key_id is None:
+            return token[:max_chars]
+        if key_id not in self.keys:
+            raise ValueError(f"Unknown message encryption key id {key_id!r}.")
+
+        encoded = token.rpartition(':')[2]
+        if max_chars is not None:
+            # CFB decrypts any prefix of the ciphertext on its own: keep the
+            # IV plus up to 4 UTF-8 bytes per character.
+            needed = 16 + 4 * max_chars
+            encoded = encoded[:4 * -(-needed // 3)]
+        encrypted_data = base64.b64decode(encoded)
+        cipher = AES.new(self.keys[key_id], AES.MODE_CFB, encrypted_data[:16])
+        decrypted_bytes = cipher.decrypt(encrypted_data[16:])
+        if max_chars is not None:
+            return decrypted_bytes.decode('utf-8', errors='ignore')[:max_chars].strip()
+        return decrypted_bytes.decode('utf-8').strip()
+
+    def reencrypt(self, token):
+        """Return ``token`` encrypted with the primary key, or ``None`` if it already is."""
+        if self.key_id_of(token) == self.primary:
+            return None
+        return self.encrypt(self.decrypt(token))
+
+
+@functools.lru_cache(maxsize=None)
+def get_key_ring():
+    """Return the process-wide key ring, parsed from the environment once."""
+    return KeyRing.from_environment()
+
+
+def reencrypt_chunk(rows):
+    """
+    Process pool worker: re-encrypt ``(pk, encrypted_content)`` rows with the
+    primary key. Returns ``(updated rows, failed pks)``; rows already on the
+    primary key are left out.
+    """
+    key_ring = get_key_ring()
+    updated, failed = [], []
+    for pk, token in rows:
+        try:
+            new_token = key_ring.reencrypt(token)
+        except (ValueError, UnicodeDecodeError):
+            failed.append(pk)
+            continue
+        if new_token is not None:
+            updated.append((pk, new_token))
+    return updated, failed
@@ -0,0 +1,395 @@
+"""
+JSONL dumps of the forum, for migrations and backups.
+
+A dump holds one JSON object per line with a ``type`` and the source ``id``.
+References to other records use source ids and must point to records
+earlier in the file, except for post parents, which may come in any order:
+
+    {"type": "user", "id": 1, "username": "ana", "email": "ana@example.com", "password": "pbkdf2_sha256$..."}
+    {"type": "section", "id": 1, "title": "General", "slug": "general"}
+    {"type": "category", "id": 1, "section": 1, "title": "Cardiología", "slug": "cardiologia"}
+    {"type": "thread", "id": 1, "category": 1, "author": 1, "title": "...", "slug": "...", "content": "...",
+     "created_at": "2019-05-02T10:00:00+00:00", "updated_at": "..."}
+    {"type": "post", "id": 1, "thread": 1, "author": 1, "parent": null, "content": "...", "created_at": "...", "updated_at": "..."}
+    {"type": "like", "post": 1, "user": 1, "created_at": "..."}
+
+``export_lines`` writes this format from the database and ``import_dump``
+loads it (the ``export_forum`` and ``import_forum`` commands).
+"""
+import json
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+from .models import Category, Post, PostLike, ReplyCycleError, Section, Thread
+
+User = get_user_model()
+
+# Record types in dependency order.
+RECORD_TYPES = ('user', 'section', 'category', 'thread', 'post', 'like')
+
+
+class DumpError(ValueError):
+    def __init__(self, line_number, message):
+        super().__init__(f'Line {line_number}: {message}')
+
+
+def parse_timestamp(value):
+    if not value:
+        return timezone.now()
+    timestamp = parse_datetime(value)
+    if timestamp is None:
+        raise ValueError(f'invalid timestamp {value!r}')
+    return timezone.make_aware(timestamp) if timezone.is_naive(timestamp) else timestamp
+
+
+@contextmanager
+def preserve_timestamps(*models):
+    """
+    Make ``bulk_create`` keep the timestamps set on the objects instead of
+    stamping ``auto_now`` / ``auto_now_add`` fields with the current time.
+    Flips the fields process-wide: only for management commands.
+    """
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+# Columns exported per record type, as ``(key, field)``.
+EXPORT_FIELDS = {
+    'user': [('id', 'id'), ('username', 'username'), ('email', 'email'), ('first_name', 'first_name'),
+             ('last_name', 'last_name'), ('is_active', 'is_active'), ('date_joined', 'date_joined')],
+    'section': [('id', 'id'), ('title', 'title'), ('slug', 'slug')],
+    'category': [('id', 'id'), ('section', 'section_id'), ('title', 'title'), ('slug', 'slug')],
+    'thread': [('id', 'id'), ('category', 'category_id'), ('author', 'author_id'), ('title', 'title'), ('slug', 'slug'),
+               ('content', 'content'), ('created_at', 'created_at'), ('updated_at', 'updated_at')],
+    'post': [('id', 'id'), ('thread', 'thread_id'), ('author', 'author_id'), ('parent', 'parent_id'),
+             ('content', 'content'), ('created_at', 'created_at'), ('updated_at', 'updated_at')],
+    'like': [('post', 'post_id'), ('user', 'user_id'), ('created_at', 'created_at')],
+}
+EXPORT_MODELS = {'user': User, 'section': Section, 'category': Category, 'thread': Thread, 'post': Post, 'like': PostLike}
+
+
+def encode_value(value):
+    return value.isoformat()
+
+
+def export_records(batch_size=2000, passwords=False):
+    """
+    Yield the forum as dump records, table by table, streaming each table
+    with ``iterator()`` (a server-side cursor on PostgreSQL) so memory use
+    does not grow with the data. ``passwords`` adds the users' password
+    hashes.
+
+    Every table is cut at the primary key it had when the export started,
+    read from the last table to the first: whatever a record references
+    existed by then and is part of the dump, even while the forum is in use.
+    """
+    bounds = {
+        record_type: EXPORT_MODELS[record_type].objects.aggregate(bound=Max('pk'))['bound'] or 0
+        for record_type in reversed(RECORD_TYPES)
+    }
+    for record_type in RECORD_TYPES:
+        fields = EXPORT_FIELDS[record_type] + ([('password', 'password')] if passwords and record_type == 'user' else [])
+        rows = (
+            EXPORT_MODELS[record_type].objects.filter(pk__lte=bounds[record_type]).order_by('pk')
+            .values_list(*(field for _, field in fields))
+        )
+        for row in rows.iterator(chunk_size=batch_size):
+            record = {'type': record_type}
+            record.update(zip((key for key, _ in fields), row))
+            yield record
+
+
+def export_lines(batch_size=2000, passwords=False):
+    """``export_records`` as JSONL lines."""
+    for record in export_records(batch_size, passwords):
+        yield json.dumps(record, ensure_ascii=False, default=encode_value) + '\n'
+
+
+def encoded_chunks(lines, size=64 * 1024):
+    """Join the text ``lines`` into UTF-8 chunks of about ``size`` bytes, for fewer, larger writes."""
+    buffer = []
+    buffered = 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_stream(lines, level=6):
+    """The text ``lines`` as a stream of gzip-compressed chunks."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in encoded_chunks(lines):
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def aiterate_in_thread(iterator):
+    """
+    Async iterator over the sync ``iterator``, advanced one item at a time in
+    a thread of its own. Under ASGI, Django reads a sync streaming body
+    whole before sending it; this keeps a dump streaming with flat memory.
+    The thread owns its database connection, closed with the iterator, so
+    its cursors are not touched by other requests.
+    """
+    def close():
+        if hasattr(iterator, 'close'):
+            iterator.close()
+        connection.close()
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='forum-dump')
+    advance = sync_to_async(next, thread_sensitive=False, executor=executor)
+    done = object()
+    try:
+        while (item := await advance(iterator, done)) is not done:
+            yield item
+    finally:
+        await sync_to_async(close, thread_sensitive=False, executor=executor)()
+        executor.shutdown(wait=False)
+
+
+def chunks(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class ForumImporter:
+    """
+    Load a dump with ``bulk_create`` batches: feed records to ``add`` and
+    call ``finish``. Bulk inserts fire no signals and skip ``save()``, so
+    post paths, thread activity, like and message counters and search
+    vectors are recomputed by ``finish`` in set-based passes.
+
+    Source ids are mapped to new primary keys in memory. Users whose email
+    already exists, and sections and categories whose slug already exists,
+    are reused rather than duplicated. Thread slugs are kept when free.
+    """
+
+    def __init__(self, batch_size=2000):
+        self.batch_size = batch_size
+        self.buffers = {record_type: [] for record_type in RECORD_TYPES}
+        self.ids = {record_type: {} for record_type in RECORD_TYPES if record_type != 'like'}
+        self.counts = Counter()
+        self.orphans = []  # (post pk, thread pk, source parent id, line number)
+        self.post_threads = {}  # post pk -> thread pk
+
+    def add(self, record, line_number):
+        record_type = record.get('type')
+        if record_type not in self.buffers:
+            raise DumpError(line_number, f'unknown record type {record_type!r}')
+        buffer = self.buffers[record_type]
+        buffer.append((line_number, record))
+        if len(buffer) >= self.batch_size:
+            self.flush(record_type)
+
+    def flush(self, through='like'):
+        """Insert the buffered records of ``through`` and of every type it may reference."""
+        for record_type in RECORD_TYPES[:RECORD_TYPES.index(through) + 1]:
+            buffer = self.buffers[record_type]
+            if buffer:
+                try:
+                    getattr(self, f'import_{record_type}')(buffer)
+                except (KeyError, TypeError, ValueError) as e:
+                    if isinstance(e, DumpError):
+                        raise
+                    raise DumpError(f'{buffer[0][0]}-{buffer[-1][0]}', f'invalid {record_type} record ({e!r})')
+                self.counts[record_type] += len(buffer)
+                buffer.clear()
+
+    def ref(self, record_type, source_id, line_number):
+        try:
+            return self.ids[record_type][source_id]
+        except KeyError:
+            raise DumpError(line_number, f'unknown {record_type} {source_id!r}') from None
+
+    def import_user(self, buffer):
+        existing = dict(User.objects.filter(email__in=[record['email'] for _, record in buffer]).values_list('email', 'pk'))
+        new = {}
+        for _, record in buffer:
+            if record['email'] not in existing:
+                new.setdefault(record['email'], record)
+        taken = set(User.objects.filter(username__in=[record['username'] for record in new.values()]).values_list('username', flat=True))
+        users = []
+        for record in new.values():
+            username = record['username']
+            if username in taken:
+                username = f'{username}_{record["id"]}'
+            taken.add(username)
+            users.append(User(
+                username=username, email=record['email'],
+                password=record.get('password') or make_password(None),
+                first_name=record.get('first_name', ''), last_name=record.get('last_name', ''),
+                is_active=record.get('is_active', True), date_joined=parse_timestamp(record.get('date_joined')),
+            ))
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        existing.update((user.email, user.pk) for user in users)
+        for _, record in buffer:
+            self.ids['user'][record['id']] = existing[record['email']]
+
+    def import_by_slug(self, record_type, model, buffer, build):
+        for _, record in buffer:
+            record['slug'] = record.get('slug') or slugify(record['title'])
+        existing = dict(model.objects.filter(slug__in=[record['slug'] for _, record in buffer]).values_list('slug', 'pk'))
+        new = {}
+        for line_number, record in buffer:
+            if record['slug'] not in existing and record['slug'] not in new:
+                new[record['slug']] = build(line_number, record)
+        model.objects.bulk_create(new.values(), batch_size=self.batch_size)
+        existing.update((slug, obj.pk) for slug, obj in new.items())
+        for _, record in buffer:
+            self.ids[record_type][record['id']] = existing[record['slug']]
+
+    def import_section(self, buffer):
+        self.import_by_slug('section', Section, buffer, lambda line_number, record: Section(
+            title=record['title'], slug=record['slug'],
+        ))
+
+    def import_category(self, buffer):
+        self.import_by_slug('category', Category, buffer, lambda line_number, record: Category(
+            title=record['title'], slug=record['slug'], section_id=self.ref('section', record['section'], line_number),
+        ))
+
+    def import_thread(self, buffer):
+        threads = [
+            Thread(
+                title=record['title'], slug=record.get('slug') or '', content=record['content'],
+                category_id=self.ref('category', record['category'], line_number),
+                author_id=self.ref('user', record['author'], line_number),
+                created_at=parse_timestamp(record.get('created_at')),
+                updated_at=parse_timestamp(record.get('updated_at') or record.get('created_at')),
+            )
+            for line_number, record in buffer
+        ]
+        # Keep the old slugs (and so the old URLs) unless they are taken.
+        existing = set(Thread.objects.filter(slug__in=[thread.slug for thread in threads if thread.slug]).values_list('slug', flat=True))
+        seen = set()
+        for thread in threads:
+            if thread.slug in existing or thread.slug in seen:
+                thread.slug = ''
+            seen.add(thread.slug)
+        Thread.objects.bulk_create(Thread.assign_unique_slugs(threads), batch_size=self.batch_size)
+        for (_, record), thread in zip(buffer, threads):
+            self.ids['thread'][record['id']] = thread.pk
+
+    def import_post(self, buffer):
+        posts = []
+        pending = []
+        for line_number, record in buffer:
+            thread_id = self.ref('thread', record['thread'], line_number)
+            parent = record.get('parent')
+            if parent is not None and parent == record['id']:
+                raise DumpError(line_number, f'post {parent!r} is its own parent')
+            parent_id = self.ids['post'].get(parent) if parent is not None else None
+            if parent is not None and parent_id is None:
+                pending.append((len(posts), parent, line_number))
+            elif parent_id is not None:
+                self.check_parent_thread(parent_id, thread_id, parent, line_number)
+            posts.append(Post(
+                thread_id=thread_id,
+                author_id=self.ref('user', record['author'], line_number),
+                parent_id=parent_id, content=record['content'],
+                created_at=parse_timestamp(record.get('created_at')),
+                updated_at=parse_timestamp(record.get('updated_at') or record.get('created_at')),
+            ))
+        Post.objects.bulk_create(posts, batch_size=self.batch_size)
+        for (_, record), post in zip(buffer, posts):
+            self.ids['post'][record['id']] = post.pk
+            self.post_threads[post.pk] = post.thread_id
+        self.orphans.extend(
+            (posts[index].pk, posts[index].thread_id, parent, line_number)
+            for index, parent, line_number in pending
+        )
+
+    def check_parent_thread(self, parent_id, thread_id, parent, line_number):
+        if self.post_threads[parent_id] != thread_id:
+            raise DumpError(line_number, f'parent post {parent!r} belongs to another thread')
+
+    def import_like(self, buffer):
+        PostLike.objects.bulk_create([
+            PostLike(
+                post_id=self.ref('post', record['post'], line_number),
+                user_id=self.ref('user', record['user'], line_number),
+                created_at=parse_timestamp(record.get('created_at')),
+            )
+            for line_number, record in buffer
+        ], batch_size=self.batch_size, ignore_conflicts=True)
+
+    def finish(self):
+        """Flush the buffers, link the remaining replies and recompute the denormalized columns."""
+        self.flush()
+        orphan_lines = {}
+        for batch in chunks(self.orphans, self.batch_size):
+            linked = []
+            for pk, thread_id, parent, line_number in batch:
+                parent_id = self.ref('post', parent, line_number)
+                self.check_parent_thread(parent_id, thread_id, parent, line_number)
+                linked.append(Post(pk=pk, parent_id=parent_id))
+                orphan_lines[pk] = line_number
+            Post.objects.bulk_update(linked, ['parent'], batch_size=self.batch_size)
+        self.orphans.clear()
+
+        for thread_pks in chunks(set(self.ids['thread'].values()), self.batch_size):
+            threads = Thread.objects.filter(pk__in=thread_pks)
+            posts = Post.objects.filter(thread__in=thread_pks)
+            try:
+                Post.rebuild_paths(threads, batch_size=self.batch_size)
+            except ReplyCycleError as e:
+                # Replies to earlier posts cannot close a cycle, so every
+                # cycle goes through at least one reply linked above.
+                source_ids = {pk: source_id for source_id, pk in self.ids['post'].items() if pk in e.pks}
+                line_number = min(orphan_lines[pk] for pk in e.pks if pk in orphan_lines)
+                cycle = ', '.join(repr(source_ids[pk]) for pk in e.pks)
+                raise DumpError(line_number, f'posts {cycle} are their own ancestors') from None
+            Post.recount_likes(posts)
+            Thread.recompute_activity(threads)
+            Thread.update_search_vectors(threads)
+            Post.update_search_vectors(posts)
+        User.objects.recount_forum_messages()
+        Section.invalidate_tree()
+        return self.counts
+
+
+def import_dump(lines, batch_size=2000):
+    """
+    Import the JSONL ``lines`` of a dump with a ``ForumImporter`` and return
+    the number of records read per type. Run it in a transaction: a
+    ``DumpError`` can leave part of the dump inserted.
+    """
+    importer = ForumImporter(batch_size)
+    with preserve_timestamps(Thread, Post, PostLike):
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise DumpError(line_number, f'invalid JSON ({e})')
+            importer.add(record, line_number)
+        return importer.finish()
@@ -0,0 +1,88 @@
+"""
+Live thread updates: small JSON events fanned out to the Server-Sent Events
+stream of each thread (``forum.async_views.thread_events``).
+
+Events go through the broker named by ``FORUM_EVENT_BROKER``. The default
+``LocalBroker`` only reaches subscribers in the publishing process; a broker
+shared by every worker (Redis pub/sub, Postgres LISTEN/NOTIFY, ...) can
+replace it by implementing the same ``publish`` / ``subscribe`` pair.
+"""
+import asyncio
+import functools
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+def thread_channel(thread_id):
+    return f'thread:{thread_id}'
+
+
+class LocalBroker:
+    """
+    In-process pub/sub. ``publish`` may be called from any thread; each
+    subscriber gets a bounded queue on its own event loop. A subscriber that
+    falls ``max_queue`` events behind loses the oldest ones and is sent a
+    ``reset`` event so the client can reload.
+    """
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._deliver, queue, event)
+
+    def _deliver(self, queue, event):
+        if queue.full():
+            queue.get_nowait()
+            event = {'type': 'reset'}
+        queue.put_nowait(event)
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        """Async context manager yielding an ``asyncio.Queue`` of the events published on ``channel``."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=self.max_queue))
+        with self._lock:
+            self._subscribers[channel].add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                self._subscribers[channel].discard(subscriber)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+@functools.lru_cache(maxsize=None)
+def get_broker():
+    """Return the process-wide broker configured by ``FORUM_EVENT_BROKER``."""
+    return import_string(getattr(settings, 'FORUM_EVENT_BROKER', 'forum.events.LocalBroker'))()
+
+
+def publish_thread_event(thread_id, event):
+    """Publish ``event`` to the readers of ``thread_id`` once the current transaction commits."""
+    transaction.on_commit(lambda: get_broker().publish(thread_channel(thread_id), event))
+
+
+def post_event(post, event_type):
+    """Event describing ``post`` (``'post'`` when created, ``'post_edited'`` after an edit)."""
+    return {
+        'type': event_type,
+        'id': post.id,
+        'parent': post.parent_id,
+        'depth': post.depth,
+        'author': post.author.username,
+        'content': post.content,
+        'created_at': post.created_at.isoformat(),
+        'updated_at': post.updated_at.isoformat(),
+        'likes_count': post.likes_count,
+    }
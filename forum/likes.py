@@ -0,0 +1,131 @@
+import atexit
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.http import Http404
+from .events import publish_thread_event
+from .models import Post, PostLike, Thread
+from .page_cache import bump_page_versions
+
+
+class LikeCountBuffer:
+    """
+    Accumulates ``likes_count`` deltas per post in memory and applies them in
+    a single UPDATE per batch, then invalidates the cached pages of the
+    threads it touched.
+
+    A batch is written once ``flush_interval`` seconds have passed since the
+    first buffered toggle, or as soon as ``max_pending`` posts have pending
+    deltas. Deltas are additive, so every worker process can keep its own
+    buffer.
+    """
+
+    def __init__(self, flush_interval=5.0, max_pending=500):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._deltas = defaultdict(int)
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, post_id, delta):
+        """Buffer ``delta`` for ``post_id`` and return the post's pending delta."""
+        with self._lock:
+            self._deltas[post_id] += delta
+            pending = self._deltas[post_id]
+            full = len(self._deltas) >= self.max_pending
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+        return pending
+
+    def pending(self, post_id):
+        with self._lock:
+            return self._deltas.get(post_id, 0)
+
+    def flush(self):
+        """Write every pending delta to the database. Returns the number of posts updated."""
+        with self._lock:
+            deltas = {post_id: delta for post_id, delta in self._deltas.items() if delta}
+            self._deltas.clear()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not deltas:
+            return 0
+
+        counter = PositiveIntegerField()
+        try:
+            updated = Post.objects.filter(pk__in=deltas).update(likes_count=Case(
+                *[
+                    When(pk=post_id, then=Greatest(F('likes_count') + delta, Value(0), output_field=counter))
+                    for post_id, delta in deltas.items()
+                ],
+                default=F('likes_count'),
+            ))
+        except Exception:
+            # Keep the deltas for the next flush rather than losing them.
+            with self._lock:
+                for post_id, delta in deltas.items():
+                    self._deltas[post_id] += delta
+            raise
+        slugs = Thread.objects.filter(posts__pk__in=deltas).values_list('slug', flat=True).distinct()
+        bump_page_versions(*[('thread', slug) for slug in slugs])
+        return updated
+
+    def _flush_from_timer(self):
+        close_old_connections()
+        try:
+            self.flush()
+        finally:
+            close_old_connections()
+
+
+like_buffer = LikeCountBuffer(
+    flush_interval=getattr(settings, 'FORUM_LIKE_FLUSH_INTERVAL', 5.0),
+    max_pending=getattr(settings, 'FORUM_LIKE_MAX_PENDING', 500),
+)
+atexit.register(like_buffer.flush)
+
+
+def toggle_like(post_id, user):
+    """
+    Like ``post_id`` for ``user``, or unlike it if they already did, and
+    return ``(liked, likes_count)``. Raises ``Http404`` for unknown posts.
+
+    The ``PostLike`` row is the source of truth. The counter is adjusted in
+    the database without rewriting the post, or, with
+    ``FORUM_COALESCE_LIKES`` enabled, buffered in ``like_buffer``. Readers
+    of the thread are sent a ``likes`` event with the new count.
+    """
+    coalesce = getattr(settings, 'FORUM_COALESCE_LIKES', False)
+    with transaction.atomic():
+        if PostLike.objects.filter(post_id=post_id, user=user).delete()[0]:
+            liked, delta = False, -1
+        else:
+            try:
+                with transaction.atomic():
+                    PostLike.objects.create(post_id=post_id, user=user)
+                liked, delta = True, 1
+            except IntegrityError:
+                liked, delta = True, 0  # A concurrent request already liked it.
+
+        if coalesce or not delta:
+            likes_count = Post.objects.filter(pk=post_id).values_list('likes_count', flat=True).first()
+        else:
+            likes_count = Post.adjust_likes_count(post_id, delta)
+        if likes_count is None:
+            raise Http404('No Post matches the given query.')
+
+    if coalesce and delta:
+        likes_count = max(likes_count + like_buffer.add(post_id, delta), 0)
+    if delta:
+        thread_id = Post.objects.filter(pk=post_id).values_list('thread_id', flat=True).first()
+        publish_thread_event(thread_id, {'type': 'likes', 'id': int(post_id), 'likes_count': likes_count})
+    return liked, likes_count
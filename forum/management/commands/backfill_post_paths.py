@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from forum.models import Post, Thread
+
+
+class Command(BaseCommand):
+    help = 'Compute the materialized path and depth of existing posts. Safe to re-run: unchanged rows are skipped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--thread', action='append', dest='threads', metavar='SLUG',
+                            help='Only rebuild the given thread (may be repeated).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        threads = None
+        if options['threads']:
+            threads = Thread.objects.filter(slug__in=options['threads'])
+        updated = Post.rebuild_paths(threads=threads, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} posts.'))
@@ -0,0 +1,72 @@
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from forum.models import Thread
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the throughput of a forum page served by the sync views through the WSGI handler with '
+        'the async views through the ASGI handler, both in process, with the page cache disabled. '
+        'Results depend heavily on the database: SQLite serializes everything.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--path', help='Page to request (defaults to the most recently active thread).')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            thread = Thread.objects.order_by('-last_post_at').first()
+            if thread is None:
+                raise CommandError('No threads to benchmark; pass --path or run seed_forum first.')
+            path = thread.get_absolute_url()
+        host = next((host for host in settings.ALLOWED_HOSTS if host[:1] not in ('*', '.')), 'localhost')
+        requests, concurrency = options['requests'], options['concurrency']
+        per_worker = [requests // concurrency + (index < requests % concurrency) for index in range(concurrency)]
+
+        with override_settings(FORUM_PAGE_CACHE=False, ROOT_URLCONF='vimiapi.urls'):
+            self.report('WSGI (sync views)', *self.run_wsgi(path, host, per_worker))
+        with override_settings(FORUM_PAGE_CACHE=False, ROOT_URLCONF='vimiapi.asgi_urls'):
+            self.report('ASGI (async views)', *self.run_asgi(path, host, per_worker))
+
+    def run_wsgi(self, path, host, per_worker):
+        def worker(count):
+            client = Client(HTTP_HOST=host)
+            try:
+                return [client.get(path).status_code for _ in range(count)]
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(per_worker)) as pool:
+            statuses = [status for result in pool.map(worker, per_worker) for status in result]
+        return statuses, time.perf_counter() - started
+
+    def run_asgi(self, path, host, per_worker):
+        async def worker(count):
+            client = AsyncClient(HTTP_HOST=host)
+            return [(await client.get(path)).status_code for _ in range(count)]
+
+        async def run():
+            return await asyncio.gather(*(worker(count) for count in per_worker))
+
+        started = time.perf_counter()
+        statuses = [status for result in asyncio.run(run()) for status in result]
+        return statuses, time.perf_counter() - started
+
+    def report(self, label, statuses, elapsed):
+        codes = ', '.join(f'{count}x{status}' for status, count in sorted(Counter(statuses).items()))
+        self.stdout.write(
+            f'{label:>19}: {len(statuses) / elapsed:7.1f} req/s, '
+            f'{1000 * elapsed / max(len(statuses), 1):6.2f} ms/request wall ({codes})'
+        )
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from forum.benchmarks import CASES, SCALES, Fixtures, run_case, uncovered_url_names
+from forum.crypto import get_key_ring
+from forum.seeding import seed_forum
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every forum and users URL at growing data scales in a throwaway test database: '
+        'latency percentiles and SQL query counts per view. Fails when a view runs more queries than '
+        'its budget in forum.benchmarks.QUERY_BUDGETS. The page cache is disabled.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append', choices=list(SCALES),
+                            help='Scale to seed and measure; repeat for several (default: small and medium).')
+        parser.add_argument('--requests', type=int, default=20, help='Requests per view and scale.')
+        parser.add_argument('--case', action='append', help='Only run the cases whose label contains this.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive')
+
+    def handle(self, *args, **options):
+        try:
+            get_key_ring()
+        except ValueError as e:
+            raise CommandError(f'{e} Seeded private messages are encrypted.')
+
+        cases = [case for case in CASES if not options['case'] or any(part in case.label for part in options['case'])]
+        for name in uncovered_url_names():
+            self.stderr.write(f'No benchmark case requests {name}.')
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=not options['interactive'], serialize=False)
+        try:
+            with override_settings(FORUM_PAGE_CACHE=False):
+                failures = self.run_scales(options['scale'] or ['small', 'medium'], cases, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if failures:
+            raise CommandError('Query budgets exceeded or requests failed:\n' + '\n'.join(failures))
+
+    def run_scales(self, scales, cases, options):
+        failures = []
+        for scale_name in scales:
+            started = time.perf_counter()
+            created = seed_forum(SCALES[scale_name], seed=options['seed'])
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'\n{scale_name}: seeded {", ".join(f"{count} {name}" for name, count in created.items())} '
+                f'in {time.perf_counter() - started:.1f}s'
+            ))
+            self.stdout.write(f'{"view":<28} {"queries":>7} {"budget":>6} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8}  status')
+            fixtures = Fixtures.pick()
+            for case in cases:
+                result = run_case(case, fixtures, options['requests'])
+                p50, p90, p99 = result.percentiles_ms(0.5, 0.9, 0.99)
+                statuses = ', '.join(f'{count}x{status}' for status, count in sorted(result.statuses.items()))
+                line = (
+                    f'{case.label:<28} {result.queries:>7} {result.budget if result.budget is not None else "-":>6} '
+                    f'{p50:>8.2f} {p90:>8.2f} {p99:>8.2f}  {statuses}'
+                )
+                self.stdout.write(self.style.ERROR(line) if result.failures else line)
+                failures.extend(f'{scale_name}: {case.label} {failure}' for failure in result.failures)
+        return failures
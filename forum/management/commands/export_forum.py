@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from forum.dumps import encoded_chunks, export_lines, gzip_stream
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the forum (users, sections, categories, threads, posts and likes) as a JSONL dump that '
+        'import_forum can load. Tables are streamed in chunks, so memory use stays flat.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Output file; "-" writes to standard output.')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output (implied by a .gz suffix).')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--with-passwords', action='store_true', help='Include the password hashes, e.g. for backups.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        lines = export_lines(options['batch_size'], passwords=options['with_passwords'])
+        chunks = gzip_stream(lines) if options['gzip'] or path.endswith('.gz') else encoded_chunks(lines)
+
+        output = sys.stdout.buffer if path == '-' else open(path, 'wb')
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if path != '-':
+                output.close()
+        if path != '-':
+            self.stdout.write(self.style.SUCCESS(f'Wrote {path}.'))
@@ -0,0 +1,41 @@
+import gzip
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from forum.dumps import DumpError, import_dump
+
+
+class Command(BaseCommand):
+    help = (
+        'Import a JSONL forum dump (see forum.dumps) with bulk inserts, in a single transaction. '
+        'Counters, post paths and search vectors are recomputed at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Dump file; "-" reads standard input, a .gz suffix is decompressed.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path == '-':
+            lines = sys.stdin
+        elif path.endswith('.gz'):
+            lines = gzip.open(path, 'rt', encoding='utf-8')
+        else:
+            lines = open(path, encoding='utf-8')
+
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                counts = import_dump(lines, batch_size=options['batch_size'])
+        except DumpError as e:
+            raise CommandError(f'{e}. Nothing was imported.')
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+        self.stdout.write(self.style.SUCCESS(
+            'Imported ' + ', '.join(f'{record_type}: {count}' for record_type, count in counts.items())
+            + f' in {time.perf_counter() - started:.1f}s.'
+        ))
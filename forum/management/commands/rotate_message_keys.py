@@ -0,0 +1,89 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from forum.crypto import get_key_ring, reencrypt_chunk
+from forum.models import PrivateMessage
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-encrypt every private message with the primary key of MESSAGE_ENCRYPTION_KEYS. '
+        'Rows are streamed in primary key order, encrypted in a process pool and written back with bulk '
+        'updates; progress is checkpointed so an interrupted run can be resumed with --resume.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--checkpoint', default='rotate_message_keys.checkpoint',
+                            help='File recording the last primary key written.')
+        parser.add_argument('--resume', action='store_true', help='Continue after the checkpointed primary key.')
+
+    def handle(self, *args, **options):
+        key_ring = get_key_ring()
+        checkpoint = options['checkpoint']
+        chunk_size = options['chunk_size']
+
+        last_pk = 0
+        if options['resume']:
+            try:
+                with open(checkpoint) as f:
+                    last_pk = int(f.read().strip() or 0)
+            except FileNotFoundError:
+                raise CommandError(f'No checkpoint found at {checkpoint}.')
+
+        total = PrivateMessage.objects.filter(pk__gt=last_pk).count()
+        self.stdout.write(f'Re-encrypting {total} messages with key {key_ring.primary!r} (after pk {last_pk}).')
+
+        processed = rewritten = failures = 0
+        started = time.monotonic()
+        pending = deque()
+
+        def write(future, chunk_last_pk, chunk_len):
+            nonlocal processed, rewritten, failures
+            updated, failed = future.result()
+            PrivateMessage.objects.bulk_update(
+                [PrivateMessage(pk=pk, encrypted_content=token) for pk, token in updated],
+                ['encrypted_content'], batch_size=chunk_size,
+            )
+            self.write_checkpoint(checkpoint, chunk_last_pk)
+            processed += chunk_len
+            rewritten += len(updated)
+            failures += len(failed)
+            for pk in failed:
+                self.stderr.write(f'Could not decrypt message {pk}; left unchanged.')
+            rate = processed / max(time.monotonic() - started, 1e-9)
+            self.stdout.write(f'{processed}/{total} messages ({rewritten} re-encrypted, {rate:.0f}/s)')
+
+        # Workers only do the AES work; every query runs in this process.
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                rows = list(
+                    PrivateMessage.objects.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('pk', 'encrypted_content')[:chunk_size]
+                )
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+                pending.append((pool.submit(reencrypt_chunk, rows), last_pk, len(rows)))
+                # Keep a bounded number of chunks in flight and write them
+                # back in order, so the checkpoint never skips a chunk.
+                while len(pending) > 2 * options['workers']:
+                    write(*pending.popleft())
+            while pending:
+                write(*pending.popleft())
+
+        message = f'Done: {rewritten} of {processed} messages re-encrypted.'
+        if failures:
+            self.stdout.write(self.style.WARNING(f'{message} {failures} could not be decrypted.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
+
+    def write_checkpoint(self, path, pk):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(pk))
+        os.replace(tmp_path, path)
@@ -0,0 +1,40 @@
+import time
+from dataclasses import fields
+
+from django.core.management.base import BaseCommand, CommandError
+from forum.seeding import SEED_PASSWORD, SeedScale, seed_forum
+
+
+class Command(BaseCommand):
+    help = (
+        'Add a synthetic forum (users, sections, categories, threads, nested posts, likes and private '
+        'messages) to the database with bulk inserts. Run it against a development or scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        defaults = SeedScale()
+        parser.add_argument('--users', type=int, default=defaults.users)
+        parser.add_argument('--sections', type=int, default=defaults.sections)
+        parser.add_argument('--categories', type=int, default=defaults.categories, help='Categories per section.')
+        parser.add_argument('--threads', type=int, default=defaults.threads, help='Threads per category.')
+        parser.add_argument('--posts', type=int, default=defaults.posts, help='Average posts per thread.')
+        parser.add_argument('--max-depth', type=int, default=defaults.max_depth)
+        parser.add_argument('--likes', type=float, default=defaults.likes, help='Average likes per post.')
+        parser.add_argument('--messages', type=int, default=defaults.messages)
+        parser.add_argument('--max-recipients', type=int, default=defaults.max_recipients)
+        parser.add_argument('--seed', type=int, help='Random seed, for a reproducible structure.')
+
+    def handle(self, *args, **options):
+        scale = SeedScale(**{field.name: options[field.name] for field in fields(SeedScale)})
+        if scale.users < 1:
+            raise CommandError('At least one user is needed to write the content.')
+
+        started = time.perf_counter()
+        try:
+            created = seed_forum(scale, seed=options['seed'])
+        except ValueError as e:  # No message encryption key.
+            raise CommandError(str(e))
+        self.stdout.write(
+            ', '.join(f'{count} {name}' for name, count in created.items())
+            + f' created in {time.perf_counter() - started:.1f}s. Seeded users log in with "{SEED_PASSWORD}".'
+        )
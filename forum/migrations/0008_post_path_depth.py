@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+PATH_STEP = 8
+
+
+def encode_path_step(pk):
+    digits = ''
+    while pk:
+        pk, remainder = divmod(pk, 36)
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'[remainder] + digits
+    return digits.rjust(PATH_STEP, '0')
+
+
+def backfill_post_paths(apps, schema_editor, batch_size=1000):
+    """Same walk as ``Post.rebuild_paths``, which historical models do not have."""
+    Post = apps.get_model('forum', 'Post')
+    changed = []
+
+    def rebuild_thread(thread_rows):
+        parents = dict(thread_rows)
+        encoded = {}
+        for pk in parents:
+            chain = []
+            node = pk
+            while node is not None and node not in encoded:
+                chain.append(node)
+                node = parents.get(node)
+            prefix, level = encoded.get(node, ('', -1))
+            for node in reversed(chain):
+                level += 1
+                prefix += encode_path_step(node)
+                encoded[node] = (prefix, level)
+            changed.append(Post(pk=pk, path=encoded[pk][0], depth=encoded[pk][1]))
+
+    thread_rows = []
+    current_thread = None
+    rows = Post.objects.order_by('thread_id', 'id').values_list('thread_id', 'id', 'parent_id')
+    for thread_id, pk, parent_id in rows.iterator(chunk_size=batch_size):
+        if thread_id != current_thread:
+            rebuild_thread(thread_rows)
+            thread_rows = []
+            current_thread = thread_id
+        thread_rows.append((pk, parent_id))
+        if len(changed) >= batch_size:
+            Post.objects.bulk_update(changed, ['path', 'depth'], batch_size=batch_size)
+            changed.clear()
+    rebuild_thread(thread_rows)
+    Post.objects.bulk_update(changed, ['path', 'depth'], batch_size=batch_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0007_post_likes_count_postlike'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='path',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['path'], name='forum_post_path_idx', opclasses=['text_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['thread', 'depth'], name='forum_post_thread_depth_idx'),
+        ),
+        migrations.RunPython(backfill_post_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_thread_activity(apps, schema_editor):
+    Thread = apps.get_model('forum', 'Thread')
+    Post = apps.get_model('forum', 'Post')
+    posts = Post.objects.filter(thread=OuterRef('pk'))
+    latest = posts.order_by('-created_at', '-id')
+    Thread.objects.update(
+        post_count=Coalesce(Subquery(posts.values('thread').annotate(total=Count('id')).values('total')), 0),
+        reply_count=Coalesce(Subquery(
+            posts.filter(parent__isnull=False).values('thread').annotate(total=Count('id')).values('total')
+        ), 0),
+        last_post_at=Coalesce(Subquery(latest.values('created_at')[:1]), F('created_at')),
+        last_post_author=Subquery(latest.values('author')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0009_post_root_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='last_post_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='last_post_author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['category', '-last_post_at'], name='forum_thread_activity_idx'),
+        ),
+        migrations.RunPython(backfill_thread_activity, migrations.RunPython.noop),
+    ]
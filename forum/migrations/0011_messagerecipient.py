@@ -0,0 +1,57 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_recipients(apps, schema_editor):
+    PrivateMessage = apps.get_model('forum', 'PrivateMessage')
+    MessageRecipient = apps.get_model('forum', 'MessageRecipient')
+    rows = PrivateMessage.recipients.through.objects.values_list(
+        'privatemessage_id', 'customuser_id', 'privatemessage__read', 'privatemessage__timestamp',
+    ).order_by('pk')
+
+    batch = []
+    for message_id, recipient_id, read, timestamp in rows.iterator(chunk_size=2000):
+        batch.append(MessageRecipient(message_id=message_id, recipient_id=recipient_id, read_at=timestamp if read else None))
+        if len(batch) >= 2000:
+            MessageRecipient.objects.bulk_create(batch)
+            batch = []
+    MessageRecipient.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0010_thread_activity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='forum.privatemessage')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_deliveries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['recipient', 'read_at'], name='forum_msgrecipient_unread_idx')],
+                'constraints': [models.UniqueConstraint(fields=('message', 'recipient'), name='forum_messagerecipient_unique')],
+            },
+        ),
+        migrations.RunPython(copy_recipients, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='privatemessage',
+            name='recipients',
+        ),
+        migrations.AddField(
+            model_name='privatemessage',
+            name='recipients',
+            field=models.ManyToManyField(related_name='received_messages', through='forum.MessageRecipient', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RemoveField(
+            model_name='privatemessage',
+            name='read',
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:07
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# GIN indexes and tsvector functions only exist on PostgreSQL; other backends
+# keep the (unused) columns and fall back to substring search.
+INDEXES = [
+    ('forum_thread_search_idx', 'forum_thread'),
+    ('forum_post_search_idx', 'forum_post'),
+]
+
+
+def populate_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "UPDATE forum_thread SET search_vector = "
+        "setweight(to_tsvector('spanish', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('spanish', coalesce(content, '')), 'B')"
+    )
+    schema_editor.execute("UPDATE forum_post SET search_vector = to_tsvector('spanish', coalesce(content, ''))")
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table in INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (search_vector)')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0011_messagerecipient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -1,16 +1,39 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.core.cache import cache
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils import timezone
-import base64  # Add this import
-import os
 import uuid
-from Crypto.Cipher import AES
 from django.utils.text import slugify  # Add this import at the top of the file
+from .caching import invalidated_timeout
+from .crypto import get_key_ring
 
 
 User = get_user_model()
 
+# How many suffixed slugs Thread.save tries after a unique conflict.
+SLUG_ATTEMPTS = 5
+
+# Text search configuration of the stored search vectors (see forum.search).
+SEARCH_CONFIG = 'spanish'
+
+# Cached unread counts are invalidated explicitly; the timeout only bounds
+# how long a missed invalidation can go unnoticed (much shorter with a
+# per-process cache, see forum.caching).
+UNREAD_COUNT_CACHE_TIMEOUT = 60 * 60
+
+# The section tree is cached under a random version token that changes on
+# every Section/Category write. Each process also keeps the last tree it
+# loaded as (version, sections), so a warm read is a single cache lookup.
+# With a per-process cache the token expires quickly instead, since other
+# processes' writes cannot replace it (see forum.caching).
+SECTION_TREE_VERSION_KEY = 'forum:section-tree:version'
+SECTION_TREE_CACHE_TIMEOUT = 24 * 60 * 60
+_section_tree = (None, None)
+
 class Section(models.Model):
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
@@ -26,6 +49,46 @@ class Section(models.Model):
     def get_absolute_url(self):
         return reverse('forum:section_detail', kwargs={'slug': self.slug})
 
+    @classmethod
+    def get_tree(cls):
+        """
+        Return every section with its categories prefetched, from the
+        process-level copy when it is still current, else from the shared
+        cache, else from the database (two queries).
+        """
+        global _section_tree
+        version = cls.tree_version()
+        cached_version, sections = _section_tree
+        if version is not None and version == cached_version:
+            return sections
+
+        tree_key = f'forum:section-tree:{version}'
+        sections = cache.get(tree_key) if version is not None else None
+        if sections is None:
+            sections = list(cls.objects.prefetch_related('categories'))
+            if version is not None:
+                cache.set(tree_key, sections, SECTION_TREE_CACHE_TIMEOUT)
+        _section_tree = (version, sections)
+        return sections
+
+    @classmethod
+    def tree_version(cls):
+        """Return the current section tree version token (``None`` without a working cache)."""
+        version = cache.get(SECTION_TREE_VERSION_KEY)
+        if version is None:
+            cache.add(SECTION_TREE_VERSION_KEY, uuid.uuid4().hex, invalidated_timeout(None))
+            version = cache.get(SECTION_TREE_VERSION_KEY)
+        return version
+
+    @classmethod
+    def invalidate_tree(cls):
+        """Publish a new tree version once the current transaction commits."""
+        def publish():
+            global _section_tree
+            _section_tree = (None, None)
+            cache.set(SECTION_TREE_VERSION_KEY, uuid.uuid4().hex, invalidated_timeout(None))
+        transaction.on_commit(publish)
+
 class Category(models.Model):
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
@@ -51,15 +114,40 @@ class Thread(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalized activity, kept up to date by forum.signals.
+    last_post_at = models.DateTimeField(null=True, blank=True)
+    last_post_author = models.ForeignKey(User, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    post_count = models.PositiveIntegerField(default=0)
+    reply_count = models.PositiveIntegerField(default=0)
+
+    # Weighted title + content tsvector, kept up to date by forum.signals. Its
+    # GIN index is created by migration 0012 on PostgreSQL only.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', '-last_post_at'], name='forum_thread_activity_idx'),
+        ]
+
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base_slug = slugify(self.title)
-            slug = base_slug
-            count = 1
-            while Thread.objects.filter(slug=slug).exists():
-                slug = f'{base_slug}-{uuid.uuid4().hex[:6]}'
-            self.slug = slug
-        super().save(*args, **kwargs)
+        if self._state.adding and self.last_post_at is None:
+            self.last_post_at = timezone.now()
+        if self.slug:
+            return super().save(*args, **kwargs)
+
+        # Let the unique constraint arbitrate instead of probing first: the
+        # common case costs no extra query, and a concurrent insert of the
+        # same slug only costs a retry.
+        base_slug = self.base_slug(self.title)
+        self.slug = base_slug
+        for attempt in range(SLUG_ATTEMPTS):
+            try:
+                with transaction.atomic(using=kwargs.get('using')):
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if attempt == SLUG_ATTEMPTS - 1 or not Thread.objects.filter(slug=self.slug).exclude(pk=self.pk).exists():
+                    raise
+                self.slug = self.suffixed_slug(base_slug)
 
     def __str__(self):
         return self.title
@@ -67,30 +155,246 @@ class Thread(models.Model):
     def get_absolute_url(self):
         return reverse('forum:thread_detail', kwargs={'slug': self.slug})
 
+    @staticmethod
+    def base_slug(title):
+        # Leave room for the "-xxxxxx" suffix within max_length.
+        return slugify(title)[:248].strip('-') or 'thread'
+
+    @staticmethod
+    def suffixed_slug(base_slug):
+        return f'{base_slug}-{uuid.uuid4().hex[:6]}'
+
+    @classmethod
+    def assign_unique_slugs(cls, threads, batch_size=900):
+        """
+        Give every unsaved thread in ``threads`` without a slug a unique one,
+        e.g. before ``bulk_create``. Candidates are checked against the
+        database in batches, so the cost is a handful of queries per round
+        rather than one per thread; a round only repeats for the rare
+        candidates that collide.
+        """
+        taken = {thread.slug for thread in threads if thread.slug}
+        pending = [(thread, cls.base_slug(thread.title)) for thread in threads if not thread.slug]
+        first_round = True
+        while pending:
+            proposals = [
+                (thread, base_slug, base_slug if first_round else cls.suffixed_slug(base_slug))
+                for thread, base_slug in pending
+            ]
+            candidates = list({candidate for _, _, candidate in proposals})
+            existing = set()
+            for start in range(0, len(candidates), batch_size):
+                existing.update(
+                    cls.objects.filter(slug__in=candidates[start:start + batch_size]).values_list('slug', flat=True)
+                )
+
+            pending = []
+            for thread, base_slug, candidate in proposals:
+                if candidate in taken or candidate in existing:
+                    pending.append((thread, base_slug))
+                else:
+                    thread.slug = candidate
+                    taken.add(candidate)
+            first_round = False
+        return threads
+
+    @classmethod
+    def recompute_activity(cls, threads=None):
+        """
+        Recompute the denormalized activity columns of ``threads`` (all
+        threads by default) from their posts in a single UPDATE.
+        """
+        threads = cls.objects.all() if threads is None else threads
+        posts = Post.objects.filter(thread=OuterRef('pk'))
+        latest = posts.order_by('-created_at', '-id')
+        return threads.update(
+            post_count=Coalesce(Subquery(posts.values('thread').annotate(total=Count('id')).values('total')), 0),
+            reply_count=Coalesce(Subquery(
+                posts.filter(parent__isnull=False).values('thread').annotate(total=Count('id')).values('total')
+            ), 0),
+            last_post_at=Coalesce(Subquery(latest.values('created_at')[:1]), F('created_at')),
+            last_post_author=Subquery(latest.values('author')[:1]),
+        )
+
+    @classmethod
+    def update_search_vectors(cls, threads=None):
+        """
+        Recompute ``search_vector`` for ``threads`` (all threads by default),
+        weighting the title above the content. A no-op outside PostgreSQL.
+        """
+        if connections[router.db_for_write(cls)].vendor != 'postgresql':
+            return 0
+        threads = cls.objects.all() if threads is None else threads
+        return threads.update(search_vector=(
+            SearchVector('title', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('content', weight='B', config=SEARCH_CONFIG)
+        ))
+
+class ReplyCycleError(ValueError):
+    """Raised when posts are (indirectly) their own parents."""
+
+    def __init__(self, pks):
+        self.pks = pks
+        super().__init__(f'Posts {pks} form a reply cycle.')
+
 class Post(models.Model):
+    # Every post stores its materialized path: the fixed-width, base 36 ids
+    # of its ancestors followed by its own. A subtree is a prefix match on
+    # ``path`` and a depth limit is a range on ``depth``. ``path`` is
+    # unbounded text so nesting depth has no limit.
+    PATH_STEP = 8
+
     thread = models.ForeignKey(Thread, related_name='posts', on_delete=models.CASCADE)
     author = models.ForeignKey(User, related_name='posts', on_delete=models.CASCADE)
     content = models.TextField()
     parent = models.ForeignKey('self', null=True, blank=True, related_name='replies', on_delete=models.CASCADE)
+    path = models.TextField(blank=True, default='', editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     likes_count = models.PositiveIntegerField(default=0)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['path'], name='forum_post_path_idx', opclasses=['text_pattern_ops']),
+            models.Index(fields=['thread', 'depth'], name='forum_post_thread_depth_idx'),
+            # Keyset pagination of a thread's root posts, in both orderings.
+            models.Index(fields=['thread', 'created_at', 'id'], name='forum_post_root_created_idx',
+                         condition=models.Q(parent__isnull=True)),
+            models.Index(fields=['thread', 'likes_count', 'id'], name='forum_post_root_likes_idx',
+                         condition=models.Q(parent__isnull=True)),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+
+        self.depth = self.parent.depth + 1 if self.parent else 0
+        # The thread's activity columns are updated from post_save, so the
+        # insert, the path and the counters commit together.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if not self.path:
+                # The path ends with our own id, so it can only be written
+                # once the row exists.
+                self.path = (self.parent.path if self.parent else '') + self.encode_path_step(self.pk)
+                Post.objects.filter(pk=self.pk).update(path=self.path)
+
+    def delete(self, *args, **kwargs):
+        if not self.path:
+            return super().delete(*args, **kwargs)
+        # Collecting the subtree by prefix lets the cascade run a fixed number
+        # of queries instead of one per nesting level.
+        return Post.objects.filter(thread_id=self.thread_id, path__startswith=self.path).delete()
 
     def __str__(self):
         return f'Post by {self.author} in {self.thread}'
 
-    def get_absolute_url(self):
-        return reverse('forum:thread_detail', kwargs={'slug': self.thread.slug})
+    @classmethod
+    def adjust_likes_count(cls, pk, delta):
+        """
+        Atomically add ``delta`` to the likes counter of post ``pk`` without
+        touching any other column (``updated_at`` included) and return the new
+        count, or ``None`` if there is no such post.
+        """
+        connection = connections[router.db_for_write(cls)]
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            cls.objects.filter(pk=pk).update(likes_count=F('likes_count') + delta)
+            return cls.objects.filter(pk=pk).values_list('likes_count', flat=True).first()
+
+        table = connection.ops.quote_name(cls._meta.db_table)
+        column = connection.ops.quote_name('likes_count')
+        pk_column = connection.ops.quote_name(cls._meta.pk.column)
+        # UPDATE ... RETURNING reads the new value in the same statement.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET {column} = CASE WHEN {column} + %s < 0 THEN 0 ELSE {column} + %s END '
+                f'WHERE {pk_column} = %s RETURNING {column}',
+                [delta, delta, pk],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def recount_likes(cls, posts=None):
+        """Recompute ``likes_count`` of ``posts`` (all posts by default) from their likes in a single UPDATE."""
+        posts = cls.objects.all() if posts is None else posts
+        likes = PostLike.objects.filter(post=OuterRef('pk')).values('post').annotate(total=Count('id'))
+        return posts.update(likes_count=Coalesce(Subquery(likes.values('total')), 0))
+
+    @classmethod
+    def update_search_vectors(cls, posts=None):
+        """Recompute ``search_vector`` for ``posts`` (all posts by default). A no-op outside PostgreSQL."""
+        if connections[router.db_for_write(cls)].vendor != 'postgresql':
+            return 0
+        posts = cls.objects.all() if posts is None else posts
+        return posts.update(search_vector=SearchVector('content', config=SEARCH_CONFIG))
+
+    @classmethod
+    def encode_path_step(cls, pk):
+        digits = ''
+        while pk:
+            pk, remainder = divmod(pk, 36)
+            digits = '0123456789abcdefghijklmnopqrstuvwxyz'[remainder] + digits
+        return digits.rjust(cls.PATH_STEP, '0')
 
-    def is_root(self):
-        return self.parent is None
+    @classmethod
+    def rebuild_paths(cls, threads=None, batch_size=1000):
+        """
+        Recompute ``path`` and ``depth`` for every post of ``threads`` (all
+        threads by default), one thread at a time, and write back only the
+        rows that changed. Returns the number of updated posts, or raises
+        ``ReplyCycleError`` if some posts are their own ancestors.
+        """
+        rows = cls.objects.order_by('thread_id', 'id')
+        if threads is not None:
+            rows = rows.filter(thread__in=threads)
+        rows = rows.values_list('thread_id', 'id', 'parent_id', 'path', 'depth')
 
-    def get_replies(self):
-        return self.replies.all()
+        changed = []
+        updated = 0
 
-    def mark_as_edited(self):
-        self.updated_at = timezone.now()
-        self.save()
+        def rebuild_thread(thread_rows):
+            parents = {pk: parent_id for pk, parent_id, _, _ in thread_rows}
+            encoded = {}
+            for pk, _, path, depth in thread_rows:
+                # Walk up iteratively: parents are not guaranteed to have
+                # lower ids (e.g. imported trees) and nesting can be deep.
+                chain = []
+                seen = set()
+                node = pk
+                while node is not None and node not in encoded:
+                    if node in seen:
+                        raise ReplyCycleError(chain[chain.index(node):])
+                    chain.append(node)
+                    seen.add(node)
+                    node = parents.get(node)
+                prefix, level = encoded.get(node, ('', -1))
+                for node in reversed(chain):
+                    level += 1
+                    prefix += cls.encode_path_step(node)
+                    encoded[node] = (prefix, level)
+                if encoded[pk] != (path, depth):
+                    changed.append(cls(pk=pk, path=encoded[pk][0], depth=encoded[pk][1]))
+
+        thread_rows = []
+        current_thread = None
+        for thread_id, pk, parent_id, path, depth in rows.iterator(chunk_size=batch_size):
+            if thread_id != current_thread:
+                rebuild_thread(thread_rows)
+                thread_rows = []
+                current_thread = thread_id
+            thread_rows.append((pk, parent_id, path, depth))
+            if len(changed) >= batch_size:
+                cls.objects.bulk_update(changed, ['path', 'depth'], batch_size=batch_size)
+                updated += len(changed)
+                changed.clear()
+        rebuild_thread(thread_rows)
+        if changed:
+            cls.objects.bulk_update(changed, ['path', 'depth'], batch_size=batch_size)
+            updated += len(changed)
+        return updated
 
 class PostLike(models.Model):
     post = models.ForeignKey(Post, related_name='likes', on_delete=models.CASCADE)
@@ -100,13 +404,15 @@ class PostLike(models.Model):
     class Meta:
         unique_together = ('post', 'user')
 
+def unread_count_cache_key(user_id):
+    return f'forum:unread-count:{user_id}'
+
 class PrivateMessage(models.Model):
     title = models.CharField(max_length=255)
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
-    recipients = models.ManyToManyField(User, related_name='received_messages')
+    recipients = models.ManyToManyField(User, related_name='received_messages', through='MessageRecipient')
     encrypted_content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
-    read = models.BooleanField(default=False)
 
     def save(self, *args, **kwargs):
         if not self.encrypted_content.startswith('ENC:'):
@@ -117,41 +423,73 @@ class PrivateMessage(models.Model):
         return f'Message from {self.sender} to {", ".join([user.username for user in self.recipients.all()])}'
 
     def encrypt(self, raw):
-        raw = raw.ljust(16 * ((len(raw) + 15) // 16))
-        key = os.environ.get('MESSAGE_ENCRYPTION_KEY')
-        if not key:
-            raise ValueError("Encryption key not set. Please set the MESSAGE_ENCRYPTION_KEY environment variable.")
-        
-        key_bytes = bytes.fromhex(key)
-        iv = os.urandom(16)
-        cipher = AES.new(key_bytes, AES.MODE_CFB, iv)
-        encrypted = iv + cipher.encrypt(raw.encode('utf-8'))
-        return 'ENC:' + base64.b64encode(encrypted).decode('utf-8')
-
-    def decrypt(self):
-        key_hex = os.environ.get('MESSAGE_ENCRYPTION_KEY')
-        if not key_hex:
-            raise ValueError("Encryption key not set. Please set the MESSAGE_ENCRYPTION_KEY environment variable.")
-        
-        key = bytes.fromhex(key_hex)
+        return get_key_ring().encrypt(raw)
 
+    def decrypt(self, max_chars=None):
+        """
+        Return the plaintext. With ``max_chars`` only the ciphertext blocks
+        needed for a preview of that length are decoded and decrypted.
+        """
+        key_ring = get_key_ring()
         try:
-            if not self.encrypted_content.startswith('ENC:'):
-                return self.encrypted_content
-
-            encrypted_data = base64.b64decode(self.encrypted_content[4:])
-            iv = encrypted_data[:16]
-            cipher = AES.new(key, AES.MODE_CFB, iv)
-            decrypted_bytes = cipher.decrypt(encrypted_data[16:])
-            decrypted_message = decrypted_bytes.decode('utf-8').strip()
-            return decrypted_message
+            return key_ring.decrypt(self.encrypted_content, max_chars)
         except (ValueError, UnicodeDecodeError) as e:
             return "Decryption error"
 
-    def mark_as_read(self):
-        if not self.read:
-            self.read = True
-            self.save()
+    def mark_as_read(self, user):
+        """Mark the message as read for ``user`` only. Returns whether it was unread."""
+        updated = self.deliveries.filter(recipient=user, read_at__isnull=True).update(read_at=timezone.now())
+        if updated:
+            PrivateMessage.invalidate_unread_counts([user.pk])
+        return bool(updated)
+
+    @classmethod
+    def unread_count_for(cls, user):
+        """
+        Return how many unread messages ``user`` has, served from the cache
+        until a message is sent to them or read.
+        """
+        key = unread_count_cache_key(user.pk)
+        count = cache.get(key)
+        if count is None:
+            count = MessageRecipient.objects.filter(recipient=user, read_at__isnull=True).count()
+            cache.set(key, count, invalidated_timeout(UNREAD_COUNT_CACHE_TIMEOUT))
+        return count
+
+    @classmethod
+    async def aunread_count_for(cls, user):
+        """Async ``unread_count_for``."""
+        key = unread_count_cache_key(user.pk)
+        count = await cache.aget(key)
+        if count is None:
+            count = await MessageRecipient.objects.filter(recipient=user, read_at__isnull=True).acount()
+            await cache.aset(key, count, invalidated_timeout(UNREAD_COUNT_CACHE_TIMEOUT))
+        return count
+
+    @classmethod
+    def invalidate_unread_counts(cls, user_ids):
+        """Drop the cached unread counts of ``user_ids`` once the current transaction commits."""
+        keys = [unread_count_cache_key(user_id) for user_id in user_ids]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
 
     def get_absolute_url(self):
         return reverse('forum:message_detail', kwargs={'pk': self.pk})
+
+
+class MessageRecipient(models.Model):
+    """Delivery of a private message to one recipient, with its own read state."""
+    message = models.ForeignKey(PrivateMessage, related_name='deliveries', on_delete=models.CASCADE)
+    recipient = models.ForeignKey(User, related_name='message_deliveries', on_delete=models.CASCADE)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'recipient'], name='forum_messagerecipient_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['recipient', 'read_at'], name='forum_msgrecipient_unread_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.message} to {self.recipient}'
@@ -0,0 +1,142 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from .caching import cache_is_shared
+
+# Cached pages only bound memory use: they are invalidated by version bumps,
+# never by age.
+PAGE_CACHE_TIMEOUT = getattr(settings, 'FORUM_PAGE_CACHE_TIMEOUT', 24 * 60 * 60)
+VARY_HEADERS = ('Cookie', 'Authorization')
+
+
+def page_version_key(kind, slug):
+    return f'forum:page-version:{kind}:{slug}'
+
+
+def get_page_version(kind, slug):
+    """
+    Return the current version of the ``kind`` (``'thread'`` or
+    ``'category'``) page for ``slug``. Versions start from the clock, so a
+    version lost from the cache never comes back with an old value.
+    """
+    key = page_version_key(kind, slug)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_page_versions(*pages):
+    """
+    Invalidate the cached ``(kind, slug)`` pages, now and again once the
+    current transaction commits, so a page rendered from data that was not
+    yet committed cannot outlive the write.
+    """
+    def bump():
+        for kind, slug in pages:
+            key = page_version_key(kind, slug)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, time.time_ns(), None)
+    bump()
+    transaction.on_commit(bump)
+
+
+def page_cache_enabled():
+    """
+    Whether page caching is on: ``FORUM_PAGE_CACHE`` and a shared cache. A
+    write bumps page versions only in the cache it can reach, so with a
+    per-process cache other workers would serve stale pages until
+    ``PAGE_CACHE_TIMEOUT``.
+    """
+    return getattr(settings, 'FORUM_PAGE_CACHE', True) and cache_is_shared()
+
+
+def is_cacheable_request(request):
+    """
+    Whether the response to ``request`` may come from the page cache: page
+    caching is on (see ``page_cache_enabled``) and the request is a read that
+    cannot carry a user (no session cookie, no token).
+    """
+    return (
+        request.method in ('GET', 'HEAD')
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and 'HTTP_AUTHORIZATION' not in request.META
+        and page_cache_enabled()
+    )
+
+
+def page_cache_key(kind, slug, version, request):
+    url_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'forum:page:{kind}:{slug}:{version}:{url_hash}'
+
+
+def cacheable_content(response):
+    """Return what to cache of ``response``, or ``None`` if it must not be cached."""
+    if hasattr(response, 'render'):
+        response.render()
+    # Responses that set cookies (CSRF, session) are specific to the visitor.
+    if response.status_code == 200 and not response.cookies and not response.streaming:
+        return response.content, response['Content-Type']
+    return None
+
+
+def cache_anonymous_page(kind, slug_kwarg='slug'):
+    """
+    View decorator caching the whole response for anonymous readers, keyed
+    by the full URL (query string included) and the version of the ``kind``
+    page named by the ``slug_kwarg`` URL argument. Works on sync and async views.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if not is_cacheable_request(request):
+                    response = await view(request, *args, **kwargs)
+                    patch_vary_headers(response, VARY_HEADERS)
+                    return response
+
+                version = await sync_to_async(get_page_version)(kind, kwargs[slug_kwarg])
+                key = page_cache_key(kind, kwargs[slug_kwarg], version, request)
+                cached = await cache.aget(key)
+                if cached is not None:
+                    response = HttpResponse(cached[0], content_type=cached[1])
+                else:
+                    response = await view(request, *args, **kwargs)
+                    content = cacheable_content(response)
+                    if content is not None:
+                        await cache.aset(key, content, PAGE_CACHE_TIMEOUT)
+                patch_vary_headers(response, VARY_HEADERS)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable_request(request):
+                response = view(request, *args, **kwargs)
+                patch_vary_headers(response, VARY_HEADERS)
+                return response
+
+            version = get_page_version(kind, kwargs[slug_kwarg])
+            key = page_cache_key(kind, kwargs[slug_kwarg], version, request)
+            cached = cache.get(key)
+            if cached is not None:
+                response = HttpResponse(cached[0], content_type=cached[1])
+            else:
+                response = view(request, *args, **kwargs)
+                content = cacheable_content(response)
+                if content is not None:
+                    cache.set(key, content, PAGE_CACHE_TIMEOUT)
+            patch_vary_headers(response, VARY_HEADERS)
+            return response
+        return wrapper
+    return decorator
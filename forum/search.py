@@ -0,0 +1,147 @@
+import base64
+import json
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import connections, router
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Cast, Substr
+from django.urls import reverse
+from django.utils.html import escape
+
+from .models import SEARCH_CONFIG, Post, Thread
+
+# Result kinds, in the order they are listed when ranks tie.
+THREAD, POST = 0, 1
+KIND_NAMES = {THREAD: 'thread', POST: 'post'}
+
+SNIPPET_WORDS = (15, 35)
+# Characters of content shown as the snippet when full-text search is not
+# available (non-PostgreSQL databases).
+FALLBACK_SNIPPET_CHARS = 200
+# Private use characters mark the matches in headlines: the snippet is
+# HTML-escaped first and only then are they turned into <mark> tags.
+MATCH_START, MATCH_STOP = '\ue000', '\ue001'
+
+
+def encode_cursor(rank, kind, pk):
+    """Build the opaque ``after`` cursor pointing just past a result."""
+    raw = json.dumps([rank, kind, pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the ``(rank, kind, id)`` stored in ``cursor``, or ``None`` when missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        rank, kind, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(rank), int(kind), int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def highlight(snippet):
+    """Escape a headline and wrap its matches in ``<mark>``."""
+    return escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_STOP, '</mark>')
+
+
+def ranked(queryset, text_query, search_text):
+    """
+    Filter ``queryset`` to the rows matching ``text_query`` and annotate them
+    with ``rank`` and a ``snippet`` of their content.
+
+    On PostgreSQL this uses the stored search vectors (GIN indexed) and
+    ``ts_headline``; elsewhere it degrades to a case-insensitive substring
+    match with a constant rank.
+    """
+    if connections[router.db_for_read(queryset.model)].vendor == 'postgresql':
+        min_words, max_words = SNIPPET_WORDS
+        return queryset.filter(search_vector=text_query).annotate(
+            # ts_rank returns a float4. As a float8, the value written to
+            # the cursor compares equal to the rank it came from.
+            rank=Cast(SearchRank(F('search_vector'), text_query), FloatField()),
+            snippet=SearchHeadline(
+                'content', text_query, config=SEARCH_CONFIG, start_sel=MATCH_START, stop_sel=MATCH_STOP,
+                min_words=min_words, max_words=max_words, max_fragments=2,
+            ),
+        )
+    matches = Q(content__icontains=search_text)
+    if queryset.model is Thread:
+        matches |= Q(title__icontains=search_text)
+    return queryset.filter(matches).annotate(
+        rank=Value(0.0, output_field=FloatField()),
+        snippet=Substr('content', 1, FALLBACK_SNIPPET_CHARS),
+    )
+
+
+def after_position(kind, position):
+    """Keyset condition selecting the results of ``kind`` that sort after ``position``."""
+    rank, position_kind, pk = position
+    if kind < position_kind:
+        return Q(rank__lt=rank)
+    if kind > position_kind:
+        return Q(rank__lte=rank)
+    return Q(rank__lt=rank) | Q(rank=rank, id__lt=pk)
+
+
+def search(text, section=None, category=None, after=None, page_size=20):
+    """
+    Search thread titles and contents and post contents for ``text``,
+    optionally restricted to a section and/or category slug.
+
+    Results are ordered by rank, then threads before posts, then newest
+    first, and keyset-paginated: ``after`` is a cursor from a previous page.
+    Only the columns a result needs are fetched, never whole bodies.
+    Returns ``(results, next_cursor)``; every result is a dict with ``kind``,
+    ``id``, ``title``, ``url``, ``snippet`` (safe HTML) and ``rank``.
+    """
+    text = (text or '').strip()
+    if not text:
+        return [], None
+    text_query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+
+    threads = Thread.objects.all()
+    posts = Post.objects.all()
+    if section:
+        threads = threads.filter(category__section__slug=section)
+        posts = posts.filter(thread__category__section__slug=section)
+    if category:
+        threads = threads.filter(category__slug=category)
+        posts = posts.filter(thread__category__slug=category)
+
+    threads = ranked(threads, text_query, text)
+    posts = ranked(posts, text_query, text)
+    position = decode_cursor(after)
+    if position is not None:
+        threads = threads.filter(after_position(THREAD, position))
+        posts = posts.filter(after_position(POST, position))
+
+    limit = page_size + 1
+    rows = [
+        (THREAD, row) for row in
+        threads.order_by('-rank', '-id').values('id', 'title', 'slug', 'rank', 'snippet')[:limit]
+    ] + [
+        (POST, row) for row in
+        posts.order_by('-rank', '-id').values(
+            'id', 'rank', 'snippet', title=F('thread__title'), slug=F('thread__slug'),
+        )[:limit]
+    ]
+    rows.sort(key=lambda item: (-item[1]['rank'], item[0], -item[1]['id']))
+
+    results = []
+    for kind, row in rows[:page_size]:
+        url = reverse('forum:thread_detail', kwargs={'slug': row['slug']})
+        results.append({
+            'kind': KIND_NAMES[kind],
+            'id': row['id'],
+            'title': row['title'],
+            'url': url if kind == THREAD else f"{url}#post-{row['id']}",
+            'snippet': highlight(row['snippet'] or ''),
+            'rank': row['rank'],
+        })
+
+    next_cursor = None
+    if len(rows) > page_size:
+        kind, row = rows[page_size - 1]
+        next_cursor = encode_cursor(row['rank'], kind, row['id'])
+    return results, next_cursor
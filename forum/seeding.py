@@ -0,0 +1,174 @@
+"""
+Synthetic forum data for benchmarks and local development, written with
+bulk inserts (see the ``seed_forum`` command).
+
+Bulk inserts skip ``save()`` and the model signals, so everything they would
+maintain is recomputed afterwards in set-based queries: post paths, thread
+activity, search vectors, user message counts and the section tree.
+"""
+import random
+import uuid
+from dataclasses import dataclass
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from .crypto import get_key_ring
+from .models import Category, MessageRecipient, Post, PostLike, PrivateMessage, Section, Thread
+
+User = get_user_model()
+
+SEED_PASSWORD = 'seed-password'
+BATCH_SIZE = 500
+WORDS = (
+    'corazón paciente guardia residente examen estudio caso clínico diagnóstico tratamiento '
+    'hospital rotación especialidad cirugía pediatría cardiología consulta urgencias dosis '
+    'síntoma protocolo revisión pregunta respuesta duda apuntes temario plaza examen mir '
+    'simulacro nota academia libro resumen fármaco analítica imagen radiografía'
+).split()
+
+
+@dataclass
+class SeedScale:
+    """Size of a seeded forum. ``threads`` is per category, the rest are totals or averages."""
+    users: int = 50
+    sections: int = 3
+    categories: int = 4
+    threads: int = 10
+    posts: int = 20
+    max_depth: int = 6
+    likes: float = 1.5
+    messages: int = 100
+    max_recipients: int = 4
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def create_users(count, token, password):
+    users = [
+        User(username=f'seed_{token}_{index}', email=f'seed_{token}_{index}@example.com', password=password)
+        for index in range(count)
+    ]
+    return User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+
+
+def create_sections(rng, scale, token):
+    sections = Section.objects.bulk_create([
+        Section(title=f'{words(rng, 2).capitalize()} {index}', slug=f'seed-{token}-{index}')
+        for index in range(scale.sections)
+    ])
+    return Category.objects.bulk_create([
+        Category(title=f'{words(rng, 2).capitalize()} {index}', slug=f'seed-{token}-{section.pk}-{index}', section=section)
+        for section in sections for index in range(scale.categories)
+    ])
+
+
+def create_threads(rng, scale, categories, user_ids):
+    threads = [
+        Thread(
+            title=f'{words(rng, rng.randint(3, 8)).capitalize()}?', content=words(rng, rng.randint(20, 120)),
+            category=category, author_id=rng.choice(user_ids),
+        )
+        for category in categories for _ in range(scale.threads)
+    ]
+    return Thread.objects.bulk_create(Thread.assign_unique_slugs(threads), batch_size=BATCH_SIZE)
+
+
+def plan_post_trees(rng, scale, threads, user_ids):
+    """
+    Unsaved posts for ``threads`` grouped by depth, parents before children.
+    About half the posts answer the thread; the rest reply to a recent post,
+    so discussions grow into deep, narrow branches as on a real forum.
+    """
+    levels = [[] for _ in range(scale.max_depth + 1)]
+    for thread in threads:
+        posts = []
+        for _ in range(max(1, round(rng.expovariate(1 / scale.posts)))):
+            recent = [post for post in posts[-5:] if post.depth < scale.max_depth]
+            parent = rng.choice(recent) if recent and rng.random() < 0.5 else None
+            post = Post(
+                thread=thread, parent=parent, author_id=rng.choice(user_ids), content=words(rng, rng.randint(5, 80)),
+                depth=parent.depth + 1 if parent else 0,
+                # Few posts collect most of the likes.
+                likes_count=min(len(user_ids), int(scale.likes * (rng.paretovariate(2) - 1))),
+            )
+            posts.append(post)
+            levels[post.depth].append(post)
+    return levels
+
+
+def create_posts(rng, scale, threads, user_ids):
+    posts = []
+    for level in plan_post_trees(rng, scale, threads, user_ids):
+        # Each level is inserted once its parents have ids.
+        posts.extend(Post.objects.bulk_create(level, batch_size=BATCH_SIZE))
+    Post.rebuild_paths(threads)
+    return posts
+
+
+def create_likes(rng, posts, user_ids):
+    likes = [
+        PostLike(post=post, user_id=user_id)
+        for post in posts if post.likes_count for user_id in rng.sample(user_ids, post.likes_count)
+    ]
+    return PostLike.objects.bulk_create(likes, batch_size=BATCH_SIZE)
+
+
+def create_messages(rng, scale, user_ids):
+    key_ring = get_key_ring()
+    messages = PrivateMessage.objects.bulk_create([
+        PrivateMessage(
+            title=words(rng, rng.randint(2, 6)).capitalize(), sender_id=rng.choice(user_ids),
+            encrypted_content=key_ring.encrypt(words(rng, rng.randint(10, 150))),
+        )
+        for _ in range(scale.messages)
+    ], batch_size=BATCH_SIZE)
+    now = timezone.now()
+    deliveries = []
+    for message in messages:
+        candidates = [user_id for user_id in user_ids if user_id != message.sender_id]
+        count = min(len(candidates), rng.randint(1, scale.max_recipients))
+        deliveries.extend(
+            MessageRecipient(message=message, recipient_id=recipient_id, read_at=now if rng.random() < 0.6 else None)
+            for recipient_id in rng.sample(candidates, count)
+        )
+    MessageRecipient.objects.bulk_create(deliveries, batch_size=BATCH_SIZE)
+    return messages
+
+
+def seed_forum(scale, seed=None):
+    """
+    Add a forum of ``scale`` to the database, written by new users whose
+    password is ``SEED_PASSWORD``, and return the number of rows created per
+    model. The same ``seed`` produces the same structure. Private messages
+    need the message encryption key.
+    """
+    rng = random.Random(seed)
+    token = uuid.uuid4().hex[:6]
+    with transaction.atomic():
+        created_users = create_users(scale.users, token, make_password(SEED_PASSWORD))
+        user_ids = [user.pk for user in created_users]
+        categories = create_sections(rng, scale, token)
+        threads = create_threads(rng, scale, categories, user_ids)
+        posts = create_posts(rng, scale, threads, user_ids)
+        likes = create_likes(rng, posts, user_ids)
+        messages = create_messages(rng, scale, user_ids) if scale.messages and len(user_ids) > 1 else []
+
+        thread_pks = [thread.pk for thread in threads]
+        Thread.recompute_activity(Thread.objects.filter(pk__in=thread_pks))
+        Thread.update_search_vectors(Thread.objects.filter(pk__in=thread_pks))
+        Post.update_search_vectors(Post.objects.filter(thread__in=thread_pks))
+        User.objects.recount_forum_messages()
+        Section.invalidate_tree()
+
+    return {
+        'users': len(created_users),
+        'categories': len(categories),
+        'threads': len(threads),
+        'posts': len(posts),
+        'likes': len(likes),
+        'messages': len(messages),
+    }
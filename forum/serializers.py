@@ -0,0 +1,55 @@
+from rest_framework import serializers
+from .models import Section, Category, Thread, Post
+
+
+class CategorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ['id', 'title', 'slug', 'section']
+
+
+class SectionSerializer(serializers.ModelSerializer):
+    """Section with its categories; expects them to be prefetched (see ``Section.get_tree``)."""
+    categories = CategorySerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Section
+        fields = ['id', 'title', 'slug', 'categories']
+
+
+class ThreadListSerializer(serializers.ModelSerializer):
+    """Thread row of a category listing; expects ``author`` and ``last_post_author`` to be selected."""
+    author = serializers.CharField(source='author.username', read_only=True)
+    last_post_author = serializers.CharField(source='last_post_author.username', read_only=True, default=None)
+
+    class Meta:
+        model = Thread
+        fields = ['id', 'title', 'slug', 'author', 'created_at', 'updated_at',
+                  'last_post_at', 'last_post_author', 'post_count', 'reply_count']
+
+
+class PostSerializer(serializers.ModelSerializer):
+    author = serializers.CharField(source='author.username', read_only=True)
+
+    class Meta:
+        model = Post
+        fields = ['id', 'parent', 'depth', 'author', 'content', 'created_at', 'updated_at', 'likes_count']
+
+
+class PostTreeSerializer(PostSerializer):
+    """Post with its replies, as linked in memory by ``forum.trees``."""
+    replies = serializers.SerializerMethodField()
+
+    class Meta(PostSerializer.Meta):
+        fields = PostSerializer.Meta.fields + ['replies']
+
+    def get_replies(self, post):
+        return PostTreeSerializer(post.children, many=True, context=self.context).data
+
+
+class ThreadDetailSerializer(ThreadListSerializer):
+    category = serializers.SlugRelatedField(slug_field='slug', read_only=True)
+    posts = PostTreeSerializer(many=True, read_only=True, source='post_tree')
+
+    class Meta(ThreadListSerializer.Meta):
+        fields = ThreadListSerializer.Meta.fields + ['category', 'content', 'posts']
@@ -0,0 +1,111 @@
+from django.db.models import BigIntegerField, Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .models import Category, Post, PostLike, PrivateMessage, Section, Thread
+from .events import post_event, publish_thread_event
+from .page_cache import bump_page_versions
+
+
+@receiver([post_save, post_delete], sender=Section)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_section_tree(sender, **kwargs):
+    Section.invalidate_tree()
+
+
+@receiver(post_save, sender=Post)
+def record_thread_activity(sender, instance, created, **kwargs):
+    if not created:
+        return
+    # Only move the "last post" forward, in case a concurrent insert with a
+    # later timestamp already committed.
+    is_latest = Q(last_post_at__isnull=True) | Q(last_post_at__lte=instance.created_at)
+    Thread.objects.filter(pk=instance.thread_id).update(
+        post_count=F('post_count') + 1,
+        reply_count=F('reply_count') + (1 if instance.parent_id else 0),
+        last_post_at=Case(When(is_latest, then=Value(instance.created_at)), default=F('last_post_at')),
+        last_post_author=Case(
+            When(is_latest, then=Value(instance.author_id)), default=F('last_post_author'),
+            output_field=BigIntegerField(),
+        ),
+    )
+
+
+@receiver(post_delete, sender=Post)
+def forget_thread_activity(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Thread):
+        return  # The thread itself is going away.
+    threads = Thread.objects.filter(pk=instance.thread_id)
+    threads.update(
+        post_count=Greatest(F('post_count') - 1, 0),
+        reply_count=Greatest(F('reply_count') - (1 if instance.parent_id else 0), 0),
+    )
+    # Only the removal of the latest post changes the thread's last post.
+    Thread.recompute_activity(threads.filter(last_post_at__lte=instance.created_at))
+
+
+@receiver(post_save, sender=Thread)
+def index_thread(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'title', 'content'} & set(update_fields):
+        Thread.update_search_vectors(Thread.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'content' in update_fields:
+        Post.update_search_vectors(Post.objects.filter(pk=instance.pk))
+
+
+def bump_thread_pages(thread_id, category=True):
+    """Invalidate the cached pages of a thread and, with ``category``, of its category."""
+    slugs = Thread.objects.filter(pk=thread_id).values_list('slug', 'category__slug').first()
+    if slugs:
+        thread_slug, category_slug = slugs
+        bump_page_versions(('thread', thread_slug), *([('category', category_slug)] if category else []))
+
+
+@receiver([post_save, post_delete], sender=Thread)
+def invalidate_thread_pages(sender, instance, **kwargs):
+    bump_page_versions(('thread', instance.slug))
+    category_slug = Category.objects.filter(pk=instance.category_id).values_list('slug', flat=True).first()
+    if category_slug:
+        bump_page_versions(('category', category_slug))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Thread):
+        return  # Handled by invalidate_thread_pages.
+    bump_thread_pages(instance.thread_id)
+
+
+@receiver(post_save, sender=Post)
+def publish_post(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or 'content' in update_fields:
+        publish_thread_event(instance.thread_id, post_event(instance, 'post' if created else 'post_edited'))
+
+
+@receiver([post_save, post_delete], sender=PostLike)
+def invalidate_liked_post_pages(sender, instance, **kwargs):
+    bump_thread_pages(Post.objects.filter(pk=instance.post_id).values('thread_id')[:1], category=False)
+
+
+@receiver(m2m_changed, sender=PrivateMessage.recipients.through)
+def invalidate_recipient_unread_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # ``instance`` is the user, ``pk_set`` the messages.
+        PrivateMessage.invalidate_unread_counts([instance.pk])
+    elif action == 'pre_clear':
+        PrivateMessage.invalidate_unread_counts(instance.recipients.values_list('id', flat=True))
+    else:
+        PrivateMessage.invalidate_unread_counts(pk_set)
+
+
+@receiver(pre_delete, sender=PrivateMessage)
+def invalidate_deleted_message_unread_counts(sender, instance, **kwargs):
+    PrivateMessage.invalidate_unread_counts(
+        instance.deliveries.filter(read_at__isnull=True).values_list('recipient_id', flat=True)
+    )
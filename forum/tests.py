@@ -1,3 +1,935 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .benchmarks import CASES, SCALES, Fixtures, run_case, uncovered_url_names
+from .caching import invalidated_timeout
+from .crypto import KeyRing, get_key_ring, reencrypt_chunk
+from .events import LocalBroker, get_broker, thread_channel
+from .likes import LikeCountBuffer
+from .models import Section, Category, Thread, Post, PostLike, PrivateMessage, ReplyCycleError, unread_count_cache_key
+from .dumps import DumpError, export_lines, import_dump
+from .search import MATCH_START, MATCH_STOP, highlight, search
+from .seeding import SeedScale, seed_forum
+from .trees import load_post_page, load_post_tree
+from .views import INBOX_PAGE_SIZE, ThreadDetailView
+
+User = get_user_model()
+
+
+class ForumTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', username='testuser', password='testpass123')
+        cls.section = Section.objects.create(title='General')
+        cls.category = Category.objects.create(title='Cardiology', section=cls.section)
+        cls.thread = Thread.objects.create(title='First thread', content='Hello', category=cls.category, author=cls.user)
+
+    def setUp(self):
+        cache.clear()  # Cached pages and trees are keyed by slugs that every test reuses.
+
+    def add_post(self, parent=None, thread=None, content='Reply', **kwargs):
+        return Post.objects.create(thread=thread or self.thread, author=self.user, content=content, parent=parent, **kwargs)
+
+
+class PostTreeTests(ForumTestCase):
+    def test_tree_is_linked_in_memory(self):
+        root = self.add_post()
+        reply = self.add_post(parent=root)
+        nested = self.add_post(parent=reply)
+        other_root = self.add_post()
+
+        with self.assertNumQueries(1):
+            roots = load_post_tree(self.thread)
+            self.assertEqual([post.id for post in roots], [root.id, other_root.id])
+            self.assertEqual([post.id for post in roots[0].children], [reply.id])
+            self.assertEqual([post.id for post in roots[0].children[0].children], [nested.id])
+            self.assertEqual(roots[0].children[0].children[0].author, self.user)
+
+    def test_thread_detail_query_count_is_independent_of_depth(self):
+        self.add_post()
+        url = reverse('forum:thread_detail', kwargs={'slug': self.thread.slug})
+        with CaptureQueriesContext(connection) as shallow:
+            self.client.get(url)
+
+        parent = None
+        for _ in range(20):
+            parent = self.add_post(parent=parent)
+        with CaptureQueriesContext(connection) as deep:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(deep), len(shallow))
+
+    def test_reply_ordering_applies_to_every_level(self):
+        root = self.add_post()
+        reply = self.add_post(parent=root)
+        first = self.add_post(parent=reply)
+        popular = self.add_post(parent=reply, likes_count=5)
+
+        roots = load_post_tree(self.thread, reply_orderings={reply.id: '-likes_count'})
+        self.assertEqual([post.id for post in roots[0].children[0].children], [popular.id, first.id])
+        self.assertEqual(roots[0].children[0].order_replies_by, 'likes_count')
+        self.assertEqual(roots[0].children[0].order_replies_direction, 'desc')
+
+    def test_max_depth_flags_hidden_replies(self):
+        root = self.add_post()
+        reply = self.add_post(parent=root)
+        self.add_post(parent=reply)
+
+        roots = load_post_tree(self.thread, max_depth=1)
+        self.assertEqual(roots[0].children[0].children, [])
+        self.assertTrue(roots[0].children[0].has_hidden_replies)
+        self.assertFalse(roots[0].has_hidden_replies)
+
+
+    @override_settings(FORUM_THREAD_MAX_DEPTH=3)
+    def test_deep_replies_load_on_demand(self):
+        parent = None
+        for level in range(5):
+            parent = self.add_post(parent=parent, content=f'Level {level}')
+        cut_off = Post.objects.get(depth=3)
+        replies_url = reverse('forum:post_replies', kwargs={'thread_slug': self.thread.slug, 'pk': cut_off.id})
+
+        response = self.client.get(reverse('forum:thread_detail', kwargs={'slug': self.thread.slug}))
+        self.assertContains(response, 'Level 3')
+        self.assertNotContains(response, 'Level 4')
+        self.assertContains(response, f'href="{replies_url}"')
+
+        self.assertContains(self.client.get(replies_url), 'Level 4')
+
+
+class PostPathTests(ForumTestCase):
+    def test_path_and_depth_are_assigned_on_create(self):
+        root = self.add_post()
+        reply = self.add_post(parent=root)
+        reply.refresh_from_db()
+        self.assertEqual(reply.depth, 1)
+        self.assertEqual(reply.path, Post.encode_path_step(root.id) + Post.encode_path_step(reply.id))
+
+    def test_delete_removes_subtree(self):
+        root = self.add_post()
+        reply = self.add_post(parent=root)
+        self.add_post(parent=reply)
+        sibling = self.add_post()
+
+        reply.delete()
+        self.assertEqual(set(Post.objects.values_list('id', flat=True)), {root.id, sibling.id})
+
+    def test_rebuild_paths_backfills_existing_rows(self):
+        root = self.add_post()
+        self.add_post(parent=root)
+        expected = {post.id: (post.path, post.depth) for post in Post.objects.all()}
+        Post.objects.update(path='', depth=0)
+
+        self.assertEqual(Post.rebuild_paths(), 2)
+        self.assertEqual({post.id: (post.path, post.depth) for post in Post.objects.all()}, expected)
+        self.assertEqual(Post.rebuild_paths(), 0)
+
+    def test_rebuild_paths_rejects_reply_cycles(self):
+        root = self.add_post()
+        reply = self.add_post(parent=root)
+        Post.objects.filter(pk=root.pk).update(parent=reply)
+
+        with self.assertRaises(ReplyCycleError) as raised:
+            Post.rebuild_paths()
+        self.assertEqual(set(raised.exception.pks), {root.pk, reply.pk})
+
+    def test_migration_backfills_paths_of_deep_trees(self):
+        backfill_post_paths = import_module('forum.migrations.0008_post_path_depth').backfill_post_paths
+        parent = None
+        for _ in range(200):
+            parent = self.add_post(parent=parent)
+        expected = {post.id: (post.path, post.depth) for post in Post.objects.all()}
+        Post.objects.update(path='', depth=0)
+
+        backfill_post_paths(django_apps, None)
+        self.assertEqual({post.id: (post.path, post.depth) for post in Post.objects.all()}, expected)
+        self.assertEqual(len(parent.path), 200 * Post.PATH_STEP)
+
+
+class PostPaginationTests(ForumTestCase):
+    def test_pages_follow_cursor_without_overlap(self):
+        roots = [self.add_post(likes_count=count) for count in (3, 1, 3, 2, 0)]
+        reply = self.add_post(parent=roots[0])
+
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = load_post_page(self.thread, '-likes_count', cursor, page_size=2)
+            seen.extend(page)
+            if cursor is None:
+                break
+
+        expected = sorted(roots, key=lambda post: (post.likes_count, post.id), reverse=True)
+        self.assertEqual([post.id for post in seen], [post.id for post in expected])
+        first = next(post for post in seen if post.id == roots[0].id)
+        self.assertEqual([post.id for post in first.children], [reply.id])
+
+    def test_page_query_count_does_not_grow(self):
+        for _ in range(6):
+            self.add_post()
+        page, cursor = load_post_page(self.thread, 'created_at', page_size=2)
+        with self.assertNumQueries(2):
+            load_post_page(self.thread, 'created_at', cursor, page_size=2)
+
+    def test_malformed_cursor_falls_back_to_first_page(self):
+        first = self.add_post()
+        page, _ = load_post_page(self.thread, 'created_at', 'not-a-cursor')
+        self.assertEqual([post.id for post in page], [first.id])
+
+    def test_thread_detail_links_next_page(self):
+        posts = [self.add_post() for _ in range(3)]
+        url = reverse('forum:thread_detail', kwargs={'slug': self.thread.slug})
+        with mock.patch.object(ThreadDetailView, 'posts_per_page', 2):
+            response = self.client.get(url, {'order_posts_by': 'created_at'})
+            self.assertEqual([post.id for post in response.context['posts']], [posts[0].id, posts[1].id])
+            response = self.client.get(url + response.context['next_page_url'])
+
+        self.assertEqual([post.id for post in response.context['posts']], [posts[2].id])
+        self.assertNotIn('next_page_url', response.context)
+        self.assertEqual(response.context['first_page_url'], '?order_posts_by=created_at')
+
+
+class ThreadActivityTests(ForumTestCase):
+    def test_counters_follow_creates_and_deletes(self):
+        other = User.objects.create_user(email='other@example.com', username='other', password='testpass123')
+        root = self.add_post()
+        reply = Post.objects.create(thread=self.thread, author=other, content='Reply', parent=root)
+
+        self.thread.refresh_from_db()
+        self.assertEqual((self.thread.post_count, self.thread.reply_count), (2, 1))
+        self.assertEqual(self.thread.last_post_author, other)
+        self.assertEqual(self.thread.last_post_at, reply.created_at)
+
+        reply.delete()
+        self.thread.refresh_from_db()
+        self.assertEqual((self.thread.post_count, self.thread.reply_count), (1, 0))
+        self.assertEqual(self.thread.last_post_author, self.user)
+        self.assertEqual(self.thread.last_post_at, root.created_at)
+
+    def test_recompute_activity_matches_signals(self):
+        root = self.add_post()
+        self.add_post(parent=root)
+        expected = Thread.objects.values('post_count', 'reply_count', 'last_post_at', 'last_post_author').get()
+        Thread.objects.update(post_count=0, reply_count=0, last_post_at=None, last_post_author=None)
+
+        Thread.recompute_activity()
+        self.assertEqual(Thread.objects.values('post_count', 'reply_count', 'last_post_at', 'last_post_author').get(), expected)
+
+    def test_category_listing_orders_by_activity_in_one_query(self):
+        quiet = Thread.objects.create(title='Quiet', content='...', category=self.category, author=self.user)
+        self.add_post()
+        url = reverse('forum:category_detail', kwargs={'slug': self.category.slug})
+
+        response = self.client.get(url)
+        self.assertEqual([thread.id for thread in response.context['threads']], [self.thread.id, quiet.id])
+        cache.clear()
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+
+class LikeTests(ForumTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = self.add_post()
+        self.client.force_login(self.user)
+        self.url = reverse('forum:like_post')
+
+    def test_toggle_updates_only_the_counter(self):
+        updated_at = Post.objects.get(pk=self.post.pk).updated_at
+
+        response = self.client.post(self.url, {'post_id': self.post.pk})
+        self.assertEqual(response.json(), {'likes_count': 1, 'liked': True})
+        response = self.client.post(self.url, {'post_id': self.post.pk})
+        self.assertEqual(response.json(), {'likes_count': 0, 'liked': False})
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+        self.assertEqual(self.post.updated_at, updated_at)
+
+    def test_unknown_post_is_404(self):
+        response = self.client.post(self.url, {'post_id': self.post.pk + 100})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(PostLike.objects.exists())
+
+    def test_coalesced_likes_are_flushed_in_one_update(self):
+        other = self.add_post()
+        buffer = LikeCountBuffer(flush_interval=60)
+        with self.settings(FORUM_COALESCE_LIKES=True), mock.patch('forum.likes.like_buffer', buffer):
+            response = self.client.post(self.url, {'post_id': self.post.pk})
+            self.client.post(self.url, {'post_id': other.pk})
+
+        self.assertEqual(response.json(), {'likes_count': 1, 'liked': True})
+        self.assertEqual(Post.objects.get(pk=self.post.pk).likes_count, 0)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual([query['sql'].split()[0] for query in queries].count('UPDATE'), 1)
+        self.assertEqual(set(Post.objects.values_list('likes_count', flat=True)), {1})
+
+    @mock.patch('forum.page_cache.cache_is_shared', return_value=True)
+    def test_flushed_likes_invalidate_cached_pages(self, cache_is_shared):
+        buffer = LikeCountBuffer(flush_interval=60)
+        with self.settings(FORUM_COALESCE_LIKES=True), mock.patch('forum.likes.like_buffer', buffer):
+            self.client.post(self.url, {'post_id': self.post.pk})
+        thread_url = reverse('forum:thread_detail', kwargs={'slug': self.thread.slug})
+        likes = f'<span id="likes-count-{self.post.id}" class="text-blue-600">%d</span>'
+        self.assertContains(self.client_class().get(thread_url), likes % 0, html=True)
+
+        buffer.flush()
+        self.assertContains(self.client_class().get(thread_url), likes % 1, html=True)
+
+
+class UnreadCountTests(ForumTestCase):
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create_user(email='sender@example.com', username='sender', password='testpass123')
+
+    def send(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            message = PrivateMessage.objects.create(title='Hi', sender=self.sender, encrypted_content='ENC:')
+            message.recipients.set([self.user])
+        return message
+
+    def test_count_is_cached_until_a_message_arrives_or_is_read(self):
+        self.assertEqual(PrivateMessage.unread_count_for(self.user), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(PrivateMessage.unread_count_for(self.user), 0)
+
+        message = self.send()
+        self.assertEqual(PrivateMessage.unread_count_for(self.user), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            message.mark_as_read(self.user)
+        self.assertEqual(PrivateMessage.unread_count_for(self.user), 0)
+
+    @override_settings(FORUM_LOCAL_CACHE_TIMEOUT=30)
+    def test_per_process_cache_keeps_counts_briefly(self):
+        PrivateMessage.unread_count_for(self.user)
+        key = unread_count_cache_key(self.user.pk)
+        self.assertEqual(cache.get(key), 0)
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 31):
+            self.assertIsNone(cache.get(key))
+
+        with mock.patch('forum.caching.cache_is_shared', return_value=True):
+            self.assertEqual(invalidated_timeout(3600), 3600)
+
+    def test_read_state_is_per_recipient(self):
+        other = User.objects.create_user(email='other@example.com', username='other', password='testpass123')
+        message = self.send()
+        message.recipients.add(other)
+
+        self.assertTrue(message.mark_as_read(self.user))
+        self.assertFalse(message.mark_as_read(self.user))
+        self.assertEqual(PrivateMessage.unread_count_for(self.user), 0)
+        self.assertEqual(PrivateMessage.unread_count_for(other), 1)
+
+    def test_inbox_shows_own_read_state(self):
+        other = User.objects.create_user(email='other@example.com', username='other', password='testpass123')
+        message = self.send()
+        message.recipients.add(other)
+        message.mark_as_read(other)
+
+        self.client.force_login(self.user)
+        with mock.patch.object(PrivateMessage, 'decrypt', return_value='Hello'):
+            response = self.client.get(reverse('forum:inbox'))
+        self.assertEqual([m.read_at for m in response.context['messages_received']], [None])
+
+    def test_context_processor_feeds_every_page(self):
+        self.send()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('forum:user_profile', kwargs={'username': self.sender.username}))
+        self.assertEqual(response.context['unread_count'], 1)
+        self.assertContains(response, 'Inbox (1)')
+
+
+@mock.patch.dict(os.environ, {'MESSAGE_ENCRYPTION_KEY': '00112233445566778899aabbccddeeff'})
+class InboxTests(ForumTestCase):
+    def setUp(self):
+        get_key_ring.cache_clear()
+        self.addCleanup(get_key_ring.cache_clear)
+        self.sender = User.objects.create_user(email='sender@example.com', username='sender', password='testpass123')
+        self.client.force_login(self.user)
+
+    def send(self, content='Hello there'):
+        message = PrivateMessage.objects.create(title='Hi', sender=self.sender, encrypted_content=content)
+        message.recipients.set([self.user])
+        return message
+
+    def test_preview_decrypts_only_a_prefix(self):
+        content = 'Señales de alarma en la disección aórtica ' * 20
+        message = self.send(content)
+        self.assertEqual(message.decrypt(), content.strip())
+        self.assertEqual(message.decrypt(max_chars=51), content[:51].strip())
+
+    def test_inbox_decrypts_current_page_only(self):
+        for _ in range(INBOX_PAGE_SIZE + 5):
+            self.send()
+        with mock.patch.object(PrivateMessage, 'decrypt', autospec=True, return_value='Hello') as decrypt:
+            response = self.client.get(reverse('forum:inbox'))
+        self.assertEqual(decrypt.call_count, INBOX_PAGE_SIZE)
+        self.assertTrue(response.context['messages_received'].has_next())
+
+    def test_titles_only_skips_decryption(self):
+        self.send()
+        with mock.patch.object(PrivateMessage, 'decrypt', autospec=True) as decrypt:
+            response = self.client.get(reverse('forum:inbox'), {'view': 'titles'})
+        decrypt.assert_not_called()
+        self.assertContains(response, 'Hi')
+
+
+class KeyRotationTests(TestCase):
+    old_key = '00112233445566778899aabbccddeeff'
+    new_key = 'ffeeddccbbaa99887766554433221100'
+
+    def setUp(self):
+        get_key_ring.cache_clear()
+        self.addCleanup(get_key_ring.cache_clear)
+        self.user = User.objects.create_user(email='user@example.com', username='testuser', password='testpass123')
+
+    def test_key_id_is_embedded_and_old_keys_still_decrypt(self):
+        legacy = KeyRing.from_environment({'MESSAGE_ENCRYPTION_KEY': self.old_key})
+        ring = KeyRing.from_environment({'MESSAGE_ENCRYPTION_KEY': self.old_key, 'MESSAGE_ENCRYPTION_KEYS': f'2:{self.new_key}'})
+        token = ring.encrypt('Hola')
+
+        self.assertTrue(token.startswith('ENC:2:'))
+        self.assertEqual(ring.decrypt(token), 'Hola')
+        self.assertEqual(ring.decrypt(legacy.encrypt('Adiós')), 'Adiós')
+        self.assertIsNone(ring.reencrypt(token))
+
+    def test_rotate_command_reencrypts_and_checkpoints(self):
+        with mock.patch.dict(os.environ, {'MESSAGE_ENCRYPTION_KEY': self.old_key}):
+            for index in range(5):
+                PrivateMessage.objects.create(title='Hi', sender=self.user, encrypted_content=f'Message {index}')
+        get_key_ring.cache_clear()
+
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint')
+        with mock.patch.dict(os.environ, {'MESSAGE_ENCRYPTION_KEY': self.old_key, 'MESSAGE_ENCRYPTION_KEYS': f'2:{self.new_key}'}):
+            call_command('rotate_message_keys', chunk_size=2, workers=1, checkpoint=checkpoint, stdout=StringIO())
+            messages = list(PrivateMessage.objects.order_by('pk'))
+            self.assertTrue(all(message.encrypted_content.startswith('ENC:2:') for message in messages))
+            self.assertEqual([message.decrypt() for message in messages], [f'Message {index}' for index in range(5)])
+
+        with open(checkpoint) as f:
+            self.assertEqual(int(f.read()), messages[-1].pk)
+
+    def test_workers_run_without_django_under_spawn(self):
+        environ = {'MESSAGE_ENCRYPTION_KEY': self.old_key, 'MESSAGE_ENCRYPTION_KEYS': f'2:{self.new_key}'}
+        token = KeyRing.from_environment({'MESSAGE_ENCRYPTION_KEY': self.old_key}).encrypt('Hola')
+        with mock.patch.dict(os.environ, environ):
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                updated, failed = pool.submit(reencrypt_chunk, [(1, token), (2, 'ENC:9:AAAA')]).result()
+            self.assertEqual(failed, [2])
+            self.assertEqual(get_key_ring().decrypt(updated[0][1]), 'Hola')
+
+
+class ThreadSlugTests(ForumTestCase):
+    def create_thread(self, title='First thread'):
+        return Thread.objects.create(title=title, content='Hello', category=self.category, author=self.user)
+
+    def test_free_slug_needs_no_probe(self):
+        with CaptureQueriesContext(connection) as queries:
+            thread = self.create_thread('Brand new topic')
+        self.assertEqual(thread.slug, 'brand-new-topic')
+        self.assertFalse(any('"slug" =' in query['sql'] and query['sql'].startswith('SELECT') for query in queries))
+
+    def test_conflicting_slug_is_retried_with_suffix(self):
+        thread = self.create_thread()
+        self.assertRegex(thread.slug, r'^first-thread-[0-9a-f]{6}$')
+        self.assertEqual(Thread.objects.count(), 2)
+
+    def test_assign_unique_slugs_in_bulk(self):
+        threads = [Thread(title=title, content='...', category=self.category, author=self.user)
+                   for title in ('First thread', 'Imported', 'Imported')]
+        with self.assertNumQueries(2):
+            Thread.assign_unique_slugs(threads)
+        slugs = [thread.slug for thread in threads]
+        self.assertEqual(slugs[1], 'imported')
+        self.assertEqual(len(set(slugs) | {self.thread.slug}), 4)
+        Thread.objects.bulk_create(threads)
+
+
+class SearchTests(ForumTestCase):
+    def test_matches_threads_and_posts_across_pages(self):
+        thread = Thread.objects.create(title='Arritmias', content='Fibrilación auricular', category=self.category, author=self.user)
+        posts = [self.add_post(thread=thread, content=f'Sobre la fibrilación {index}') for index in range(3)]
+
+        results, cursor = search('fibrilación', page_size=2)
+        self.assertEqual([(result['kind'], result['id']) for result in results], [('thread', thread.id), ('post', posts[2].id)])
+        self.assertEqual(results[1]['url'], f'{thread.get_absolute_url()}#post-{posts[2].id}')
+
+        results, cursor = search('fibrilación', after=cursor, page_size=2)
+        self.assertEqual([result['id'] for result in results], [posts[1].id, posts[0].id])
+        self.assertIsNone(cursor)
+
+    def test_tied_ranks_are_paged_through_once(self):
+        # Identical posts share a rank, wider than a page; on PostgreSQL the
+        # cursor's rank must compare equal to the stored one.
+        posts = [self.add_post(content='Ecocardiograma de control') for _ in range(5)]
+        seen, cursor = [], None
+        for _ in range(len(posts)):
+            results, cursor = search('ecocardiograma', after=cursor, page_size=2)
+            seen += [result['id'] for result in results]
+            if cursor is None:
+                break
+        self.assertIsNone(cursor)
+        self.assertEqual(seen, [post.id for post in reversed(posts)])
+
+    def test_filters_by_section_and_category(self):
+        other_category = Category.objects.create(title='Neurology', section=self.section)
+        Thread.objects.create(title='Ictus', content='...', category=other_category, author=self.user)
+        self.assertEqual(len(search('ictus')[0]), 1)
+        self.assertEqual(search('ictus', category=self.category.slug)[0], [])
+        self.assertEqual(len(search('ictus', section=self.section.slug, category=other_category.slug)[0]), 1)
+        self.assertEqual(search('ictus', section='elsewhere')[0], [])
+
+    def test_snippets_are_escaped(self):
+        self.assertEqual(highlight(f'<b>{MATCH_START}ictus{MATCH_STOP}</b>'), '&lt;b&gt;<mark>ictus</mark>&lt;/b&gt;')
+
+    def test_json_endpoint(self):
+        self.add_post(content='<script>ictus</script>')
+        response = self.client.get(reverse('forum:search_json'), {'q': 'ictus'})
+        data = response.json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertNotIn('<script>', data['results'][0]['snippet'])
+        self.assertIsNone(data['next'])
+
+        response = self.client.get(reverse('forum:search'), {'q': 'ictus'})
+        self.assertContains(response, self.thread.title)
+
+
+class SectionTreeTests(ForumTestCase):
+    def test_home_page_needs_no_queries_when_warm(self):
+        Category.objects.create(title='Neurology', section=Section.objects.create(title='Clinical'))
+        url = reverse('forum:forum_main')
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Cardiology')
+        self.assertContains(response, 'Neurology')
+
+    def test_category_changes_invalidate_the_tree(self):
+        Section.get_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(title='Neurology', section=self.section)
+        self.assertIn(category, Section.get_tree()[0].categories.all())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            category.delete()
+        with self.assertNumQueries(2):
+            self.assertEqual(list(Section.get_tree()[0].categories.all()), [self.category])
+
+    @override_settings(FORUM_LOCAL_CACHE_TIMEOUT=30)
+    def test_per_process_cache_expires_the_tree_version(self):
+        Section.get_tree()
+        # A rename made by another process reaches this one once the version expires.
+        Category.objects.filter(pk=self.category.pk).update(title='Cardiología')
+        self.assertEqual(Section.get_tree()[0].categories.all()[0].title, 'Cardiology')
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 31):
+            self.assertEqual(Section.get_tree()[0].categories.all()[0].title, 'Cardiología')
+
+
+class PageCacheTests(ForumTestCase):
+    def setUp(self):
+        super().setUp()
+        # The tests run in one process, so the local-memory cache is as good as a shared one.
+        patcher = mock.patch('forum.page_cache.cache_is_shared', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_anonymous_thread_page_is_cached_until_a_write(self):
+        url = reverse('forum:thread_detail', kwargs={'slug': self.thread.slug})
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertIn('Cookie', response['Vary'])
+
+        self.add_post(content='Fresh reply')
+        self.assertContains(self.client.get(url), 'Fresh reply')
+
+        other_order = self.client.get(url, {'order_posts_by': 'likes_count'})
+        self.assertContains(other_order, 'Fresh reply')
+
+    def test_likes_and_new_threads_invalidate_pages(self):
+        post = self.add_post()
+        thread_url = reverse('forum:thread_detail', kwargs={'slug': self.thread.slug})
+        category_url = reverse('forum:category_detail', kwargs={'slug': self.category.slug})
+        self.client.get(thread_url)
+        self.client.get(category_url)
+
+        PostLike.objects.create(post=post, user=self.user)
+        Post.objects.filter(pk=post.pk).update(likes_count=1)
+        self.assertContains(self.client.get(thread_url), f'<span id="likes-count-{post.id}" class="text-blue-600">1</span>', html=True)
+
+        Thread.objects.create(title='Second thread', content='...', category=self.category, author=self.user)
+        self.assertContains(self.client.get(category_url), 'Second thread')
+
+    def test_per_process_cache_disables_page_caching(self):
+        url = reverse('forum:thread_detail', kwargs={'slug': self.thread.slug})
+        self.client.get(url)
+        with mock.patch('forum.page_cache.cache_is_shared', return_value=False), CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertTrue(queries)
+
+    def test_logged_in_users_bypass_the_cache(self):
+        url = reverse('forum:thread_detail', kwargs={'slug': self.thread.slug})
+        self.client.get(url)
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertContains(response, 'New Post')  # The post form is only shown to members.
+        self.assertIn('Authorization', response['Vary'])
+
+
+class ForumAPITests(ForumTestCase):
+    def test_sections_and_category_threads(self):
+        sections = self.client.get(reverse('forum:api_sections')).json()
+        self.assertEqual(sections[0]['categories'][0]['slug'], self.category.slug)
+
+        self.add_post()
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('forum:api_category_threads', kwargs={'slug': self.category.slug}))
+        thread = response.json()['results'][0]
+        self.assertEqual((thread['slug'], thread['post_count'], thread['last_post_author']), (self.thread.slug, 1, 'testuser'))
+
+    def test_thread_tree_and_paginated_posts(self):
+        root = self.add_post()
+        reply = self.add_post(parent=root)
+        tree = self.client.get(reverse('forum:api_thread_detail', kwargs={'slug': self.thread.slug})).json()
+        self.assertEqual(tree['posts'][0]['replies'][0]['id'], reply.id)
+
+        posts = self.client.get(reverse('forum:api_thread_posts', kwargs={'slug': self.thread.slug})).json()
+        self.assertEqual([post['id'] for post in posts['results']], [root.id, reply.id])
+
+    def test_conditional_get_is_answered_with_one_query(self):
+        post = self.add_post()
+        url = reverse('forum:api_thread_detail', kwargs={'slug': self.thread.slug})
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # The ETag follows the data, not this process's cache.
+        cache.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Post.objects.filter(pk=post.pk).update(likes_count=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.add_post()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_unknown_slugs_get_a_plain_404(self):
+        for name in ('api_thread_detail', 'api_thread_posts', 'api_category_threads'):
+            url = reverse(f'forum:{name}', kwargs={'slug': 'missing'})
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404)
+            self.assertNotIn('ETag', response)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, 404)
+
+    def test_category_and_section_etags_follow_writes(self):
+        threads_url = reverse('forum:api_category_threads', kwargs={'slug': self.category.slug})
+        sections_url = reverse('forum:api_sections')
+        threads_etag = self.client.get(threads_url)['ETag']
+        sections_etag = self.client.get(sections_url)['ETag']
+        self.assertEqual(self.client.get(threads_url, HTTP_IF_NONE_MATCH=threads_etag).status_code, 304)
+
+        self.add_post()
+        Category.objects.filter(pk=self.category.pk).update(title='Cardiología')
+        self.assertEqual(self.client.get(threads_url, HTTP_IF_NONE_MATCH=threads_etag).status_code, 200)
+        self.assertNotEqual(self.client.get(sections_url)['ETag'], sections_etag)
+
+
+@override_settings(ROOT_URLCONF='vimiapi.asgi_urls', FORUM_PAGE_CACHE=False)
+class AsyncViewTests(ForumTestCase):
+    async def test_thread_detail(self):
+        root = await Post.objects.acreate(thread=self.thread, author=self.user, content='Root post')
+        await Post.objects.acreate(thread=self.thread, author=self.user, content='Nested reply', parent=root)
+        response = await AsyncClient().get(reverse('forum:thread_detail', kwargs={'slug': self.thread.slug}))
+        self.assertContains(response, 'Root post')
+        self.assertContains(response, 'Nested reply')
+
+    async def test_thread_detail_for_the_author(self):
+        liked = await Post.objects.acreate(thread=self.thread, author=self.user, content='Liked post')
+        other = await Post.objects.acreate(thread=self.thread, author=self.user, content='Other post')
+        await PostLike.objects.acreate(post=liked, user=self.user)
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get(reverse('forum:thread_detail', kwargs={'slug': self.thread.slug}))
+
+        self.assertContains(response, 'id="edit-button"')
+        self.assertEqual(response.context['liked_posts'], {liked.id})
+        self.assertNotIn(other.id, response.context['liked_posts'])
+
+        stranger = await User.objects.acreate(email='stranger@example.com', username='stranger')
+        await client.aforce_login(stranger)
+        response = await client.get(reverse('forum:thread_detail', kwargs={'slug': self.thread.slug}))
+        self.assertNotContains(response, 'id="edit-button"')
+        self.assertEqual(response.context['liked_posts'], set())
+
+    async def test_category_detail(self):
+        response = await AsyncClient().get(reverse('forum:category_detail', kwargs={'slug': self.category.slug}))
+        self.assertContains(response, self.thread.title)
+
+    async def test_inbox_and_unread_count(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        get_key_ring.cache_clear()
+        self.addCleanup(get_key_ring.cache_clear)
+        with mock.patch.dict(os.environ, {'MESSAGE_ENCRYPTION_KEY': '00' * 16}):
+            sender = await User.objects.acreate(email='sender@example.com', username='sender')
+            message = await PrivateMessage.objects.acreate(title='Guardia', sender=sender, encrypted_content='Hola')
+            await message.recipients.aadd(self.user)
+            response = await client.get(reverse('forum:inbox'))
+        self.assertContains(response, 'Guardia')
+        self.assertContains(response, 'Inbox (1)')
+
+        response = await client.get(reverse('forum:unread_count'))
+        self.assertEqual(response.json(), {'unread_count': 1})
+        response = await AsyncClient().get(reverse('forum:inbox'))
+        self.assertEqual(response.status_code, 302)
+
+
+class ThreadEventTests(ForumTestCase):
+    async def test_local_broker_fans_out_and_resets_slow_readers(self):
+        broker = LocalBroker(max_queue=2)
+        async with broker.subscribe('thread:1') as first, broker.subscribe('thread:1') as second:
+            await asyncio.to_thread(broker.publish, 'thread:1', {'type': 'likes'})
+            broker.publish('thread:2', {'type': 'post'})
+            self.assertEqual(await asyncio.wait_for(first.get(), 1), {'type': 'likes'})
+            for _ in range(2):
+                broker.publish('thread:1', {'type': 'post'})
+            await asyncio.sleep(0)
+            self.assertEqual([second.get_nowait() for _ in range(2)], [{'type': 'post'}, {'type': 'reset'}])
+        self.assertFalse(broker._subscribers)
+
+    def test_posts_and_likes_are_published_on_commit(self):
+        with mock.patch('forum.events.get_broker') as get_broker_mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                post = self.add_post(content='Live')
+            self.client.force_login(self.user)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('forum:like_post'), {'post_id': post.id})
+        events = [call.args for call in get_broker_mock.return_value.publish.call_args_list]
+        self.assertEqual([(channel, event['type']) for channel, event in events],
+                         [(thread_channel(self.thread.id), 'post'), (thread_channel(self.thread.id), 'likes')])
+        self.assertEqual(events[0][1]['content'], 'Live')
+        self.assertEqual(events[1][1]['likes_count'], 1)
+
+    @override_settings(ROOT_URLCONF='vimiapi.asgi_urls')
+    async def test_event_stream(self):
+        get_broker.cache_clear()
+        self.addCleanup(get_broker.cache_clear)
+        response = await AsyncClient().get(reverse('forum:thread_events', kwargs={'slug': self.thread.slug}))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+
+        get_broker().publish(thread_channel(self.thread.id), {'type': 'likes', 'id': 1, 'likes_count': 3})
+        self.assertEqual(await anext(stream), b'event: likes\ndata: {"type": "likes", "id": 1, "likes_count": 3}\n\n')
+        await response._iterator.aclose()
+
+    @override_settings(ROOT_URLCONF='vimiapi.asgi_urls')
+    async def test_event_stream_releases_its_database_connection(self):
+        with mock.patch('forum.async_views.connection', in_atomic_block=False) as connection_mock:
+            response = await AsyncClient().get(reverse('forum:thread_events', kwargs={'slug': self.thread.slug}))
+            connection_mock.close.assert_called_once_with()
+        await response._iterator.aclose()
+
+
+@mock.patch.dict(os.environ, {'MESSAGE_ENCRYPTION_KEY': '00112233445566778899aabbccddeeff'})
+class SeedAndBenchmarkTests(TestCase):
+    def setUp(self):
+        get_key_ring.cache_clear()
+        self.addCleanup(get_key_ring.cache_clear)
+        cache.clear()
+
+    def test_seeded_data_is_consistent(self):
+        created = seed_forum(SeedScale(users=5, sections=1, categories=2, threads=3, posts=8, messages=4), seed=1)
+
+        self.assertEqual((created['users'], created['categories'], created['threads']), (5, 2, 6))
+        self.assertEqual(Post.objects.count(), created['posts'])
+        self.assertFalse(Post.objects.filter(path='').exists())
+        for post in Post.objects.filter(parent__isnull=False).select_related('parent')[:20]:
+            self.assertTrue(post.path.startswith(post.parent.path))
+            self.assertEqual(post.depth, post.parent.depth + 1)
+        for thread in Thread.objects.all():
+            self.assertEqual(thread.post_count, thread.posts.count())
+        for post in Post.objects.all():
+            self.assertEqual(post.likes_count, post.likes.count())
+        message = PrivateMessage.objects.first()
+        self.assertTrue(1 <= message.recipients.count() <= 4)
+        self.assertNotIn(message.sender, message.recipients.all())
+        self.assertTrue(message.decrypt())
+
+    @override_settings(FORUM_PAGE_CACHE=False, REQUEST_TIMING_SLOW_THRESHOLD=60)
+    def test_views_stay_within_query_budgets(self):
+        self.assertEqual(uncovered_url_names(), [])
+        seed_forum(SCALES['small'], seed=0)
+        fixtures = Fixtures.pick()
+        for case in CASES:
+            with self.subTest(case.label):
+                self.assertEqual(run_case(case, fixtures, requests=1).failures, [])
+
+
+class ImportTests(ForumTestCase):
+    def dump(self, *records):
+        return [json.dumps(record) for record in records]
+
+    def records(self):
+        return [
+            {'type': 'user', 'id': 10, 'username': 'testuser', 'email': 'old@example.com', 'password': 'pbkdf2_sha256$1$x$y'},
+            {'type': 'user', 'id': 11, 'username': 'same', 'email': 'user@example.com'},
+            {'type': 'section', 'id': 1, 'title': 'General', 'slug': self.section.slug},
+            {'type': 'category', 'id': 1, 'section': 1, 'title': 'Neumología'},
+            {'type': 'thread', 'id': 1, 'category': 1, 'author': 10, 'title': 'Old', 'slug': self.thread.slug,
+             'content': 'Imported', 'created_at': '2019-05-02T10:00:00+00:00'},
+            # A reply listed before its parent.
+            {'type': 'post', 'id': 2, 'thread': 1, 'author': 11, 'parent': 1, 'content': 'Reply',
+             'created_at': '2019-05-03T10:00:00+00:00'},
+            {'type': 'post', 'id': 1, 'thread': 1, 'author': 10, 'parent': None, 'content': 'Root',
+             'created_at': '2019-05-02T11:00:00+00:00'},
+            {'type': 'like', 'post': 1, 'user': 10},
+            {'type': 'like', 'post': 1, 'user': 11},
+            {'type': 'like', 'post': 1, 'user': 11},
+        ]
+
+    def test_import_links_records_and_recomputes_counters(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as dump:
+            dump.write('\n'.join(self.dump(*self.records())))
+        self.addCleanup(os.remove, dump.name)
+        with mock.patch.object(Thread, 'save') as save, mock.patch.object(Post, 'save') as post_save:
+            call_command('import_forum', dump.name, batch_size=2, stdout=StringIO())
+        save.assert_not_called()
+        post_save.assert_not_called()
+
+        imported = User.objects.get(email='old@example.com')
+        self.assertEqual(imported.username, 'testuser_10')
+        self.assertEqual(Section.objects.count(), 1)
+        thread = Thread.objects.get(title='Old')
+        self.assertNotEqual(thread.slug, self.thread.slug)
+        self.assertEqual((thread.category.title, thread.category.section), ('Neumología', self.section))
+        self.assertEqual(thread.created_at.year, 2019)
+        root, reply = Post.objects.filter(thread=thread).order_by('created_at')
+        self.assertEqual((reply.parent, reply.depth), (root, 1))
+        self.assertTrue(reply.path.startswith(root.path))
+        self.assertEqual(root.likes_count, 2)
+        self.assertEqual((thread.post_count, thread.reply_count, thread.last_post_at), (2, 1, reply.created_at))
+        self.assertEqual(imported.forum_messages, 2)
+        self.assertEqual(User.objects.get(pk=self.user.pk).forum_messages, 2)  # Their thread and the reply.
+        self.assertTrue(Thread._meta.get_field('created_at').auto_now_add)
+
+    def test_unknown_references_abort_the_import(self):
+        records = self.records()
+        records[5]['parent'] = 99
+        with self.assertRaisesMessage(DumpError, 'Line 6: unknown post 99'), transaction.atomic():
+            import_dump(self.dump(*records))
+
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as dump:
+            dump.write('\n'.join(self.dump(*records)))
+        self.addCleanup(os.remove, dump.name)
+        with self.assertRaisesMessage(CommandError, 'unknown post 99'):
+            call_command('import_forum', dump.name, stdout=StringIO())
+        self.assertFalse(Thread.objects.filter(title='Old').exists())
+
+    def test_invalid_parents_abort_the_import(self):
+        cases = [
+            ('own parent', {7: {'parent': 1}}, [], 'Line 8: post 1 is its own parent'),
+            ('cycle', {7: {'parent': 2}}, [], 'Line 7: posts'),
+            ('later parent in another thread', {7: {'thread': 2}}, [],
+             'Line 7: parent post 1 belongs to another thread'),
+            ('earlier parent in another thread', {}, [
+                {'type': 'post', 'id': 3, 'thread': 2, 'author': 10, 'parent': 1, 'content': 'Moved'},
+            ], 'Line 12: parent post 1 belongs to another thread'),
+        ]
+        for label, changes, extra, message in cases:
+            with self.subTest(label):
+                records = self.records() + extra
+                records.insert(5, {'type': 'thread', 'id': 2, 'category': 1, 'author': 10, 'title': 'Other', 'content': 'Imported'})
+                for index, change in changes.items():
+                    records[index].update(change)
+                with self.assertRaisesMessage(DumpError, message), transaction.atomic():
+                    import_dump(self.dump(*records), batch_size=1)
+        self.assertFalse(Thread.objects.filter(title='Old').exists())
+
+
+class ExportTests(ForumTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.add_post(content='Raíz')
+        self.reply = self.add_post(parent=self.root)
+        PostLike.objects.create(post=self.root, user=self.user)
+
+    def test_export_round_trips_through_import(self):
+        lines = list(export_lines(batch_size=1))
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([record['type'] for record in records], ['user', 'section', 'category', 'thread', 'post', 'post', 'like'])
+        self.assertNotIn('password', records[0])
+        created_at = {record['id']: record['created_at'] for record in records if record['type'] == 'post'}
+
+        Section.objects.all().delete()
+        with transaction.atomic():
+            import_dump(lines)
+
+        thread = Thread.objects.get()
+        self.assertEqual((thread.slug, thread.post_count, thread.category.title), (self.thread.slug, 2, 'Cardiology'))
+        root, reply = Post.objects.order_by('created_at')
+        self.assertEqual((root.content, root.likes_count, reply.parent, reply.depth), ('Raíz', 1, root, 1))
+        self.assertEqual(root.created_at.isoformat(), created_at[self.root.pk])
+        self.assertEqual(User.objects.get().forum_messages, 3)
+
+    def test_staff_endpoint_streams_the_dump(self):
+        url = reverse('forum:export_dump')
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(User.objects.create_user(
+            email='staff@example.com', username='staff', password='pass', is_staff=True,
+        ))
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        plain = b''.join(response.streaming_content)
+        response = self.client.get(url, {'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+        self.assertEqual(len(plain.splitlines()), 8)
+
+    def test_command_writes_gzip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'forum.jsonl.gz')
+            call_command('export_forum', path, '--with-passwords', stdout=StringIO())
+            with gzip.open(path, 'rt', encoding='utf-8') as dump:
+                user = json.loads(dump.readline())
+        self.assertEqual(user['password'], self.user.password)
+
+
+class AsyncExportTests(TransactionTestCase):
+    # The dump is read in a thread of its own, which only sees committed rows.
+    def setUp(self):
+        self.staff = User.objects.create_user(email='staff@example.com', username='staff', password='pass', is_staff=True)
+        category = Category.objects.create(title='Cardiology', section=Section.objects.create(title='General'))
+        Thread.objects.create(title='Streamed', content='Hello', category=category, author=self.staff)
+
+    async def test_asgi_streams_the_dump_asynchronously(self):
+        client = AsyncClient()
+        await client.aforce_login(self.staff)
+        response = await client.get(reverse('forum:export_dump'), {'gzip': '1'})
+        # An async body is sent as it is produced; a sync one would be read whole first.
+        self.assertTrue(response.is_async)
+        compressed = b''.join([chunk async for chunk in response.streaming_content])
+        records = [json.loads(line) for line in gzip.decompress(compressed).splitlines()]
+        self.assertEqual([record['type'] for record in records], ['user', 'section', 'category', 'thread'])
@@ -0,0 +1,211 @@
+import asyncio
+import base64
+import json
+from collections import defaultdict
+from datetime import datetime
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+
+from .models import Post
+
+ORDERING_FIELDS = ('created_at', 'likes_count')
+
+
+def parse_ordering(field, direction, default_direction='asc'):
+    """
+    Turn an ``order_*_by`` / ``order_*_direction`` pair from the query string
+    into an ``order_by`` style string, falling back to ``created_at`` for
+    unknown fields.
+    """
+    if field not in ORDERING_FIELDS:
+        field = 'created_at'
+    if direction not in ('asc', 'desc'):
+        direction = default_direction
+    return f"{'-' if direction == 'desc' else ''}{field}"
+
+
+def sort_posts(posts, ordering):
+    """
+    Sort ``posts`` in memory by a model field, Django ``order_by`` style
+    (``'-likes_count'`` for descending). Ties are broken by id.
+    """
+    field = ordering.lstrip('-')
+    return sorted(posts, key=lambda post: (getattr(post, field), post.id), reverse=ordering.startswith('-'))
+
+
+def encode_cursor(post, ordering):
+    """Build the opaque ``after`` cursor pointing just past ``post``."""
+    value = getattr(post, ordering.lstrip('-'))
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, post.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering):
+    """
+    Return the ``(value, id)`` pair stored in ``cursor``, or ``None`` when the
+    cursor is missing or malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if ordering.lstrip('-') == 'created_at':
+            value = datetime.fromisoformat(value)
+        return int(value) if ordering.lstrip('-') == 'likes_count' else value, int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def link_posts(posts, reply_orderings=None, max_depth=None, hidden_parents=()):
+    """
+    Attach a ``children`` list to every post of ``posts`` and return the
+    posts whose parent is not part of ``posts``.
+
+    Replies are sorted with ``reply_orderings[parent_id]`` (creation order by
+    default) and every post is annotated with the ``order_replies_by`` /
+    ``order_replies_direction`` values the templates render. Posts at
+    ``max_depth`` that have unloaded replies (ids in ``hidden_parents``) get
+    ``has_hidden_replies`` set.
+    """
+    reply_orderings = reply_orderings or {}
+    loaded = {post.id for post in posts}
+
+    children = defaultdict(list)
+    tops = []
+    for post in posts:
+        if post.parent_id in loaded:
+            children[post.parent_id].append(post)
+        else:
+            tops.append(post)
+
+    for post in posts:
+        ordering = reply_orderings.get(post.id, 'created_at')
+        post.order_replies_by = ordering.lstrip('-')
+        post.order_replies_direction = 'desc' if ordering.startswith('-') else 'asc'
+        post.children = sort_posts(children.get(post.id, []), ordering)
+        post.has_hidden_replies = max_depth is not None and post.depth == max_depth and post.id in hidden_parents
+
+    return tops
+
+
+def load_post_tree(thread, ordering='created_at', reply_orderings=None, max_depth=None):
+    """
+    Fetch the posts of ``thread`` together with their authors in a single
+    query and link the replies in memory.
+
+    ``max_depth`` limits the tree to the first levels (roots are depth 0);
+    one extra query then flags the posts whose replies were cut off so they
+    can be expanded on demand. The root posts are returned sorted by
+    ``ordering``.
+    """
+    posts = Post.objects.filter(thread=thread).select_related('author')
+    hidden_parents = set()
+    if max_depth is not None:
+        posts = posts.filter(depth__lte=max_depth)
+        hidden_parents = set(
+            Post.objects.filter(thread=thread, depth=max_depth + 1).values_list('parent_id', flat=True).distinct()
+        )
+
+    roots = link_posts(list(posts), reply_orderings, max_depth, hidden_parents)
+    return sort_posts(roots, ordering)
+
+
+def load_subtree(post, reply_orderings=None, max_depth=None):
+    """
+    Load the replies below ``post`` through its path prefix, attaching them to
+    ``post.children``. ``max_depth`` is relative to ``post``.
+    """
+    posts = Post.objects.filter(thread_id=post.thread_id, path__startswith=post.path).select_related('author')
+    hidden_parents = set()
+    if max_depth is not None:
+        limit = post.depth + max_depth
+        posts = posts.filter(depth__lte=limit)
+        hidden_parents = set(
+            Post.objects.filter(path__startswith=post.path, depth=limit + 1).values_list('parent_id', flat=True).distinct()
+        )
+        max_depth = limit
+
+    posts = list(posts)
+    link_posts(posts, reply_orderings, max_depth, hidden_parents)
+    return next(node for node in posts if node.id == post.id)
+
+
+def root_page_queryset(thread, ordering='created_at', after=None, page_size=20):
+    """
+    Keyset query for a page of the root posts of ``thread``: ordered by
+    ``ordering`` with ties broken by id, starting after the ``after`` cursor.
+    It fetches one extra row so ``paginate_roots`` can tell if a next page exists.
+    """
+    field = ordering.lstrip('-')
+    descending = ordering.startswith('-')
+    roots = thread.posts.filter(parent__isnull=True).select_related('author')
+
+    position = decode_cursor(after, ordering)
+    if position is not None:
+        value, pk = position
+        lookup = 'lt' if descending else 'gt'
+        roots = roots.filter(Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'id__{lookup}': pk}))
+    return roots.order_by(ordering, f"{'-' if descending else ''}id")[:page_size + 1]
+
+
+def paginate_roots(roots, ordering, page_size):
+    """Split the rows of ``root_page_queryset`` into ``(roots, next_cursor)``."""
+    next_cursor = encode_cursor(roots[page_size - 1], ordering) if len(roots) > page_size else None
+    return roots[:page_size], next_cursor
+
+
+def reply_querysets(thread, roots, max_depth=None):
+    """
+    Return the query for the replies below ``roots`` and, with ``max_depth``,
+    the query for the ids of the posts whose replies are cut off (else ``None``).
+    """
+    in_page = reduce(or_, (Q(path__startswith=Post.encode_path_step(root.id)) for root in roots))
+    replies = Post.objects.filter(in_page, thread=thread, depth__gt=0).select_related('author')
+    if max_depth is None:
+        return replies, None
+    hidden_parents = Post.objects.filter(in_page, thread=thread, depth=max_depth + 1).values_list('parent_id', flat=True).distinct()
+    return replies.filter(depth__lte=max_depth), hidden_parents
+
+
+def load_post_page(thread, ordering='created_at', after=None, page_size=20, reply_orderings=None, max_depth=None):
+    """
+    Keyset-paginate the root posts of ``thread`` and load the replies of the
+    page's roots.
+
+    Roots are ordered by ``ordering`` with ties broken by id, and ``after`` is
+    a cursor from a previous page, so every page is an index range scan no
+    matter how deep into the thread it is. Returns ``(roots, next_cursor)``;
+    ``next_cursor`` is ``None`` on the last page.
+    """
+    roots, next_cursor = paginate_roots(list(root_page_queryset(thread, ordering, after, page_size)), ordering, page_size)
+    if not roots:
+        return [], None
+
+    replies, hidden_parents = reply_querysets(thread, roots, max_depth)
+    hidden_parents = set(hidden_parents) if hidden_parents is not None else set()
+    link_posts(roots + list(replies), reply_orderings, max_depth, hidden_parents)
+    return roots, next_cursor
+
+
+async def aload_post_page(thread, ordering='created_at', after=None, page_size=20, reply_orderings=None, max_depth=None):
+    """
+    Async ``load_post_page``. The replies and cut-off queries are gathered,
+    but Django runs them one after another in its thread-sensitive executor.
+    """
+    roots = [post async for post in root_page_queryset(thread, ordering, after, page_size)]
+    roots, next_cursor = paginate_roots(roots, ordering, page_size)
+    if not roots:
+        return [], None
+
+    replies, hidden_parents = reply_querysets(thread, roots, max_depth)
+
+    async def fetch(queryset):
+        return [row async for row in queryset] if queryset is not None else []
+
+    replies, hidden_parents = await asyncio.gather(fetch(replies), fetch(hidden_parents))
+    link_posts(roots + replies, reply_orderings, max_depth, set(hidden_parents))
+    return roots, next_cursor
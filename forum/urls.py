@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, async_views, views
 
 app_name = 'forum'
 
@@ -9,13 +9,34 @@ urlpatterns = [
     path('category/<slug:slug>/new_thread/', views.ThreadCreateView.as_view(), name='thread_create'),
     path('thread/<slug:slug>/', views.ThreadDetailView.as_view(), name='thread_detail'),
     path('thread/<slug:thread_slug>/add_post/', views.add_post, name='add_post'),
+    path('thread/<slug:thread_slug>/post/<int:pk>/replies/', views.post_replies, name='post_replies'),
+    path('search/', views.search, name='search'),
+    path('search/json/', views.search_json, name='search_json'),
     path('login/', views.custom_login, name='custom_login'),
     path('logout/', views.custom_logout, name='custom_logout'),
     path('user/<str:username>/', views.UserProfileView.as_view(), name='user_profile'),
     path('inbox/', views.inbox, name='inbox'),
+    path('inbox/unread-count/', views.unread_count, name='unread_count'),
     path('send_message/', views.send_message, name='send_message'),
     path('send_message/<str:username>/', views.send_message, name='send_message_with_username'),
     path('message/<int:pk>/', views.message_detail, name='message_detail'),
     path('check-key/', views.check_key, name='check_key'),
     path('post/like/', views.like_post, name='like_post'),
+    path('export/', views.export_dump, name='export_dump'),
+    path('api/sections/', api.SectionListView.as_view(), name='api_sections'),
+    path('api/categories/', api.CategoryListView.as_view(), name='api_categories'),
+    path('api/categories/<slug:slug>/threads/', api.CategoryThreadListView.as_view(), name='api_category_threads'),
+    path('api/threads/<slug:slug>/', api.ThreadDetailAPIView.as_view(), name='api_thread_detail'),
+    path('api/threads/<slug:slug>/posts/', api.ThreadPostListView.as_view(), name='api_thread_posts'),
+]
+
+# Native async views for the read-heavy pages. The ASGI URLconf
+# (vimiapi.asgi_urls) lists them ahead of urlpatterns, shadowing the sync ones.
+async_urlpatterns = [
+    path('category/<slug:slug>/', async_views.category_detail, name='category_detail'),
+    path('thread/<slug:slug>/', async_views.thread_detail, name='thread_detail'),
+    path('inbox/', async_views.inbox, name='inbox'),
+    path('inbox/unread-count/', async_views.unread_count, name='unread_count'),
+    # Streaming responses would pin a WSGI worker per reader: ASGI only.
+    path('thread/<slug:slug>/events/', async_views.thread_events, name='thread_events'),
 ]
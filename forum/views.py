@@ -1,35 +1,45 @@
+from itertools import chain
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import Paginator
 from django.views.generic import ListView, DetailView
 from django.views.generic.edit import CreateView
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from .models import Section, Category, Thread, Post, PrivateMessage, PostLike
 from django.contrib.auth import get_user_model
+from .dumps import aiterate_in_thread, encoded_chunks, export_lines, gzip_stream
 from .forms import PrivateMessageForm
-from django.http import JsonResponse
+from .likes import toggle_like
+from .page_cache import cache_anonymous_page
+from .search import search as search_forum
+from .trees import load_post_page, load_subtree, parse_ordering
+from django.db.models import F
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from django.contrib.auth import authenticate, login
+from django.contrib.auth import authenticate, login, logout
 
 
 User = get_user_model()
 
+INBOX_PAGE_SIZE = 20
+INBOX_PREVIEW_CHARS = 50
+SEARCH_PAGE_SIZE = 20
+
 class ForumMainView(ListView):
     model = Section
     template_name = 'forum/forum_main.html'
     context_object_name = 'sections'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['sections'] = Section.objects.all()
-
-        if self.request.user.is_authenticated:
-            context['unread_count'] = PrivateMessage.objects.filter(recipients=self.request.user, read=False).count()
-        else:
-            context['unread_count'] = 0
-
-        return context
+    def get_queryset(self):
+        return Section.get_tree()
 
+@method_decorator(cache_anonymous_page('category'), name='dispatch')
 class CategoryDetailView(DetailView):
     model = Category
     template_name = 'forum/category_detail.html'
@@ -37,53 +47,84 @@ class CategoryDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['threads'] = self.object.threads.all()
-
-        if self.request.user.is_authenticated:
-            context['unread_count'] = PrivateMessage.objects.filter(recipients=self.request.user, read=False).count()
-        else:
-            context['unread_count'] = 0
-
+        context['threads'] = category_threads(self.object)
         return context
 
+def category_threads(category):
+    """Threads of ``category`` for its listing page, most recently active first."""
+    return category.threads.select_related('last_post_author').defer('content').order_by('-last_post_at')
+
+def get_reply_orderings(request):
+    """
+    Collect the per-post ``order_replies_by_<id>`` / ``order_replies_direction_<id>``
+    query parameters into a ``{post_id: ordering}`` mapping.
+    """
+    orderings = {}
+    for key, value in request.GET.items():
+        if key.startswith('order_replies_by_') and key[17:].isdigit():
+            post_id = key[17:]
+            direction = request.GET.get(f'order_replies_direction_{post_id}')
+            orderings[int(post_id)] = parse_ordering(value, direction)
+    return orderings
+
+def get_posts_ordering(request):
+    """Ordering of a thread's root posts; likes default to most liked first."""
+    order_posts_by = request.GET.get('order_posts_by', 'created_at')
+    default_direction = 'desc' if order_posts_by == 'likes_count' else 'asc'
+    return parse_ordering(order_posts_by, request.GET.get('order_posts_direction'), default_direction)
+
+def get_page_urls(request, next_cursor):
+    """``first_page_url`` / ``next_page_url`` of a cursor-paginated page, keeping the other query parameters."""
+    urls = {}
+    # Cursors are opaque; the other query parameters (orderings) are kept.
+    query = request.GET.copy()
+    query.pop('after', None)
+    urls['first_page_url'] = f'?{query.urlencode()}' if 'after' in request.GET else None
+    if next_cursor:
+        query['after'] = next_cursor
+        urls['next_page_url'] = f'?{query.urlencode()}'
+    return urls
+
+def thread_max_depth():
+    """
+    Reply levels rendered up front (``FORUM_THREAD_MAX_DEPTH``); deeper
+    replies are loaded through post_replies. ``None`` renders whole trees.
+    """
+    return getattr(settings, 'FORUM_THREAD_MAX_DEPTH', 3)
+
+def liked_posts_query(user, thread):
+    return PostLike.objects.filter(user=user, post__thread=thread).values_list('post_id', flat=True)
+
 @method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(cache_anonymous_page('thread'), name='dispatch')
 class ThreadDetailView(DetailView):
     model = Thread
+    queryset = Thread.objects.select_related('category')
     template_name = 'forum/thread_detail.html'
     context_object_name = 'thread'
+    posts_per_page = 20
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        thread = self.get_object()
+        thread = self.object
         context['category'] = thread.category
 
-        # Set default ordering
-        order_posts_by = self.request.GET.get('order_posts_by', 'created_at')
-        order_posts_direction = self.request.GET.get('order_posts_direction', 'asc')
-        
-        if order_posts_by == 'likes_count':
-            order_posts_direction = self.request.GET.get('order_posts_direction', 'desc')  # Default to likes descending
-
-        posts_ordering = f"{'-' if order_posts_direction == 'desc' else ''}{order_posts_by}"
-        context['posts'] = self.object.posts.filter(parent__isnull=True).order_by(posts_ordering)
+        posts_ordering = get_posts_ordering(self.request)
+        context['posts'], next_cursor = load_post_page(
+            thread, posts_ordering, self.request.GET.get('after'), self.posts_per_page,
+            get_reply_orderings(self.request), thread_max_depth(),
+        )
         context['can_edit'] = self.request.user == thread.author
+        context.update(get_page_urls(self.request, next_cursor))
 
         if self.request.user.is_authenticated:
-            context['unread_count'] = PrivateMessage.objects.filter(recipients=self.request.user, read=False).count()
-            liked_posts = PostLike.objects.filter(user=self.request.user, post__thread=thread).values_list('post_id', flat=True)
-            context['liked_posts'] = set(liked_posts)
+            context['liked_posts'] = set(liked_posts_query(self.request.user, thread))
         else:
-            context['unread_count'] = 0
             context['liked_posts'] = set()
 
         # Pass ordering options to the context
-        context['order_posts_by'] = order_posts_by
-        context['order_posts_direction'] = order_posts_direction
-
-        # Add ordering context for each post's replies
-        for post in context['posts']:
-            post.order_replies_by = self.request.GET.get(f'order_replies_by_{post.id}', 'created_at')
-            post.order_replies_direction = self.request.GET.get(f'order_replies_direction_{post.id}', 'asc')
+        context['order_posts_by'] = posts_ordering.lstrip('-')
+        context['order_posts_direction'] = 'desc' if posts_ordering.startswith('-') else 'asc'
 
         return context
 
@@ -131,20 +172,8 @@ class ThreadDetailView(DetailView):
 @csrf_exempt
 def like_post(request):
     if request.method == 'POST':
-        post_id = request.POST.get('post_id')
-        post = get_object_or_404(Post, id=post_id)
-        user = request.user
-        
-        like, created = PostLike.objects.get_or_create(post=post, user=user)
-        if not created:
-            like.delete()
-            post.likes_count = post.likes.count()
-            post.save()
-            return JsonResponse({'likes_count': post.likes_count, 'liked': False})
-        else:
-            post.likes_count = post.likes.count()
-            post.save()
-            return JsonResponse({'likes_count': post.likes_count, 'liked': True})
+        liked, likes_count = toggle_like(request.POST.get('post_id'), request.user)
+        return JsonResponse({'likes_count': likes_count, 'liked': liked})
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 class ThreadCreateView(CreateView):
@@ -168,16 +197,6 @@ class UserProfileView(DetailView):
     def get_object(self):
         return get_object_or_404(User, username=self.kwargs['username'])
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-
-        if self.request.user.is_authenticated:
-            context['unread_count'] = PrivateMessage.objects.filter(recipients=self.request.user, read=False).count()
-        else:
-            context['unread_count'] = 0
-
-        return context
-
 @login_required(login_url='/forum/')
 def add_post(request, thread_slug):
     thread = get_object_or_404(Thread, slug=thread_slug)
@@ -185,12 +204,57 @@ def add_post(request, thread_slug):
     if request.method == 'POST':
         content = request.POST.get('content')
         parent_id = request.POST.get('parent_id')
-        parent = Post.objects.get(id=parent_id) if parent_id else None
+        parent = get_object_or_404(Post, id=parent_id, thread=thread) if parent_id else None
         Post.objects.create(thread=thread, author=request.user, content=content, parent=parent)
         return redirect(thread.get_absolute_url())
 
     return render(request, 'forum/thread_detail.html', {'thread': thread, 'category': thread.category})
 
+@cache_anonymous_page('thread', slug_kwarg='thread_slug')
+def post_replies(request, thread_slug, pk):
+    subtree_root = get_object_or_404(Post.objects.select_related('thread'), pk=pk, thread__slug=thread_slug)
+    post = load_subtree(subtree_root, get_reply_orderings(request), thread_max_depth())
+
+    if request.user.is_authenticated:
+        liked_posts = set(PostLike.objects.filter(user=request.user, post__path__startswith=post.path).values_list('post_id', flat=True))
+    else:
+        liked_posts = set()
+
+    return render(request, 'forum/post_replies.html', {
+        'post': post,
+        'thread': subtree_root.thread,
+        'liked_posts': liked_posts,
+    })
+
+def run_search(request):
+    """Run the search described by the ``q``/``section``/``category``/``after`` query parameters."""
+    return search_forum(
+        request.GET.get('q'), section=request.GET.get('section'), category=request.GET.get('category'),
+        after=request.GET.get('after'), page_size=SEARCH_PAGE_SIZE,
+    )
+
+def search(request):
+    results, next_cursor = run_search(request)
+    query = request.GET.copy()
+    query.pop('after', None)
+    next_page_url = None
+    if next_cursor:
+        query['after'] = next_cursor
+        next_page_url = f'?{query.urlencode()}'
+
+    return render(request, 'forum/search.html', {
+        'query': request.GET.get('q', ''),
+        'section': request.GET.get('section', ''),
+        'category_filter': request.GET.get('category', ''),
+        'sections': Section.objects.prefetch_related('categories'),
+        'results': results,
+        'next_page_url': next_page_url,
+    })
+
+def search_json(request):
+    results, next_cursor = run_search(request)
+    return JsonResponse({'results': results, 'next': next_cursor})
+
 def custom_login(request):
     next_url = request.GET.get('next', 'forum:forum_main')
     
@@ -219,41 +283,69 @@ def custom_logout(request):
     logout(request)
     return redirect('forum:forum_main')
 
+def inbox_querysets(user, titles_only=False):
+    """Return the ``(received, sent)`` message queries of ``user``'s inbox."""
+    messages_received = (
+        PrivateMessage.objects.filter(deliveries__recipient=user)
+        .annotate(read_at=F('deliveries__read_at'))
+        .select_related('sender')
+        .order_by('-timestamp', '-id')
+    )
+    messages_sent = (
+        PrivateMessage.objects.filter(sender=user)
+        .prefetch_related('recipients')
+        .order_by('-timestamp', '-id')
+    )
+    if titles_only:
+        messages_received = messages_received.defer('encrypted_content')
+        messages_sent = messages_sent.defer('encrypted_content')
+    return messages_received, messages_sent
+
+def decrypt_previews(messages):
+    """
+    Decrypt only as much of each message as the inbox preview needs (one
+    extra character lets truncatechars add "…").
+    """
+    for message in messages:
+        message.content = message.decrypt(max_chars=INBOX_PREVIEW_CHARS + 1)
+
 @login_required(login_url='/forum/')
 def inbox(request):
-    messages_received = PrivateMessage.objects.filter(recipients=request.user)
-    messages_sent = PrivateMessage.objects.filter(sender=request.user)
-    unread_messages = messages_received.filter(read=False)
-    
-    for message in messages_received:
-        message.content = message.decrypt()
-    
-    for message in messages_sent:
-        message.content = message.decrypt()
-    
+    titles_only = request.GET.get('view') == 'titles'
+    messages_received, messages_sent = inbox_querysets(request.user, titles_only)
+    received_page = Paginator(messages_received, INBOX_PAGE_SIZE).get_page(request.GET.get('received_page'))
+    sent_page = Paginator(messages_sent, INBOX_PAGE_SIZE).get_page(request.GET.get('sent_page'))
+
+    # Only the messages shown on this page are decrypted.
+    if not titles_only:
+        decrypt_previews(chain(received_page, sent_page))
+
     return render(request, 'forum/inbox.html', {
-        'messages_received': messages_received,
-        'messages_sent': messages_sent,
-        'unread_count': unread_messages.count(),
+        'messages_received': received_page,
+        'messages_sent': sent_page,
+        'titles_only': titles_only,
     })
 
+def unread_count(request):
+    count = PrivateMessage.unread_count_for(request.user) if request.user.is_authenticated else 0
+    return JsonResponse({'unread_count': count})
+
 @login_required(login_url='/forum/')
 def message_detail(request, pk):
-    message = get_object_or_404(PrivateMessage, pk=pk)
+    message = get_object_or_404(PrivateMessage.objects.select_related('sender'), pk=pk)
+    is_recipient = message.deliveries.filter(recipient=request.user).exists()
 
-    if request.user not in message.recipients.all() and request.user != message.sender:
+    if not is_recipient and request.user != message.sender:
         return HttpResponse('Unauthorized', status=401)
 
-    if request.user in message.recipients.all():
-        message.mark_as_read()
+    if is_recipient:
+        message.mark_as_read(request.user)
 
     message.content = message.decrypt()
 
-    unread_count = PrivateMessage.objects.filter(recipients=request.user, read=False).count()
-
     return render(request, 'forum/message_detail.html', {
         'message': message,
-        'unread_count': unread_count,
+        'is_recipient': is_recipient,
     })
 
 @login_required(login_url='/forum/')
@@ -275,14 +367,26 @@ def send_message(request, username=None):
     else:
         form = PrivateMessageForm(initial={**initial_data, 'content': quoted_message})
 
-    unread_count = PrivateMessage.objects.filter(recipients=request.user, read=False).count()
-
     return render(request, 'forum/send_message.html', {
         'form': form,
         'username': username,
-        'unread_count': unread_count,
     })
 
 def check_key(request):
     key = os.environ.get('MESSAGE_ENCRYPTION_KEY')
     return HttpResponse(f"The encryption key is: {key}")
+
+@staff_member_required(login_url='/forum/')
+def export_dump(request):
+    """Stream the whole forum as a JSONL dump (see forum.dumps), gzipped with ``?gzip=1``."""
+    filename = f'forum-{timezone.now():%Y%m%d-%H%M%S}.jsonl'
+    if request.GET.get('gzip'):
+        content, content_type = gzip_stream(export_lines()), 'application/gzip'
+        filename += '.gz'
+    else:
+        content, content_type = encoded_chunks(export_lines()), 'application/x-ndjson; charset=utf-8'
+    if isinstance(request, ASGIRequest):
+        content = aiterate_in_thread(content)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
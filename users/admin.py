@@ -1,6 +1,11 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
+from .models import CustomUser, RequestProfile
+from .profiling import pstats_summary
 
 class CustomUserAdmin(UserAdmin):
     model = CustomUser
@@ -25,3 +30,52 @@ class CustomUserAdmin(UserAdmin):
     ordering = ('email',)
 
 admin.site.register(CustomUser, CustomUserAdmin)
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'view_name', 'status_code', 'duration_ms', 'trigger', 'user', 'downloads')
+    list_filter = ('trigger', 'view_name')
+    search_fields = ('path', 'view_name')
+    fields = ('created_at', 'method', 'path', 'view_name', 'status_code', 'duration_ms', 'trigger', 'user', 'downloads', 'summary')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/<str:extension>/', self.admin_site.admin_view(self.download),
+                 name='users_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download(self, request, pk, extension):
+        if extension not in ('pstats', 'collapsed') or not self.has_view_permission(request):
+            raise Http404
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        try:
+            return FileResponse(open(profile.file_path(extension), 'rb'), as_attachment=True,
+                                filename=f'{profile.name}.{extension}')
+        except FileNotFoundError:
+            raise Http404
+
+    @admin.display(description='Duration (ms)', ordering='duration')
+    def duration_ms(self, obj):
+        return None if obj.duration is None else round(1000 * obj.duration, 1)
+
+    @admin.display(description='Files')
+    def downloads(self, obj):
+        return format_html_join(' ', '<a href="{}">{}</a>', (
+            (reverse('admin:users_requestprofile_download', args=[obj.pk, extension]), extension)
+            for extension in ('pstats', 'collapsed')
+        ))
+
+    @admin.display(description='Top functions (cumulative time)')
+    def summary(self, obj):
+        try:
+            return format_html('<pre>{}</pre>', pstats_summary(obj.file_path('pstats')))
+        except FileNotFoundError:
+            return 'The profile file is gone.'
@@ -6,3 +6,4 @@ class UsersConfig(AppConfig):
 
     def ready(self):
         import users.signals  # Import the signals.py file to ensure signals are connected
+        import users.timing  # Time the queries of every database connection
@@ -0,0 +1,55 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import F
+from users.models import CustomUser
+from users.thumbnails import update_avatar_thumbnails
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the pre-sized variants of existing avatars (see users.thumbnails), several at a time. '
+        'Safe to re-run: users whose variants match their avatar, or whose avatar could not be read, '
+        'are skipped unless --force is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=min(8, os.cpu_count() or 1),
+                            help='Avatars processed in parallel; Pillow releases the GIL while resizing.')
+        parser.add_argument('--force', action='store_true', help='Rebuild the variants of every avatar.')
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.exclude(avatar='').exclude(avatar__isnull=True)
+        if not options['force']:
+            users = users.exclude(avatar_thumbnails_source=F('avatar'))
+        pks = list(users.values_list('pk', flat=True))
+
+        workers = max(1, min(options['workers'], len(pks)))
+        if workers == 1:
+            failures = self.process(pks)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                failures = [failure for result in pool.map(self.process_in_thread, [pks[i::workers] for i in range(workers)])
+                            for failure in result]
+        for pk, error in failures:
+            self.stderr.write(f'User {pk}: {error}')
+        self.stdout.write(self.style.SUCCESS(f'Processed {len(pks) - len(failures)} avatars, {len(failures)} failed.'))
+
+    def process(self, pks):
+        """Update the variants of ``pks``; return the ``(pk, error)`` of the failures."""
+        failures = []
+        for pk in pks:
+            try:
+                if not update_avatar_thumbnails(CustomUser.objects.get(pk=pk)):
+                    failures.append((pk, 'the avatar could not be read or its variants stored (see the log)'))
+            except Exception as e:  # Nothing about one user must stop the backfill.
+                failures.append((pk, repr(e)))
+        return failures
+
+    def process_in_thread(self, pks):
+        try:
+            return self.process(pks)
+        finally:
+            connection.close()  # Each worker thread opened its own connection.
@@ -0,0 +1,50 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from users.models import CustomUser
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay Bearer-authenticated GETs against an endpoint with session-based and stateless JWT '
+        'authentication and report the queries and writes each mode costs. Runs against a throwaway '
+        'user inside a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100)
+        parser.add_argument('--path', default='/user/me/')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = CustomUser.objects.create_user(
+                email=f'benchmark-{uuid.uuid4().hex}@example.com', username=f'benchmark-{uuid.uuid4().hex[:12]}',
+            )
+            host = next((host for host in settings.ALLOWED_HOSTS if host[:1] not in ('*', '.')), 'localhost')
+            # Mobile clients send the token but never keep cookies.
+            client = Client(HTTP_HOST=host, HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+            for label, stateless in (('session', False), ('stateless', True)):
+                self.run_mode(client, label, stateless, options['path'], options['requests'])
+            transaction.set_rollback(True)
+
+    def run_mode(self, client, label, stateless, path, requests):
+        with override_settings(JWT_STATELESS_AUTH=stateless), CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(requests):
+                client.cookies.clear()
+                response = client.get(path)
+            elapsed = time.perf_counter() - started
+
+        writes = sum(query['sql'].lstrip().upper().startswith(WRITE_STATEMENTS) for query in queries)
+        self.stdout.write(
+            f'{label:>9}: HTTP {response.status_code}, {len(queries) / requests:.1f} queries and '
+            f'{writes / requests:.1f} writes per request, {1000 * elapsed / requests:.2f} ms/request'
+        )
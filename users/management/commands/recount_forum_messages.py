@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Recompute every user\'s forum_messages counter from their threads and posts in one set-based UPDATE.'
+
+    def handle(self, *args, **options):
+        updated = CustomUser.objects.recount_forum_messages()
+        self.stdout.write(self.style.SUCCESS(f'Recounted forum messages for {updated} users.'))
@@ -1,13 +1,32 @@
 # users/middleware.py
+import json
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.contrib.auth import login
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
+from .authentication import CachedJWTAuthentication
+from .profiling import RequestProfiler
+from .timing import RequestTimings, current_timings
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 class JWTAuthMiddleware(MiddlewareMixin):
+    """
+    Authenticate ``Authorization: Bearer`` requests for the Django views.
+
+    With ``JWT_STATELESS_AUTH`` (the default) a valid token only sets
+    ``request.user`` for this request. Otherwise it is exchanged for a Django
+    session through ``login()``, which writes a session row and ``last_login``
+    on every cookie-less request.
+    """
+
     def process_request(self, request):
         if request.user.is_authenticated:
             return  # User is already authenticated
@@ -15,13 +34,181 @@ class JWTAuthMiddleware(MiddlewareMixin):
         auth_header = request.META.get('HTTP_AUTHORIZATION')
         if auth_header and auth_header.startswith('Bearer '):
             token = auth_header.split('Bearer ')[1]
-            jwt_auth = JWTAuthentication()
+            jwt_auth = CachedJWTAuthentication()
 
             try:
                 validated_token = jwt_auth.get_validated_token(token)
                 user = jwt_auth.get_user(validated_token)
                 if isinstance(user, User):
-                    login(request, user)  # Establish Django session
+                    if getattr(settings, 'JWT_STATELESS_AUTH', True):
+                        request.user = request._cached_user = request._acached_user = user
+                    else:
+                        login(request, user)  # Establish Django session
             except Exception as e:
                 request.user = AnonymousUser()  # Fallback to anonymous if token invalid
 
+
+class RequestTimingMiddleware:
+    """
+    Measure each request: SQL query count and time, template render time,
+    view time and total time (see ``users.timing``). Keep it first in
+    ``MIDDLEWARE`` so the total covers the other middleware.
+
+    Staff responses get the figures in a ``Server-Timing`` header, shown by
+    the browser's network panel. Requests slower than
+    ``REQUEST_TIMING_SLOW_THRESHOLD`` seconds are logged as JSON. With
+    ``REQUEST_TIMING_CAPTURE_DUPLICATES`` queries are also fingerprinted, and
+    any run ``REQUEST_TIMING_DUPLICATE_THRESHOLD`` times or more in one
+    request (usually an N+1) is logged.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = RequestTimings(getattr(settings, 'REQUEST_TIMING_CAPTURE_DUPLICATES', False))
+        token = current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings(getattr(settings, 'REQUEST_TIMING_CAPTURE_DUPLICATES', False))
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = current_timings.get()
+        if timings is not None:
+            timings.view_started = time.perf_counter()
+
+    def finish(self, request, response, timings):
+        finished = time.perf_counter()
+        total = finished - timings.started
+        view = finished - timings.view_started if timings.view_started is not None else 0.0
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={1000 * timings.db_time:.1f};desc="{timings.queries} queries"',
+                f'tpl;dur={1000 * timings.template_time:.1f};desc="Templates"',
+                f'view;dur={1000 * view:.1f};desc="View"',
+                f'total;dur={1000 * total:.1f};desc="Total"',
+            ])
+
+        slow = total >= getattr(settings, 'REQUEST_TIMING_SLOW_THRESHOLD', 0.5)
+        duplicates = timings.duplicates(getattr(settings, 'REQUEST_TIMING_DUPLICATE_THRESHOLD', 3))
+        if slow or duplicates:
+            match = getattr(request, 'resolver_match', None)
+            record = {
+                'method': request.method,
+                'path': request.path,
+                'view': match.view_name if match else None,
+                'status': response.status_code,
+                'total_ms': round(1000 * total, 1),
+                'view_ms': round(1000 * view, 1),
+                'db_ms': round(1000 * timings.db_time, 1),
+                'template_ms': round(1000 * timings.template_time, 1),
+                'queries': timings.queries,
+            }
+            if duplicates:
+                record['duplicate_queries'] = [{'sql': sql, 'count': count} for sql, count in duplicates]
+            logger.warning(
+                '%s %s', 'slow_request' if slow else 'duplicate_queries', json.dumps(record),
+                extra={'request_timing': record},
+            )
+        return response
+
+
+def profiling_trigger(request):
+    """Why ``request`` should be profiled (see ``RequestProfile.TRIGGER_CHOICES``), or ``None``."""
+    # Cheap checks first: request.user and request.GET are only evaluated
+    # when a flag is present.
+    flagged = 'HTTP_X_PROFILE' in request.META or 'profile' in request.META.get('QUERY_STRING', '')
+    if flagged and request.user.is_staff:
+        if 'HTTP_X_PROFILE' in request.META:
+            return 'header'
+        if 'profile' in request.GET:
+            return 'query'
+    sample_rate = getattr(settings, 'REQUEST_PROFILING_SAMPLE_RATE', 0)
+    if sample_rate and random.random() < sample_rate:
+        return 'sample'
+    return None
+
+
+class RequestProfilingMiddleware:
+    """
+    Profile the request (see ``users.profiling``) when a staff member sends
+    an ``X-Profile`` header or a ``profile`` query parameter, and for a
+    random ``REQUEST_PROFILING_SAMPLE_RATE`` fraction of all requests. The
+    response names the profile in ``X-Profile-Id``; the admin lists them.
+
+    Keep it last in ``MIDDLEWARE``: it needs ``request.user``. Under WSGI the
+    whole middleware chain below it is profiled. Under ASGI the chain is
+    async, so only sync views are profiled, from ``process_view`` in the
+    executor thread that runs them. Async views are not profiled, since
+    their work is spread over the event loop and executor threads.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.get_response(request)
+        trigger = profiling_trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        with RequestProfiler() as profiler:
+            response = self.get_response(request)
+        return self.save_profile(profiler, request, response, trigger)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Django adapts this method to the handler's mode, so under ASGI it
+        # runs in the same thread-sensitive executor as sync views.
+        if not self.async_mode or iscoroutinefunction(view_func):
+            return None
+        trigger = profiling_trigger(request)
+        if trigger is None:
+            return None
+
+        with RequestProfiler() as profiler:
+            response = view_func(request, *view_args, **view_kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()  # Cover the templates too; rendering twice is a no-op.
+        return self.save_profile(profiler, request, response, trigger)
+
+    def save_profile(self, profiler, request, response, trigger):
+        if not profiler.started:
+            return response
+        match = getattr(request, 'resolver_match', None)
+        try:
+            profile = profiler.save(
+                method=request.method, path=request.get_full_path()[:2048],
+                view_name=match.view_name if match else '', status_code=response.status_code, trigger=trigger,
+                user=request.user if request.user.is_authenticated else None,
+            )
+        except Exception:
+            logger.exception('Could not save the profile of %s %s', request.method, request.path)
+        else:
+            response['X-Profile-Id'] = profile.name
+        return response
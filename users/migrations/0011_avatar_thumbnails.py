@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='avatar_large',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='users/avatars/thumbs/'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='avatar_small',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='users/avatars/thumbs/'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='avatar_thumbnails_source',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+    ]
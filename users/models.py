@@ -1,5 +1,10 @@
+import os
+
+from django.apps import apps
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -24,6 +29,18 @@ class CustomUserManager(BaseUserManager):
 
         return self.create_user(email, password, **extra_fields)
 
+    def recount_forum_messages(self):
+        """
+        Recompute ``forum_messages`` (threads + posts authored) for every user
+        in a single UPDATE. Returns the number of users updated.
+        """
+        def authored(model_name):
+            model = apps.get_model('forum', model_name)
+            counts = model.objects.filter(author=OuterRef('pk')).values('author').annotate(total=Count('id'))
+            return Coalesce(Subquery(counts.values('total')), 0)
+
+        return self.get_queryset().update(forum_messages=authored('Thread') + authored('Post'))
+
 class CustomUser(AbstractUser):
     username = models.CharField(max_length=150, unique=True)
     email = models.EmailField('email address', unique=True)
@@ -54,6 +71,11 @@ class CustomUser(AbstractUser):
 
     # Profile information
     avatar = models.ImageField(upload_to='users/avatars/', blank=True, null=True)
+    # Pre-sized copies of the avatar for pages that show many of them (see
+    # users.thumbnails), and the avatar they were made from.
+    avatar_small = models.ImageField(upload_to='users/avatars/thumbs/', blank=True, null=True, editable=False)
+    avatar_large = models.ImageField(upload_to='users/avatars/thumbs/', blank=True, null=True, editable=False)
+    avatar_thumbnails_source = models.CharField(max_length=255, blank=True, default='', editable=False)
     city = models.CharField(blank=True, null=True, max_length=255)
     bio = models.TextField(blank=True, null=True, max_length=500)
 
@@ -175,6 +197,53 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.email
 
+    @property
+    def avatar_small_url(self):
+        """URL of the small avatar, or of the original until its variants exist."""
+        return (self.avatar_small or self.avatar).url
+
+    @property
+    def avatar_large_url(self):
+        return (self.avatar_large or self.avatar).url
+
     class Meta:
         verbose_name = 'custom user'
         verbose_name_plural = 'custom users'
+
+
+class RequestProfileManager(models.Manager):
+    def trim(self, keep):
+        """Delete all but the ``keep`` newest profiles (their files go with them, see users.signals)."""
+        stale = list(self.order_by('-created_at', '-id').values_list('pk', flat=True)[keep:])
+        return self.filter(pk__in=stale).delete()
+
+
+class RequestProfile(models.Model):
+    """A profiled request; the profile itself is on disk (see users.profiling)."""
+    TRIGGER_CHOICES = [
+        ('header', 'X-Profile header'),
+        ('query', 'Query parameter'),
+        ('sample', 'Random sample'),
+    ]
+
+    name = models.CharField(max_length=64, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=2048)
+    view_name = models.CharField(max_length=255, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    duration = models.FloatField(null=True, help_text='Seconds, under the profiler.')
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    user = models.ForeignKey(CustomUser, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+
+    objects = RequestProfileManager()
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.created_at:%Y-%m-%d %H:%M:%S})'
+
+    def file_path(self, extension):
+        from .profiling import profile_dir
+        return os.path.join(profile_dir(), f'{self.name}.{extension}')
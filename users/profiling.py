@@ -0,0 +1,121 @@
+"""
+On-demand profiling of live requests (see
+``users.middleware.RequestProfilingMiddleware``).
+
+A profiled request runs under ``cProfile`` while a sampler thread records
+the request thread's stack every ``REQUEST_PROFILING_INTERVAL`` seconds.
+Both are written to ``REQUEST_PROFILING_DIR``: a ``.pstats`` file for
+``pstats`` / snakeviz and a ``.collapsed`` file (one ``frame;frame;... count``
+line per stack) for flamegraph.pl or speedscope. Only the newest
+``REQUEST_PROFILING_MAX_PROFILES`` are kept.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+
+def profile_dir():
+    return getattr(settings, 'REQUEST_PROFILING_DIR', None) or os.path.join(tempfile.gettempdir(), 'request-profiles')
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+
+
+def collapse_stack(frame):
+    """``frame``'s stack, outermost call first, in collapsed-stack notation."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler(threading.Thread):
+    """Counts the stacks seen in thread ``thread_id`` every ``interval`` seconds until ``stop()``."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='request-profiling-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return self.stacks
+
+
+class RequestProfiler:
+    """
+    Context manager profiling the current thread. ``started`` is false when
+    another profiler was already active (one at a time on Python 3.12+);
+    the request then runs unprofiled.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or getattr(settings, 'REQUEST_PROFILING_INTERVAL', 0.001)
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident(), self.interval)
+        self.started = False
+        self.duration = None
+
+    def __enter__(self):
+        try:
+            self.profile.enable()
+        except ValueError:
+            return self
+        self.started = True
+        self.sampler.start()
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.started:
+            self.profile.disable()
+            self.duration = time.perf_counter() - self._started_at
+            self.sampler.stop()
+        return False
+
+    def save(self, **fields):
+        """Write the profile files and record them as a ``RequestProfile``."""
+        from .models import RequestProfile
+
+        directory = profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        name = f'{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}'
+        self.profile.dump_stats(os.path.join(directory, f'{name}.pstats'))
+        with open(os.path.join(directory, f'{name}.collapsed'), 'w') as collapsed:
+            for stack, count in self.sampler.stacks.most_common():
+                collapsed.write(f'{stack} {count}\n')
+
+        with transaction.atomic():
+            profile = RequestProfile.objects.create(name=name, duration=self.duration, **fields)
+            RequestProfile.objects.trim(getattr(settings, 'REQUEST_PROFILING_MAX_PROFILES', 50))
+        return profile
+
+
+def pstats_summary(path, limit=30):
+    """The ``limit`` most expensive functions of a ``.pstats`` file by cumulative time, as text."""
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
@@ -41,7 +41,7 @@ class UserDetailSerializer(serializers.ModelSerializer):
             'id', 'first_name', 'last_name', 'email', 'username',
             'is_email_verified', 'subscription_status', 'subscription_start_date',
             'subscription_end_date', 'is_trial_used', 'is_auto_renewal',
-            'stripe_customer_id', 'stripe_subscription_id', 'avatar',
+            'stripe_customer_id', 'stripe_subscription_id', 'avatar', 'avatar_small', 'avatar_large',
             'city', 'bio', 'educational_status', 
             'desired_specialty'
         ]
@@ -1,14 +1,50 @@
-from django.db.models.signals import post_save
+import os
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from forum.models import Thread, Post
-from .models import CustomUser
+from .authentication import user_cache
+from .models import CustomUser, RequestProfile
+from .thumbnails import needs_thumbnails, update_avatar_thumbnails
 
 @receiver(post_save, sender=Thread)
 @receiver(post_save, sender=Post)
 def update_forum_messages(sender, instance, created, **kwargs):
     if created:
-        user = instance.author
-        thread_count = Thread.objects.filter(author=user).count()
-        post_count = Post.objects.filter(author=user).count()
-        user.forum_messages = thread_count + post_count
-        user.save()
+        CustomUser.objects.filter(pk=instance.author_id).update(forum_messages=F('forum_messages') + 1)
+
+@receiver(post_delete, sender=Thread)
+@receiver(post_delete, sender=Post)
+def decrement_forum_messages(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, CustomUser):
+        return  # The author is being deleted along with their messages.
+    CustomUser.objects.filter(pk=instance.author_id).update(forum_messages=Greatest(F('forum_messages') - 1, 0))
+
+@receiver(post_save, sender=CustomUser)
+def process_avatar(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Partial saves that leave the avatar out (e.g. last_login at login)
+    # skip it outright; for the others, comparing names costs nothing.
+    if raw or (update_fields is not None and 'avatar' not in update_fields):
+        return
+    if needs_thumbnails(instance):
+        update_avatar_thumbnails(instance)
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+
+@receiver(post_delete, sender=RequestProfile)
+def delete_profile_files(sender, instance, **kwargs):
+    paths = [instance.file_path('pstats'), instance.file_path('collapsed')]
+
+    def delete_files():
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    transaction.on_commit(delete_files)
@@ -1,5 +1,22 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from io import BytesIO, StringIO
+
+from unittest import mock
+
+from django.test import AsyncClient, TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.sessions.models import Session
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.urls import reverse
+from forum.models import Section, Category, Thread, Post
+from rest_framework_simplejwt.tokens import AccessToken
+from .authentication import UserCache, user_cache
+from .models import RequestProfile
+from .timing import RequestTimings, fingerprint
+from PIL import Image
 
 User = get_user_model()
 
@@ -49,3 +66,315 @@ class CustomUserTests(TestCase):
         self.assertIsNone(admin_user.bio)
         self.assertIsNone(admin_user.educational_status)
         self.assertIsNone(admin_user.desired_specialty)
+
+class ForumMessagesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', username='testuser', password='testpass123')
+        section = Section.objects.create(title='General')
+        self.category = Category.objects.create(title='Cardiology', section=section)
+
+    def test_counter_follows_creates_and_deletes(self):
+        thread = Thread.objects.create(title='Thread', content='Hello', category=self.category, author=self.user)
+        post = Post.objects.create(thread=thread, author=self.user, content='Reply')
+        Post.objects.create(thread=thread, author=self.user, content='Reply', parent=post)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.forum_messages, 3)
+
+        post.delete()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.forum_messages, 1)
+
+    def test_recount_forum_messages(self):
+        thread = Thread.objects.create(title='Thread', content='Hello', category=self.category, author=self.user)
+        Post.objects.create(thread=thread, author=self.user, content='Reply')
+        User.objects.update(forum_messages=0)
+
+        call_command('recount_forum_messages', stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.forum_messages, 2)
+
+
+class JWTMiddlewareTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(email='user@example.com', username='testuser', password='testpass123')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def test_stateless_requests_do_not_write(self):
+        response = self.client.get('/forum/inbox/', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Session.objects.exists())
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_login)
+
+    @override_settings(JWT_STATELESS_AUTH=False)
+    def test_session_mode_logs_in(self):
+        self.client.get('/forum/inbox/', **self.auth)
+        self.assertTrue(Session.objects.exists())
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_jwt_requests', requests=2, stdout=out)
+        session, stateless = out.getvalue().splitlines()
+        self.assertIn('0.0 writes', stateless)
+        self.assertNotIn('0.0 writes', session)
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(email='user@example.com', username='testuser', password='testpass123')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def test_resolved_users_are_served_from_the_cache(self):
+        self.client.get('/user/me/', **self.auth)
+        with self.assertNumQueries(0):
+            response = self.client.get('/user/me/', **self.auth)
+        self.assertEqual(response.json()['username'], 'testuser')
+        self.assertEqual(user_cache.stats()['misses'], 1)
+
+    def test_saving_the_user_invalidates_the_entry(self):
+        self.client.get('/user/me/', **self.auth)
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(self.client.get('/user/me/', **self.auth).json()['username'], 'renamed')
+
+    def test_staff_is_never_cached(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get('/user/me/', **self.auth)
+        self.assertEqual(user_cache.stats()['size'], 0)
+
+    def test_lru_and_ttl_bounds(self):
+        cache = UserCache(max_size=2, ttl=60)
+        for user_id in (1, 2, 3):
+            cache.set(user_id, user_id)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get('3'), 3)
+
+        cache.ttl = -1
+        cache.set(4, 4)
+        self.assertIsNone(cache.get(4))
+
+
+class RequestTimingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(email='staff@example.com', username='staff', password='pass', is_staff=True)
+        cls.user = User.objects.create_user(email='user@example.com', username='user', password='pass')
+        section = Section.objects.create(title='General')
+        category = Category.objects.create(title='Cardiology', section=section)
+        cls.thread = Thread.objects.create(title='Timed', content='Hello', category=category, author=cls.user)
+
+    def test_server_timing_is_only_sent_to_staff(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.thread.get_absolute_url())
+        metrics = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(metrics), {'db', 'tpl', 'view', 'total'})
+        self.assertRegex(metrics['db'], r'^dur=[\d.]+;desc="[1-9]\d* queries"$')
+
+        self.client.force_login(self.user)
+        self.assertNotIn('Server-Timing', self.client.get(self.thread.get_absolute_url()))
+
+    @override_settings(REQUEST_TIMING_SLOW_THRESHOLD=0)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('users.middleware', 'WARNING') as logs:
+            self.client.get(self.thread.get_absolute_url())
+        kind, record = logs.records[0].getMessage().split(' ', 1)
+        record = json.loads(record)
+        self.assertEqual(kind, 'slow_request')
+        self.assertEqual((record['view'], record['status']), ('forum:thread_detail', 200))
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertNotIn('duplicate_queries', record)
+
+    @override_settings(REQUEST_TIMING_CAPTURE_DUPLICATES=True, REQUEST_TIMING_DUPLICATE_THRESHOLD=2)
+    def test_repeated_queries_are_reported(self):
+        with self.assertNoLogs('users.middleware', 'WARNING'):
+            self.client.get(self.thread.get_absolute_url())
+
+        for index in range(3):
+            Post.objects.create(thread=self.thread, author=self.user, content=f'Post {index}')
+        # The admin change list of posts looks up each post's thread: an N+1.
+        self.client.force_login(User.objects.create_superuser(email='admin@example.com', username='admin', password='pass'))
+        with override_settings(REQUEST_TIMING_SLOW_THRESHOLD=60), self.assertLogs('users.middleware', 'WARNING') as logs:
+            self.client.get('/admin/forum/post/')
+        kind, record = logs.records[0].getMessage().split(' ', 1)
+        self.assertEqual(kind, 'duplicate_queries')
+        self.assertTrue(any(entry['count'] >= 2 for entry in json.loads(record)['duplicate_queries']))
+
+    def test_fingerprints_ignore_parameters(self):
+        self.assertEqual(
+            fingerprint('SELECT "a" FROM "t" WHERE "id" IN (%s, %s, %s) AND "b" = \'x\' LIMIT 21'),
+            'SELECT "a" FROM "t" WHERE "id" IN (...) AND "b" = ? LIMIT ?',
+        )
+        timings = RequestTimings(capture_fingerprints=True)
+        for sql in ('SELECT 1 WHERE "id" = %s', 'SELECT 1 WHERE "id" = %s', 'SELECT 2'):
+            timings.add_query(sql, 0.001)
+        self.assertEqual(timings.duplicates(2), [('SELECT ? WHERE "id" = ?', 2)])
+        self.assertEqual(timings.queries, 3)
+
+
+class RequestProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser(email='staff@example.com', username='staff', password='pass')
+        cls.user = User.objects.create_user(email='user@example.com', username='user', password='pass')
+        section = Section.objects.create(title='General')
+        category = Category.objects.create(title='Cardiology', section=section)
+        cls.thread = Thread.objects.create(title='Profiled', content='Hello', category=category, author=cls.user)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(REQUEST_PROFILING_DIR=self.directory, REQUEST_PROFILING_INTERVAL=0.0002)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_staff_trigger_profiles_the_request(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.thread.get_absolute_url(), HTTP_X_PROFILE='1')
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(response['X-Profile-Id'], profile.name)
+        self.assertEqual((profile.view_name, profile.status_code, profile.trigger, profile.user),
+                         ('forum:thread_detail', 200, 'header', self.staff))
+        with open(profile.file_path('collapsed')) as collapsed:
+            lines = collapsed.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+
+        response = self.client.get(f'/admin/users/requestprofile/{profile.pk}/change/')
+        self.assertContains(response, 'get_context_data')
+        response = self.client.get(f'/admin/users/requestprofile/{profile.pk}/download/pstats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/admin/users/requestprofile/').status_code, 200)
+
+    async def test_sync_views_are_profiled_under_asgi(self):
+        client = AsyncClient()
+        await client.aforce_login(self.staff)
+        response = await client.get(self.thread.get_absolute_url(), headers={'X-Profile': '1'})
+
+        profile = await RequestProfile.objects.aget()
+        self.assertEqual(response['X-Profile-Id'], profile.name)
+        self.assertEqual((profile.view_name, profile.status_code), ('forum:thread_detail', 200))
+
+    def test_only_staff_can_trigger(self):
+        self.client.force_login(self.user)
+        response = self.client.get(f'{self.thread.get_absolute_url()}?profile=1', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(REQUEST_PROFILING_SAMPLE_RATE=1.0, REQUEST_PROFILING_MAX_PROFILES=1)
+    def test_sampled_profiles_are_kept_in_a_ring_buffer(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(self.thread.get_absolute_url())
+        first = RequestProfile.objects.get()
+        self.assertEqual(first.trigger, 'sample')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(self.thread.get_absolute_url())
+
+        self.assertNotEqual(RequestProfile.objects.get().name, first.name)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+
+def image_upload(color='red', size=(600, 400)):
+    output = BytesIO()
+    Image.new('RGB', size, color).save(output, 'PNG')
+    return SimpleUploadedFile('avatar.png', output.getvalue(), content_type='image/png')
+
+
+class AvatarThumbnailTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(email='user@example.com', username='user', password='pass')
+
+    def test_upload_creates_content_hashed_variants(self):
+        self.user.avatar = image_upload()
+        self.user.save()
+
+        self.user.refresh_from_db()
+        for field, size in ((self.user.avatar_small, 48), (self.user.avatar_large, 128)):
+            self.assertRegex(field.name, rf'^users/avatars/thumbs/[0-9a-f]{{20}}-{size}\.webp$')
+            with Image.open(field.path) as thumbnail:
+                self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (size, size)))
+        self.assertEqual(self.user.avatar_small_url, self.user.avatar_small.url)
+
+        other = User.objects.create_user(email='other@example.com', username='other', password='pass', avatar=image_upload())
+        other.refresh_from_db()
+        self.assertEqual(other.avatar_small.name, self.user.avatar_small.name)
+
+        with mock.patch('users.thumbnails.render_thumbnails') as render:
+            self.user.save(update_fields=['last_login'])
+        render.assert_not_called()
+
+    @override_settings(REQUEST_TIMING_SLOW_THRESHOLD=60)
+    def test_unreadable_avatars_are_logged_once_and_do_not_break_logins(self):
+        self.user.avatar = image_upload()
+        self.user.save()
+        os.remove(self.user.avatar.path)
+        User.objects.filter(pk=self.user.pk).update(avatar_thumbnails_source='')
+
+        response = self.client.post(reverse('forum:custom_login'), {'username': self.user.email, 'password': 'pass'})
+        self.assertEqual(response.status_code, 302)  # Saving last_login leaves the avatar alone.
+        self.user.refresh_from_db()
+        with self.assertLogs('users.thumbnails', 'WARNING'):
+            self.user.save()
+        with self.assertNoLogs('users.thumbnails', 'WARNING'):
+            self.user.save()  # The failed avatar is recorded, not retried.
+
+        self.user.avatar = SimpleUploadedFile('broken.png', b'not an image', content_type='image/png')
+        with self.assertLogs('users.thumbnails', 'WARNING'):
+            self.user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_thumbnails_source, self.user.avatar.name)
+        self.assertFalse(self.user.avatar_small)
+        self.assertEqual(self.user.avatar_small_url, self.user.avatar.url)
+
+        out, err = StringIO(), StringIO()
+        call_command('backfill_avatar_thumbnails', workers=1, stdout=out, stderr=err)
+        self.assertIn('Processed 0 avatars, 0 failed.', out.getvalue())
+        with self.assertLogs('users.thumbnails', 'WARNING'):
+            call_command('backfill_avatar_thumbnails', workers=1, force=True, stdout=out, stderr=err)
+        self.assertIn('Processed 0 avatars, 1 failed.', out.getvalue())
+
+    def test_removing_the_avatar_removes_unshared_variants(self):
+        self.user.avatar = image_upload()
+        self.user.save()
+        path = self.user.avatar_small.path
+
+        self.user.avatar = None
+        self.user.save()
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.avatar_small)
+        self.assertFalse(os.path.exists(path))
+
+    def test_thread_pages_use_the_small_variant(self):
+        self.user.avatar = image_upload()
+        self.user.save()
+        thread = Thread.objects.create(
+            title='Avatars', content='Hello', author=self.user,
+            category=Category.objects.create(title='Cardiology', section=Section.objects.create(title='General')),
+        )
+        Post.objects.create(thread=thread, author=self.user, content='Hi')
+        response = self.client.get(thread.get_absolute_url())
+        self.assertContains(response, f'src="{self.user.avatar_small.url}"')
+        self.assertNotContains(response, f'src="{self.user.avatar.url}"')
+
+    def test_backfill_command(self):
+        self.user.avatar = image_upload()
+        self.user.save()
+        User.objects.filter(pk=self.user.pk).update(avatar_small=None, avatar_large=None, avatar_thumbnails_source='')
+
+        out = StringIO()
+        call_command('backfill_avatar_thumbnails', workers=1, stdout=out)
+        self.assertIn('Processed 1 avatars, 0 failed.', out.getvalue())
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.avatar_small.name.endswith('-48.webp'))
+        call_command('backfill_avatar_thumbnails', stdout=out)
+        self.assertIn('Processed 0 avatars', out.getvalue())
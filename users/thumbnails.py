@@ -0,0 +1,105 @@
+"""
+Pre-sized avatar variants.
+
+An uploaded avatar (up to 1 MB) is cropped to a square and encoded once per
+size in ``AVATAR_SIZES`` as WebP (JPEG where Pillow lacks WebP). The files
+are named after a hash of their content, so a URL never changes meaning and
+media servers can cache ``users/avatars/thumbs/`` for a year
+(``Cache-Control: public, max-age=31536000, immutable``).
+"""
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import Q
+from PIL import Image, ImageOps, features
+
+AVATAR_SIZES = {'small': 48, 'large': 128}
+THUMBNAIL_DIR = 'users/avatars/thumbs'
+# Missing or unreadable files (OSError covers UnidentifiedImageError and
+# storage failures), corrupt image data and oversized images.
+THUMBNAIL_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail_format():
+    preferred = getattr(settings, 'AVATAR_THUMBNAIL_FORMAT', 'WEBP')
+    return preferred if preferred != 'WEBP' or features.check('webp') else 'JPEG'
+
+
+def render_thumbnail(image, size, image_format):
+    """Encode ``image`` cropped to a ``size`` pixels square; return ``(bytes, extension)``."""
+    thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    output = io.BytesIO()
+    if image_format == 'JPEG':
+        thumbnail.convert('RGB').save(output, 'JPEG', quality=85, optimize=True, progressive=True)
+        return output.getvalue(), 'jpg'
+    thumbnail.save(output, 'WEBP', quality=80, method=6)
+    return output.getvalue(), 'webp'
+
+
+def render_thumbnails(source):
+    """Render every size of the image file ``source``: ``{variant: ContentFile}`` named by content hash."""
+    image_format = thumbnail_format()
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') and image_format == 'WEBP' else 'RGB')
+        thumbnails = {}
+        for variant, size in AVATAR_SIZES.items():
+            content, extension = render_thumbnail(image, size, image_format)
+            digest = hashlib.sha256(content).hexdigest()[:20]
+            thumbnails[variant] = ContentFile(content, name=f'{digest}-{size}.{extension}')
+    return thumbnails
+
+
+def needs_thumbnails(user):
+    return (user.avatar.name or '') != user.avatar_thumbnails_source
+
+
+def update_avatar_thumbnails(user):
+    """
+    Bring ``user``'s avatar variants in line with their avatar, saving only
+    those columns. Files already stored under the same name (identical
+    images) are reused; replaced ones are deleted unless another user still
+    points to them.
+
+    Returns ``False`` when the avatar cannot be read or the variants cannot
+    be stored. The failure is logged and the user is left without variants,
+    so pages show the original. The avatar is still recorded as the source,
+    so later saves do not retry it (``backfill_avatar_thumbnails --force``
+    does).
+    """
+    from .authentication import user_cache
+    from .models import CustomUser
+
+    old_names = {user.avatar_small.name, user.avatar_large.name} - {'', None}
+    built = True
+    if user.avatar:
+        try:
+            with user.avatar.open('rb') as source:
+                thumbnails = render_thumbnails(source)
+            for variant, thumbnail in thumbnails.items():
+                field = getattr(user, f'avatar_{variant}')
+                name = f'{THUMBNAIL_DIR}/{thumbnail.name}'
+                field.name = name if field.storage.exists(name) else field.storage.save(name, thumbnail)
+        except THUMBNAIL_ERRORS:
+            logger.warning('Could not create the avatar variants of user %s from %r.', user.pk, user.avatar.name, exc_info=True)
+            user.avatar_small = user.avatar_large = None
+            built = False
+    else:
+        user.avatar_small = user.avatar_large = None
+    user.avatar_thumbnails_source = user.avatar.name or ''
+
+    CustomUser.objects.filter(pk=user.pk).update(
+        avatar_small=user.avatar_small.name or None, avatar_large=user.avatar_large.name or None,
+        avatar_thumbnails_source=user.avatar_thumbnails_source,
+    )
+    user_cache.invalidate(user.pk)
+
+    for name in old_names - {user.avatar_small.name, user.avatar_large.name}:
+        if not CustomUser.objects.exclude(pk=user.pk).filter(Q(avatar_small=name) | Q(avatar_large=name)).exists():
+            user.avatar_small.storage.delete(name)
+    return built
@@ -0,0 +1,108 @@
+"""
+Per-request SQL and template timing, collected for
+``users.middleware.RequestTimingMiddleware``.
+
+The middleware puts a ``RequestTimings`` in ``current_timings`` for the
+duration of the request. Every database connection reports its queries to
+it through an execute wrapper, and templates rendered by
+``TimedDjangoTemplates`` report their render time. The context variable
+follows the request into ``sync_to_async`` threads, so queries run by async
+views are counted as well. Outside a request both cost one lookup.
+"""
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+current_timings = ContextVar('request_timings', default=None)
+
+# Literals and IN lists vary between otherwise identical queries.
+FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    """``sql`` with its parameters and literals replaced, to group repetitions of one query."""
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class RequestTimings:
+    """What one request spent on SQL and templates, in seconds."""
+
+    def __init__(self, capture_fingerprints=False):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.fingerprints = Counter() if capture_fingerprints else None
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        if self.fingerprints is not None:
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold):
+        """``(fingerprint, count)`` of the queries run at least ``threshold`` times, most repeated first."""
+        if not self.fingerprints:
+            return []
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+
+def record_query(execute, sql, params, many, context):
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(sql, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def install_query_timing(sender, connection, **kwargs):
+    # First in the list: connection.execute_wrapper() blocks pop the last one.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = current_timings.get()
+        if timings is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing each top-level render. Included
+    templates are part of their parent's render and are not counted twice.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
@@ -1,6 +1,6 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .views import UserRegistrationView, UserDetailView, UserProfileUpdateView
+from .views import AuthCacheStatsView, UserRegistrationView, UserDetailView, UserProfileUpdateView
 
 urlpatterns = [
     path('register/', UserRegistrationView.as_view(), name='user_registration'),
@@ -8,4 +8,5 @@ urlpatterns = [
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('me/', UserDetailView.as_view(), name='user_detail'),
     path('me/update/', UserProfileUpdateView.as_view(), name='user_profile_update'),
+    path('auth-cache/', AuthCacheStatsView.as_view(), name='auth_cache_stats'),
 ]
\ No newline at end of file
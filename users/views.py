@@ -2,8 +2,9 @@ from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from drf_spectacular.utils import extend_schema, OpenApiExample
+from .authentication import user_cache
 from .serializers import UserUpdateSerializer, UserDetailSerializer, UserRegistrationSerializer
 
 
@@ -176,3 +177,14 @@ class UserProfileUpdateView(APIView):
             serializer.save()
             return Response(UserDetailSerializer(user).data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AuthCacheStatsView(APIView):
+    """
+    API endpoint exposing the hit/miss counters of this process's JWT user cache.
+    """
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(tags=['user'], description="Hit/miss counters of the in-process JWT user cache, for tuning.")
+    def get(self, request, *args, **kwargs):
+        return Response(user_cache.stats())
@@ -0,0 +1,12 @@
+"""
+URLconf of the ASGI deployment: the routes of vimiapi.urls, with the
+forum's read-heavy pages served by native async views.
+"""
+from django.urls import include, path
+from forum.urls import async_urlpatterns, urlpatterns as forum_urlpatterns
+from .urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    path('forum/', include((async_urlpatterns + forum_urlpatterns, 'forum'))),
+    *[pattern for pattern in wsgi_urlpatterns if getattr(pattern, 'namespace', None) != 'forum'],
+]
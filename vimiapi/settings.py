@@ -33,7 +33,7 @@ AUTH_USER_MODEL = 'users.CustomUser'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -56,6 +56,7 @@ SIMPLE_JWT = {
 }
 
 MIDDLEWARE = [
+    'users.middleware.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Use Whitenoise for static file management
@@ -66,15 +67,59 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'users.middleware.JWTAuthMiddleware',
+    'users.middleware.RequestProfilingMiddleware',
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
 
-ROOT_URLCONF = 'vimiapi.urls'
+# Cached counts, trees and pages are invalidated on write, which only reaches
+# every worker through a shared cache: Redis when REDIS_URL is set (needs the
+# redis package). The local-memory fallback is per process, so the forum
+# keeps invalidated entries for at most FORUM_LOCAL_CACHE_TIMEOUT there
+# (see forum.caching).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+    }
+FORUM_LOCAL_CACHE_TIMEOUT = 30  # seconds
+
+# Per-request timing (see users.middleware.RequestTimingMiddleware): requests
+# slower than this are logged; fingerprinting repeated queries costs a regex
+# pass per query, so it is opt-in.
+REQUEST_TIMING_SLOW_THRESHOLD = float(os.environ.get('REQUEST_TIMING_SLOW_THRESHOLD', '0.5'))  # seconds
+REQUEST_TIMING_CAPTURE_DUPLICATES = os.environ.get('REQUEST_TIMING_CAPTURE_DUPLICATES', '') == 'True'
+REQUEST_TIMING_DUPLICATE_THRESHOLD = 3
+
+# On-demand profiling (see users.middleware.RequestProfilingMiddleware):
+# staff trigger it per request; a non-zero rate also profiles that fraction
+# of all requests. Profiles go to REQUEST_PROFILING_DIR (a temporary
+# directory by default), newest REQUEST_PROFILING_MAX_PROFILES kept.
+REQUEST_PROFILING_SAMPLE_RATE = float(os.environ.get('REQUEST_PROFILING_SAMPLE_RATE', '0'))
+REQUEST_PROFILING_DIR = os.environ.get('REQUEST_PROFILING_DIR')
+REQUEST_PROFILING_MAX_PROFILES = 50
+REQUEST_PROFILING_INTERVAL = 0.001  # seconds between stack samples
+
+# Bearer tokens authenticate a single request instead of opening a Django
+# session (see users.middleware.JWTAuthMiddleware).
+JWT_STATELESS_AUTH = os.environ.get('JWT_STATELESS_AUTH', 'True') == 'True'
+
+# Per-process LRU of users resolved from bearer tokens
+# (see users.authentication.CachedJWTAuthentication).
+JWT_USER_CACHE_SIZE = 1024
+JWT_USER_CACHE_TTL = 30.0  # seconds
+
+# The ASGI entry point serves the forum's read views asynchronously
+# (see vimiapi.asgi_urls).
+FORUM_ASYNC_VIEWS = os.environ.get('FORUM_ASYNC_VIEWS', '') == 'True'
+ROOT_URLCONF = 'vimiapi.asgi_urls' if FORUM_ASYNC_VIEWS else 'vimiapi.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that also reports render time to RequestTimingMiddleware.
+        'BACKEND': 'users.timing.TimedDjangoTemplates',
         'DIRS': [
             # You can include other directories here if you have custom template directories
         ],
@@ -85,6 +130,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'forum.context_processors.unread_count',
             ],
         },
     },
@@ -131,5 +177,28 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Reply levels shown on a thread page; deeper replies load on demand
+# through "Show more replies" (see forum.views.post_replies).
+FORUM_THREAD_MAX_DEPTH = 3
+
+# Buffer like/unlike counter updates in memory and write them in batches
+# (see forum.likes.LikeCountBuffer). Useful when a post goes viral.
+FORUM_COALESCE_LIKES = os.environ.get('FORUM_COALESCE_LIKES', '') == 'True'
+FORUM_LIKE_FLUSH_INTERVAL = 5.0  # seconds
+
+# Upper bound on how long anonymous thread/category pages stay in the cache
+# (see forum.page_cache); writes invalidate them immediately. Pages are only
+# cached with a shared cache (REDIS_URL above).
+FORUM_PAGE_CACHE = os.environ.get('FORUM_PAGE_CACHE', 'True') == 'True'
+FORUM_PAGE_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Pub/sub behind the live thread event streams (see forum.events). The local
+# broker only reaches readers connected to the same process.
+FORUM_EVENT_BROKER = 'forum.events.LocalBroker'
+
+# Encoding of the pre-sized avatar variants (see users.thumbnails); JPEG is
+# used instead when Pillow was built without WebP.
+AVATAR_THUMBNAIL_FORMAT = 'WEBP'
+
 # Activate Django-Heroku settings
 django_heroku.settings(locals())
\ No newline at end of file